@@ -205,6 +205,7 @@ if [ ${stage} -le 4 ]; then
     if [ ! -z "${aug_path}" ] && [ ${aug_use} == true ]; then
       echo "updating ${feat_tr_dir}/data.json with augmenting data"
       add2json.py -a ${aug_path} -d ${dict} -j ${feat_tr_dir}/data.json
+      json2augindex.py ${feat_tr_dir}/data.json ${feat_tr_dir}/aug_index
     else
       echo "skipping data augmentation..."
     fi
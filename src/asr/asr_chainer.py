@@ -12,6 +12,7 @@ import math
 import os
 import pickle
 import six
+import time
 
 # chainer related
 import chainer
@@ -23,15 +24,23 @@ from chainer.training import extensions
 
 # espnet related
 from asr_utils import adadelta_eps_decay
+from asr_utils import attach_token_arrays
+from asr_utils import BackgroundWriter
 from asr_utils import CompareValueTrigger
 from asr_utils import converter_kaldi
 from asr_utils import delete_feat
-from asr_utils import make_batchset
+from asr_utils import load_kaldi_batch
+from asr_utils import make_feat_iterator
+from asr_utils import PrefetchBatchIterator
+from asr_utils import PrefetchIterator
+from asr_utils import report_io_wait
 from asr_utils import restore_snapshot
 from e2e_asr_attctc import E2E
 from e2e_asr_attctc import Loss
 
 # for kaldi io
+from fbank import WavFbankDict
+from feat_transform import make_transform
 import kaldi_io_py
 import lazy_io
 
@@ -89,10 +98,14 @@ class ChainerSeqEvaluaterKaldi(extensions.Evaluator):
 class ChainerSeqUpdaterKaldi(training.StandardUpdater):
     '''Custom updater with Kaldi reader for chainer'''
 
-    def __init__(self, train_iter, optimizer, reader, device):
+    def __init__(self, train_iter, optimizer, reader, device, n_prefetch=0, n_workers=1):
+        if n_prefetch > 0:
+            train_iter = PrefetchBatchIterator(
+                train_iter, lambda batch: [load_kaldi_batch(batch[0], reader)], n_prefetch, n_workers)
         super(ChainerSeqUpdaterKaldi, self).__init__(
             train_iter, optimizer, device=device)
         self.reader = reader
+        self.prefetch = n_prefetch > 0
 
     # The core part of the update routine can be customized by overriding.
     def update_core(self):
@@ -108,7 +121,11 @@ class ChainerSeqUpdaterKaldi(training.StandardUpdater):
         # x: original json with loaded features
         #    will be converted to chainer variable later
         # batch only has one minibatch utterance, which is specified by batch[0]
-        x = converter_kaldi(batch[0], self.reader)
+        if self.prefetch:
+            # features have already been read in the background
+            x = batch[0]
+        else:
+            x = converter_kaldi(batch[0], self.reader)
 
         # Compute the loss at this time step and accumulate it
         loss = optimizer.target(x)
@@ -166,10 +183,11 @@ def train(args):
         logging.warning('cudnn is not available')
 
     # get input and output dimension info
-    with open(args.valid_label, 'rb') as f:
-        valid_json = json.load(f)['utts']
+    valid_json = lazy_io.read_label(args.valid_label)
     utts = list(valid_json.keys())
     idim = int(valid_json[utts[0]]['idim'])
+    # deltas computed on the fly are not included in the json
+    idim *= args.delta_order + 1
     odim = int(valid_json[utts[0]]['odim'])
     logging.info('#input dims : ' + str(idim))
     logging.info('#output dims: ' + str(odim))
@@ -209,30 +227,25 @@ def train(args):
     optimizer.setup(model)
     optimizer.add_hook(chainer.optimizer.GradientClipping(args.grad_clip))
 
-    # read json data
-    with open(args.train_label, 'rb') as f:
-        train_json = json.load(f)['utts']
-    with open(args.valid_label, 'rb') as f:
-        valid_json = json.load(f)['utts']
-
-    # make minibatch list (variable length)
-    train = make_batchset(train_json, args.batch_size,
-                          args.maxlen_in, args.maxlen_out, args.minibatches)
-    valid = make_batchset(valid_json, args.batch_size,
-                          args.maxlen_in, args.maxlen_out, args.minibatches)
-    # hack to make batchsze argument as 1
-    # actual bathsize is included in a list
-    train_iter = chainer.iterators.SerialIterator(train, 1)
-    valid_iter = chainer.iterators.SerialIterator(
-        valid, 1, repeat=False, shuffle=False)
-
-    # prepare Kaldi reader
-    train_reader = lazy_io.read_dict_scp(args.train_feat)
-    valid_reader = lazy_io.read_dict_scp(args.valid_feat)
+    # read json data (or manifests made by json2manifest.py)
+    train_json = lazy_io.read_label(args.train_label)
+    valid_json = lazy_io.read_label(args.valid_label)
+
+    # token ids are parsed once instead of every minibatch (a manifest has them as an array)
+    for utts in (train_json, valid_json):
+        if not isinstance(utts, lazy_io.Manifest):
+            attach_token_arrays(utts.values())
+
+    # apply CMVN and deltas on the fly instead of dumping the features
+    transform = make_transform(args.cmvn, args.utt2spk, bool(args.norm_vars), args.delta_order)
+    # minibatch iterators and Kaldi readers (or feature store readers, or None for the shards)
+    train_iter, train_reader = make_feat_iterator(args.train_feat, train_json, args, transform, train=True)
+    valid_iter, valid_reader = make_feat_iterator(args.valid_feat, valid_json, args, transform, train=False)
 
     # Set up a trainer
     updater = ChainerSeqUpdaterKaldi(
-        train_iter, optimizer, train_reader, gpu_id)
+        train_iter, optimizer, train_reader, gpu_id,
+        args.prefetch_batches, args.prefetch_workers)
     trainer = training.Trainer(
         updater, (args.epochs, 'epoch'), out=args.outdir)
 
@@ -292,6 +305,11 @@ def train(args):
             'eps', lambda trainer: trainer.updater.get_optimizer('main').eps),
             trigger=(100, 'iteration'))
         report_keys.append('eps')
+    for name, reader in [('train_cache_hit', train_reader), ('valid_cache_hit', valid_reader)]:
+        if isinstance(reader, lazy_io.FeatCache):
+            trainer.extend(extensions.observe_value(
+                name, lambda trainer, reader=reader: reader.hit_rate()), trigger=(100, 'iteration'))
+            report_keys.append(name)
     trainer.extend(extensions.PrintReport(
         report_keys), trigger=(100, 'iteration'))
 
@@ -299,6 +317,9 @@ def train(args):
 
     # Run the training
     trainer.run()
+    for name, reader in [('train', train_reader), ('valid', valid_reader)]:
+        if isinstance(reader, lazy_io.FeatCache):
+            logging.info('%s feature cache: %s' % (name, reader))
 
 
 def recog(args):
@@ -331,22 +352,24 @@ def recog(args):
     else:
         rnnlm = None
 
-    # prepare Kaldi reader
-    reader = kaldi_io_py.read_mat_ark(args.recog_feat)
+    # prepare Kaldi reader (features are read ahead in a background thread)
+    if args.recog_feat.startswith('wav:'):
+        reader = WavFbankDict(args.recog_feat[len('wav:'):], cache_dir=args.fbank_cache).items()
+    else:
+        reader = kaldi_io_py.read_mat_ark(args.recog_feat)
+    transform = make_transform(args.cmvn, args.utt2spk, bool(args.norm_vars), args.delta_order)
+    if transform is not None:
+        reader = ((name, transform(feat, name)) for name, feat in reader)
+    if args.read_ahead > 0:
+        reader = PrefetchIterator(reader, args.read_ahead)
 
-    # read json data
-    with open(args.recog_label, 'rb') as f:
-        recog_json = json.load(f)['utts']
+    # read json data (or a manifest made by json2manifest.py)
+    recog_json = lazy_io.read_label(args.recog_label)
 
     new_json = {}
-    for name, feat in reader:
-        logging.info('decoding ' + name)
-        if args.beam_size == 1:
-            y_hat = e2e.recognize(feat, args, train_args.char_list, rnnlm)
-        else:
-            nbest_hyps = e2e.recognize(feat, args, train_args.char_list, rnnlm)
-            # get 1best and remove sos
-            y_hat = nbest_hyps[0]['yseq'][1:]
+
+    def add_result(result):
+        name, y_hat, nbest_hyps = result
         y_true = map(int, recog_json[name]['tokenid'].split())
 
         # print out decoding result
@@ -367,7 +390,7 @@ def recog(args):
         new_json[name]['rec_text'] = seq_hat_text
 
         # add n-best recognition results with scores
-        if args.beam_size > 1 and len(nbest_hyps) > 1:
+        if nbest_hyps is not None and len(nbest_hyps) > 1:
             for i, hyp in enumerate(nbest_hyps):
                 y_hat = hyp['yseq'][1:]
                 seq_hat = [train_args.char_list[int(idx)] for idx in y_hat]
@@ -378,6 +401,22 @@ def recog(args):
                 new_json[name]['rec_text' + '[' + '{:05d}'.format(i) + ']'] = seq_hat_text
                 new_json[name]['score' + '[' + '{:05d}'.format(i) + ']'] = hyp['score']
 
+    # results are formatted and logged in a background thread
+    writer = BackgroundWriter(add_result)
+    start_time = time.time()
+    for name, feat in reader:
+        logging.info('decoding ' + name)
+        nbest_hyps = None
+        if args.beam_size == 1:
+            y_hat = e2e.recognize(feat, args, train_args.char_list, rnnlm)
+        else:
+            nbest_hyps = e2e.recognize(feat, args, train_args.char_list, rnnlm)
+            # get 1best and remove sos
+            y_hat = nbest_hyps[0]['yseq'][1:]
+        writer.put((name, y_hat, nbest_hyps))
+    writer.close()
+    report_io_wait(reader, writer, time.time() - start_time)
+
     # TODO(watanabe) fix character coding problems when saving it
     with open(args.result_label, 'wb') as f:
         f.write(json.dumps({'utts': new_json}, indent=4, sort_keys=True).encode('utf_8'))
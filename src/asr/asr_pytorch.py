@@ -11,6 +11,7 @@ import math
 import os
 import pickle
 import random
+import time
 
 # chainer related
 import chainer
@@ -18,21 +19,40 @@ from chainer import reporter as reporter_module
 from chainer import training
 from chainer.training import extensions
 
+import six
 import torch
 
 # spnet related
 from asr_utils import adadelta_eps_decay
+from asr_utils import attach_token_arrays
+from asr_utils import BackgroundWriter
+from asr_utils import check_request_feat
+from asr_utils import check_request_file
 from asr_utils import CompareValueTrigger
 from asr_utils import converter_augment
+from asr_utils import converter_augment_index
 from asr_utils import converter_kaldi
 from asr_utils import delete_feat
+from asr_utils import DynamicBatcher
+from asr_utils import InterleavedBatchIterator
+from asr_utils import load_kaldi_batch
 from asr_utils import make_augment_batchset
-from asr_utils import make_batchset
+from asr_utils import make_feat_iterator
+from asr_utils import make_recog_server
+from asr_utils import PrefetchBatchIterator
+from asr_utils import PrefetchIterator
+from asr_utils import report_io_wait
 from asr_utils import restore_snapshot
 from e2e_asr_attctc_th import E2E
 from e2e_asr_attctc_th import Loss
+from e2e_asr_attctc_th import quantize_dynamic
+from e2e_asr_export_th import export as export_traced
+from e2e_asr_export_th import ExportedE2E
+from e2e_asr_stream_th import StreamingRecognizer
 
 # for kaldi io
+from fbank import WavFbankDict
+from feat_transform import make_transform
 import kaldi_io_py
 import lazy_io
 
@@ -88,11 +108,16 @@ class PytorchSeqEvaluaterKaldi(extensions.Evaluator):
 class PytorchSeqUpdaterKaldi(training.StandardUpdater):
     '''Custom updater with Kaldi reader for pytorch'''
 
-    def __init__(self, model, grad_clip_threshold, train_iter, optimizer, reader, device):
+    def __init__(self, model, grad_clip_threshold, train_iter, optimizer, reader, device,
+                 n_prefetch=0, n_workers=1):
+        if n_prefetch > 0:
+            train_iter = PrefetchBatchIterator(
+                train_iter, lambda batch: [load_kaldi_batch(batch[0], reader)], n_prefetch, n_workers)
         super(PytorchSeqUpdaterKaldi, self).__init__(
             train_iter, optimizer, device=None)
         self.model = model
         self.reader = reader
+        self.prefetch = n_prefetch > 0
         self.grad_clip_threshold = grad_clip_threshold
 
     # The core part of the update routine can be customized by overriding.
@@ -109,7 +134,11 @@ class PytorchSeqUpdaterKaldi(training.StandardUpdater):
         # x: original json with loaded features
         #    will be converted to chainer variable later
         # batch only has one minibatch utterance, which is specified by batch[0]
-        x = converter_kaldi(batch[0], self.reader)
+        if self.prefetch:
+            # features have already been read in the background
+            x = batch[0]
+        else:
+            x = converter_kaldi(batch[0], self.reader)
 
         # Compute the loss at this time step and accumulate it
         loss = self.model(x)
@@ -128,38 +157,53 @@ class PytorchSeqUpdaterKaldi(training.StandardUpdater):
 
 
 class PytorchSeqUpdaterKaldiWithAugment(PytorchSeqUpdaterKaldi):
-    '''Custom updated for kaldi reader with augment data support'''
+    '''Custom updated for kaldi reader with augment data support
+
+    The audio and augmenting minibatches are scheduled (and prefetched) by InterleavedBatchIterator.
+    '''
 
     def __init__(self, model, grad_clip_threshold, train_iter,
-                 train_augment_iter, augment_metadata, augment_ratio, optimizer, reader, device):
-        super(PytorchSeqUpdaterKaldiWithAugment, self).__init__(model, grad_clip_threshold,
-                                                                train_iter, optimizer, reader, device=None)
+                 train_augment_iter, augment_metadata, augment_ratio, optimizer, reader, device,
+                 n_prefetch=0, n_workers=1):
         self.augment_metadata = augment_metadata
-        self.train_augment_iter = train_augment_iter
-        self.a2a_ratio = augment_ratio   # int(self.augment_metadata['a2a_ratio'])
-        self.done_augment = 0
         self.idict = self.augment_metadata['idict']
         self.odict = self.augment_metadata['odict']
-        self.ifile = open(self.augment_metadata['ifilename'], 'r')
-        self.ofile = open(self.augment_metadata['ofilename'], 'r')
+        if self.augment_metadata['index'] is not None:
+            # token arrays made by json2augindex.py
+            self.augment_index = lazy_io.AugmentIndex(self.augment_metadata['index'])
+        else:
+            self.augment_index = None
+            self.ifile = open(self.augment_metadata['ifilename'], 'r')
+            self.ofile = open(self.augment_metadata['ofilename'], 'r')
+        train_iter = InterleavedBatchIterator(train_iter, train_augment_iter,
+                                              lambda batch: load_kaldi_batch(batch[0], reader),
+                                              self.load_augment_batch, augment_ratio, n_prefetch, n_workers)
+        super(PytorchSeqUpdaterKaldiWithAugment, self).__init__(model, grad_clip_threshold,
+                                                                train_iter, optimizer, reader, device=None)
+
+    def load_augment_batch(self, batch):
+        # the sentence dicts are copied as load_kaldi_batch (they may be loaded in the background)
+        batch = [(data[0], dict(data[1])) for data in batch[0]]
+        if self.augment_index is not None:
+            return converter_augment_index(batch, self.augment_index)
+        return converter_augment(batch, self.idict, self.odict, self.ifile, self.ofile)
+
+    def finalize(self):
+        '''Finalize the iterators and close the augmenting text files (called at the end of trainer.run)'''
+        super(PytorchSeqUpdaterKaldiWithAugment, self).finalize()
+        if self.augment_index is None:
+            self.ifile.close()
+            self.ofile.close()
 
     def update_core(self,):
         train_iter = self.get_iterator('main')
         optimizer = self.get_optimizer('main')
-        if (self.done_augment >= self.a2a_ratio):  # TODO(arendu): need a better way to switch between audio and augment
-            batch = train_iter.__next__()
-            # print(train_iter.is_new_epoch)
-            logging.info('audio batch, new_epoch:' + str(train_iter.is_new_epoch))
-            x = converter_kaldi(batch[0], self.reader)
-            self.done_augment = 0
-            is_aug = False
-        else:
-            batch = self.train_augment_iter.__next__()
-            # print(self.train_augment_iter.is_new_epoch)
-            logging.info('augment batch, new_epoch:' + str(train_iter.is_new_epoch))
-            x = converter_augment(batch[0], self.idict, self.odict, self.ifile, self.ofile)
-            self.done_augment += 1
-            is_aug = True
+        x, is_aug = train_iter.__next__()
+        logging.info(('augment' if is_aug else 'audio') + ' batch, new_epoch:' + str(train_iter.is_new_epoch))
+        # throughput of the audio and augmenting minibatches
+        reporter_module.report(train_iter.throughput())
+        if train_iter.is_new_epoch:
+            logging.info(str(train_iter))
 
         # Compute the loss at this time step and accumulate it
         loss = self.model(x, is_aug=is_aug)
@@ -172,7 +216,7 @@ class PytorchSeqUpdaterKaldiWithAugment(PytorchSeqUpdaterKaldi):
         logging.info('grad norm={}'.format(grad_norm))
         if math.isnan(grad_norm):
             logging.warning('grad norm is nan. Do not update model.')
-            logging.warning(str(batch[0]))
+            logging.warning(str([data[0] for data in x]))
         else:
             optimizer.step()
         delete_feat(x)
@@ -203,31 +247,40 @@ def train(args):
         logging.warning('cuda is not available')
 
     # get input and output dimension info
-    with open(args.valid_label, 'rb') as f:
-        valid_json = json.load(f)['utts']
+    valid_json = lazy_io.read_label(args.valid_label)
     utts = list(valid_json.keys())
     idim = int(valid_json[utts[0]]['idim'])
+    # deltas computed on the fly are not included in the json
+    idim *= args.delta_order + 1
     odim = int(valid_json[utts[0]]['odim'])
     logging.info('#input dims : ' + str(idim))
     logging.info('#output dims: ' + str(odim))
-    # read json data
-    with open(args.train_label, 'rb') as f:
-        data_json = json.load(f)
-        train_json = data_json['utts']
-        if 'aug' in data_json:
-            augment_json = data_json['aug']
-            augment_idim = len(augment_json['idict'])
-        else:
-            augment_json = None
-            augment_idim = 0
+    # read json data (or a manifest made by json2manifest.py, which has no augment data)
+    if os.path.isdir(args.train_label):
+        train_json = lazy_io.Manifest(args.train_label)
+        augment_json = None
+        augment_idim = 0
+    else:
+        with open(args.train_label, 'rb') as f:
+            data_json = json.load(f)
+            train_json = data_json['utts']
+            if 'aug' in data_json:
+                augment_json = data_json['aug']
+                augment_idim = len(augment_json['idict'])
+            else:
+                augment_json = None
+                augment_idim = 0
 
     if args.train_reduce_factor < 1.0:
         logging.warning("reducing the data used for training")
         remove_num = int(len(train_json.keys()) * (1.0 - args.train_reduce_factor))
         train_keys = sorted(list(train_json.keys()))
         random.Random(1234).shuffle(train_keys)
-        for tk in train_keys[:remove_num]:  # in range(remove_num):
-            train_json.pop(tk)  # random.choice(train_json.keys()))
+        if isinstance(train_json, lazy_io.Manifest):
+            train_json = train_json.subset(sorted(train_keys[remove_num:]))
+        else:
+            for tk in train_keys[:remove_num]:  # in range(remove_num):
+                train_json.pop(tk)  # random.choice(train_json.keys()))
         logging.warning("train instances now:" + str(len(train_json.keys())))
     # specify model architecture
     e2e = E2E(idim, odim, args, augment_idim=augment_idim)
@@ -262,19 +315,16 @@ def train(args):
     setattr(optimizer, "target", model.reporter)
     setattr(optimizer, "serialize", lambda s: model.reporter.serialize(s))
 
-    train = make_batchset(train_json, args.batch_size,
-                          args.maxlen_in, args.maxlen_out, args.minibatches)
-    valid = make_batchset(valid_json, args.batch_size,
-                          args.maxlen_in, args.maxlen_out, args.minibatches)
-    # hack to make batchsze argument as 1
-    # actual bathsize is included in a list
-    train_iter = chainer.iterators.SerialIterator(train, 1)
-    valid_iter = chainer.iterators.SerialIterator(
-        valid, 1, repeat=False, shuffle=False)
+    # token ids are parsed once instead of every minibatch (a manifest has them as an array)
+    for utts in (train_json, valid_json):
+        if not isinstance(utts, lazy_io.Manifest):
+            attach_token_arrays(utts.values())
 
-    # prepare Kaldi reader
-    train_reader = lazy_io.read_dict_scp(args.train_feat)
-    valid_reader = lazy_io.read_dict_scp(args.valid_feat)
+    # apply CMVN and deltas on the fly instead of dumping the features
+    transform = make_transform(args.cmvn, args.utt2spk, bool(args.norm_vars), args.delta_order)
+    # minibatch iterators and Kaldi readers (or feature store readers, or None for the shards)
+    train_iter, train_reader = make_feat_iterator(args.train_feat, train_json, args, transform, train=True)
+    valid_iter, valid_reader = make_feat_iterator(args.valid_feat, valid_json, args, transform, train=False)
 
     if augment_json is not None:
         train_augment, meta = make_augment_batchset(augment_json, args.batch_size,
@@ -283,7 +333,10 @@ def train(args):
                                                     args.minibatches)
         assert args.augment_ratio > 0
         if args.augment_limit:
-            lim = int(len(train) * float(args.augment_ratio))
+            # the number of minibatches of the shards is estimated from the number of utterances
+            n_batches = len(train_iter.dataset) if train_reader is not None \
+                else int(math.ceil(train_iter.n_utts / float(args.batch_size)))
+            lim = int(n_batches * float(args.augment_ratio))
             assert lim > 0
             train_augment = train_augment[:lim]
         train_augment_iter = chainer.iterators.SerialIterator(train_augment, 1)
@@ -295,14 +348,17 @@ def train(args):
                                                     args.augment_ratio,
                                                     optimizer,
                                                     train_reader,
-                                                    gpu_id)
+                                                    gpu_id,
+                                                    args.prefetch_batches,
+                                                    args.prefetch_workers)
         trainer = training.Trainer(updater,
                                    (args.epochs, 'epoch'),
                                    out=args.outdir)
     else:
         # Set up a trainer
         updater = PytorchSeqUpdaterKaldi(
-            model, args.grad_clip, train_iter, optimizer, train_reader, gpu_id)
+            model, args.grad_clip, train_iter, optimizer, train_reader, gpu_id,
+            args.prefetch_batches, args.prefetch_workers)
         trainer = training.Trainer(
             updater, (args.epochs, 'epoch'), out=args.outdir)
 
@@ -370,6 +426,11 @@ def train(args):
             'eps', lambda trainer: trainer.updater.get_optimizer('main').param_groups[0]["eps"]),
             trigger=(100, 'iteration'))
         report_keys.append('eps')
+    for name, reader in [('train_cache_hit', train_reader), ('valid_cache_hit', valid_reader)]:
+        if isinstance(reader, lazy_io.FeatCache):
+            trainer.extend(extensions.observe_value(
+                name, lambda trainer, reader=reader: reader.hit_rate()), trigger=(100, 'iteration'))
+            report_keys.append(name)
     trainer.extend(extensions.PrintReport(
         report_keys), trigger=(100, 'iteration'))
 
@@ -377,9 +438,42 @@ def train(args):
 
     # Run the training
     trainer.run()
-    if isinstance(updater, PytorchSeqUpdaterKaldiWithAugment):
-        updater.ifile.close()
-        updater.ofile.close()
+    for name, reader in [('train', train_reader), ('valid', valid_reader)]:
+        if isinstance(reader, lazy_io.FeatCache):
+            logging.info('%s feature cache: %s' % (name, reader))
+
+
+def load_e2e(model_file, idim, odim, train_args):
+    '''Build E2E model from the training config and load its parameters'''
+    if os.path.isdir(train_args.train_label):
+        # a manifest has no augment data
+        augment_idim = 0
+    else:
+        with open(train_args.train_label, 'rb') as f:
+            data_json = json.load(f)
+            if 'aug' in data_json:
+                augment_idim = len(data_json['aug']['idict'])
+            else:
+                augment_idim = 0
+    e2e = E2E(idim, odim, train_args, augment_idim=augment_idim)
+    model = Loss(e2e, train_args.mtlalpha)
+
+    def cpu_loader(storage, location):
+        return storage
+    model.load_state_dict(torch.load(model_file, map_location=cpu_loader))
+    return e2e
+
+
+def export(args):
+    '''Export traced modules for recognition'''
+    # read training config
+    with open(args.model_conf, "rb") as f:
+        logging.info('reading a model config file from' + args.model_conf)
+        idim, odim, train_args = pickle.load(f)
+
+    logging.info('reading model parameters from' + args.model)
+    e2e = load_e2e(args.model, idim, odim, train_args)
+    export_traced(e2e, idim, args.outdir)
 
 
 def recog(args):
@@ -396,46 +490,58 @@ def recog(args):
         logging.info('ARGS: ' + key + ': ' + str(vars(args)[key]))
 
     # specify model architecture
-    logging.info('reading model parameters from' + args.model)
-    with open(train_args.train_label, 'rb') as f:
-        data_json = json.load(f)
-        if 'aug' in data_json:
-            augment_json = data_json['aug']
-            augment_idim = len(augment_json['idict'])
-        else:
-            augment_json = None
-            augment_idim = 0
-    e2e = E2E(idim, odim, train_args, augment_idim=augment_idim)
-    model = Loss(e2e, train_args.mtlalpha)
+    if args.exported_model:
+        logging.info('reading exported modules from ' + args.exported_model)
+        e2e = ExportedE2E(args.exported_model)
+    else:
+        logging.info('reading model parameters from' + args.model)
+        e2e = load_e2e(args.model, idim, odim, train_args)
+        if args.quantize:
+            logging.info('apply %s dynamic quantization to the model' % args.quantize)
+            e2e = quantize_dynamic(e2e, args.quantize)
 
     def cpu_loader(storage, location):
         return storage
-    model.load_state_dict(torch.load(args.model, map_location=cpu_loader))
 
     # read rnnlm
     if args.rnnlm:
         rnnlm = lm_pytorch.ClassifierWithState(
             lm_pytorch.RNNLM(len(train_args.char_list), 650))
         rnnlm.load_state_dict(torch.load(args.rnnlm, map_location=cpu_loader))
+        if args.quantize:
+            logging.info('apply %s dynamic quantization to the rnnlm' % args.quantize)
+            rnnlm = quantize_dynamic(rnnlm, args.quantize)
     else:
         rnnlm = None
 
-    # prepare Kaldi reader
-    reader = kaldi_io_py.read_mat_ark(args.recog_feat)
-
-    # read json data
-    with open(args.recog_label, 'rb') as f:
-        recog_json = json.load(f)['utts']
+    # prepare Kaldi reader (features are read ahead in a background thread)
+    if args.recog_feat.startswith('wav:'):
+        reader = WavFbankDict(args.recog_feat[len('wav:'):], cache_dir=args.fbank_cache).items()
+    else:
+        reader = kaldi_io_py.read_mat_ark(args.recog_feat)
+    transform = make_transform(args.cmvn, args.utt2spk, bool(args.norm_vars), args.delta_order)
+    if transform is not None:
+        reader = ((name, transform(feat, name)) for name, feat in reader)
+    if args.read_ahead > 0:
+        reader = PrefetchIterator(reader, args.read_ahead)
+
+    # read json data (or a manifest made by json2manifest.py)
+    recog_json = lazy_io.read_label(args.recog_label)
+
+    # streaming recognition only uses CTC
+    if args.chunk_size > 0:
+        if train_args.mtlalpha == 0.0:
+            raise ValueError('streaming recognition requires a model trained with CTC (mtlalpha > 0).')
+        if rnnlm is not None:
+            logging.warning('rnnlm is not used in streaming recognition')
+        logging.info('streaming recognition with chunk size %d and right context %d'
+                     % (args.chunk_size, args.right_context))
+        stream = StreamingRecognizer(e2e, args.chunk_size, args.right_context, args.beam_size)
 
     new_json = {}
-    for name, feat in reader:
-        if args.beam_size == 1:
-            y_hat = e2e.recognize(feat, args, train_args.char_list, rnnlm=rnnlm)
-        else:
-            nbest_hyps = e2e.recognize(feat, args, train_args.char_list, rnnlm=rnnlm)
-            # get 1best and remove sos
-            y_hat = nbest_hyps[0]['yseq'][1:]
 
+    def add_result(result):
+        name, y_hat, nbest_hyps = result
         y_true = map(int, recog_json[name]['tokenid'].split())
 
         # print out decoding result
@@ -459,7 +565,7 @@ def recog(args):
         new_json[name]['rec_text'] = seq_hat_text
 
         # add n-best recognition results with scores
-        if args.beam_size > 1 and len(nbest_hyps) > 1:
+        if nbest_hyps is not None and len(nbest_hyps) > 1:
             for i, hyp in enumerate(nbest_hyps):
                 y_hat = hyp['yseq'][1:]
                 seq_hat = [train_args.char_list[int(idx)] for idx in y_hat]
@@ -469,6 +575,97 @@ def recog(args):
                 new_json[name]['rec_text' + '[' + '{:05d}'.format(i) + ']'] = seq_hat_text
                 new_json[name]['score' + '[' + '{:05d}'.format(i) + ']'] = hyp['score']
 
+    # results are formatted and logged in a background thread
+    writer = BackgroundWriter(add_result)
+    start_time = time.time()
+    for name, feat in reader:
+        nbest_hyps = None
+        if args.chunk_size > 0:
+            # feed the input frames of each chunk as they would arrive
+            y_hat = stream.recognize(feat, args.chunk_size * int(e2e.subsample[0]))
+        elif args.beam_size == 1:
+            y_hat = e2e.recognize(feat, args, train_args.char_list, rnnlm=rnnlm)
+        else:
+            nbest_hyps = e2e.recognize(feat, args, train_args.char_list, rnnlm=rnnlm)
+            # get 1best and remove sos
+            y_hat = nbest_hyps[0]['yseq'][1:]
+        writer.put((name, y_hat, nbest_hyps))
+    writer.close()
+    report_io_wait(reader, writer, time.time() - start_time)
+
     # TODO(watanabe) fix character coding problems when saving it
     with open(args.result_label, 'wb') as f:
         f.write(json.dumps({'utts': new_json}, indent=4, sort_keys=True).encode('utf_8'))
+
+
+def serve(args):
+    '''Run recognition server with dynamic batching'''
+    # seed setting
+    torch.manual_seed(args.seed)
+
+    # read training config
+    with open(args.model_conf, "rb") as f:
+        logging.info('reading a model config file from' + args.model_conf)
+        idim, odim, train_args = pickle.load(f)
+
+    for key in sorted(vars(args).keys()):
+        logging.info('ARGS: ' + key + ': ' + str(vars(args)[key]))
+
+    # specify model architecture
+    logging.info('reading model parameters from' + args.model)
+    e2e = load_e2e(args.model, idim, odim, train_args)
+    if args.quantize:
+        logging.info('apply %s dynamic quantization to the model' % args.quantize)
+        e2e = quantize_dynamic(e2e, args.quantize)
+
+    def cpu_loader(storage, location):
+        return storage
+
+    # read rnnlm
+    if args.rnnlm:
+        rnnlm = lm_pytorch.ClassifierWithState(
+            lm_pytorch.RNNLM(len(train_args.char_list), 650))
+        rnnlm.load_state_dict(torch.load(args.rnnlm, map_location=cpu_loader))
+        rnnlm.eval()
+        if args.quantize:
+            logging.info('apply %s dynamic quantization to the rnnlm' % args.quantize)
+            rnnlm = quantize_dynamic(rnnlm, args.quantize)
+    else:
+        rnnlm = None
+
+    char_list = train_args.char_list
+
+    def load_feat(req):
+        # only plain files are accepted, as the specifiers are interpreted by Kaldi and the shell
+        if 'feat' in req:
+            return kaldi_io_py.read_mat(check_request_feat(req['feat']))
+        elif 'wav' in req:
+            if args.wav_feat is None:
+                raise ValueError('--wav-feat is required to accept wav requests')
+            wav = six.moves.shlex_quote(check_request_file(req['wav']))
+            for _, feat in kaldi_io_py.read_mat_ark(args.wav_feat.format(wav=wav)):
+                return feat
+        raise ValueError('request must have either feat or wav')
+
+    def recognize(feats):
+        results = []
+        for y_hat in e2e.recognize_batch(feats, args, char_list, rnnlm=rnnlm):
+            if args.beam_size > 1:
+                # get 1best and remove sos
+                y_hat = y_hat[0]['yseq'][1:]
+            seq_hat = [char_list[int(idx)] for idx in y_hat]
+            results.append({'rec_tokenid': " ".join([str(int(idx)) for idx in y_hat]),
+                            'rec_token': " ".join(seq_hat),
+                            'rec_text': "".join(seq_hat).replace('<space>', ' ')})
+        return results
+
+    batcher = DynamicBatcher(recognize, args.batch_size, args.max_latency / 1000.0)
+    server = make_recog_server(args.host, args.port, load_feat, batcher)
+    logging.info('listening on %s:%d' % (args.host, args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logging.info('shutting down the server')
+    finally:
+        server.server_close()
+        batcher.close()
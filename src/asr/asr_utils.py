@@ -4,12 +4,22 @@
 #  Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
 
 
+import json
 import logging
+from multiprocessing.pool import ThreadPool
+import os
+import re
+import threading
+import time
 
 # chainer related
 import chainer
 from chainer import training
 import numpy as np
+import six
+
+from feat_transform import TransformedDict
+import lazy_io
 
 
 # * -------------------- agumenting data prep -------------------- *
@@ -26,7 +36,8 @@ def make_augment_batchset(data, batch_size,
     meta = {'ifilename': data['ifilename'],
             'ofilename': data['ofilename'],
             'idict': data['idict'],
-            'odict': data['odict']}
+            'odict': data['odict'],
+            'index': data.get('index')}
     assert '<unk>' in data['odict']
     sentences = data['sentences']
     sorted_data = sorted(sentences.items(), key=lambda data: int(
@@ -65,46 +76,490 @@ def converter_augment(batch, idict, odict, ifile, ofile):
         iline = np.array(iline, dtype=np.int64)
         oline = oline.strip().split()[1:]  # so that we can use the same aug files from OpenNMT, removed "aug"
         assert len(oline) > 0
-        oline = ' '.join([str(odict.get(i, odict['<unk>'])) for i in oline])
+        oline = np.array([odict.get(i, odict['<unk>']) for i in oline], dtype=np.int32)
         b_obj['feat'] = iline
-        b_obj['tokenid'] = oline
+        b_obj['tokenid_array'] = oline
+    return batch
+
+
+def converter_augment_index(batch, index):
+    '''Set the token arrays of augmenting sentences from an index made by json2augindex.py
+
+    It is used instead of converter_augment, which reads and maps the text in every minibatch.
+
+    :param list batch: (line number, sentence dict) of the augmenting sentences
+    :param lazy_io.AugmentIndex index: token arrays of the augmenting corpus
+    :return: batch with 'feat' (int64 input tokens) and 'tokenid_array' (int32 output tokens)
+    :rtype: list
+    '''
+    for b_idx, b_obj in batch:
+        # the input tokens are copied as they are given to torch.from_numpy
+        b_obj['feat'] = index.src(int(b_idx)).astype(np.int64)
+        b_obj['tokenid_array'] = index.tgt(int(b_idx))
     return batch
 
 
 # * -------------------- training iterator related -------------------- *
+def attach_token_arrays(utts):
+    '''Parse the token ids of utterances at once into a contiguous int32 array
+
+    Each utterance dict gets 'tokenid_array', a view of the array between its offsets,
+    which E2E uses instead of parsing 'tokenid' in every minibatch.
+
+    :param list utts: utterance dicts with 'tokenid' (e.g. values of data.json)
+    :return: token array and offsets (len(utts) + 1) of the utterances
+    :rtype: tuple
+    '''
+    utts = list(utts)
+    # the tokens are split once, and a token which is not an integer raises ValueError
+    fields = [utt['tokenid'].split() for utt in utts]
+    offsets = np.zeros(len(utts) + 1, dtype=np.int64)
+    np.cumsum([len(f) for f in fields], out=offsets[1:])
+    tokens = np.array([int(t) for f in fields for t in f], dtype=np.int32)
+    for utt, start, end in zip(utts, offsets[:-1], offsets[1:]):
+        utt['tokenid_array'] = tokens[start:end]
+    return tokens, offsets
+
+
 def make_batchset(data, batch_size, max_length_in, max_length_out, num_batches=0):
+    if isinstance(data, lazy_io.Manifest):
+        return make_manifest_batchset(data, batch_size, max_length_in, max_length_out, num_batches)
     # sort it by input lengths (long to short)
     sorted_data = sorted(data.items(), key=lambda data: int(
         data[1]['ilen']), reverse=True)
     logging.info('# utts: ' + str(len(sorted_data)))
+    minibatch = split_batches(sorted_data, batch_size, max_length_in, max_length_out)
+    if num_batches > 0:
+        minibatch = minibatch[:num_batches]
+    logging.info('# minibatches: ' + str(len(minibatch)))
+
+    return minibatch
+
+
+def make_manifest_batchset(manifest, batch_size, max_length_in, max_length_out, num_batches=0):
+    '''make_batchset of a columnar manifest (lazy_io.Manifest) made with its numpy columns'''
+    # sort it by input lengths (long to short)
+    order = np.argsort(-np.asarray(manifest.ilen, dtype=np.int64), kind='mergesort')
+    logging.info('# utts: ' + str(len(order)))
+    bounds = batch_bounds(manifest.ilen[order], manifest.olen[order], batch_size, max_length_in, max_length_out)
+    if num_batches > 0:
+        bounds = bounds[:num_batches]
+    logging.info('# minibatches: ' + str(len(bounds)))
+
+    return ManifestBatches(manifest, [order[start:end] for start, end in bounds])
+
+
+class ManifestBatches(object):
+    '''Minibatches of a manifest, whose utterance dicts are made when they are accessed
+
+    :param lazy_io.Manifest manifest: manifest of the utterances
+    :param list batches: arrays of the utterance indices of each minibatch
+    '''
+
+    def __init__(self, manifest, batches):
+        self.manifest = manifest
+        self.batches = batches
+
+    def __len__(self):
+        return len(self.batches)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in six.moves.range(*i.indices(len(self)))]
+        return [(self.manifest.key_list[j], self.manifest.info(j)) for j in self.batches[i]]
+
+
+def split_batches(sorted_data, batch_size, max_length_in, max_length_out):
+    ilens = [int(data[1]['ilen']) for data in sorted_data]
+    olens = [int(data[1]['olen']) for data in sorted_data]
+    return [sorted_data[start:end]
+            for start, end in batch_bounds(ilens, olens, batch_size, max_length_in, max_length_out)]
+
+
+def batch_bounds(ilens, olens, batch_size, max_length_in, max_length_out):
     # change batchsize depending on the input and output length
-    minibatch = []
+    bounds = []
     start = 0
-    while True:
-        ilen = int(sorted_data[start][1]['ilen'])
-        olen = int(sorted_data[start][1]['olen'])
+    while start < len(ilens):
+        ilen = int(ilens[start])
+        olen = int(olens[start])
         factor = max(int(ilen / max_length_in), int(olen / max_length_out))
         # if ilen = 1000 and max_length_in = 800
         # then b = batchsize / 2
         # and max(1, .) avoids batchsize = 0
         b = max(1, int(batch_size / (1 + factor)))
-        end = min(len(sorted_data), start + b)
-        minibatch.append(sorted_data[start:end])
-        if end == len(sorted_data):
-            break
+        end = min(len(ilens), start + b)
+        bounds.append((start, end))
         start = end
-    if num_batches > 0:
-        minibatch = minibatch[:num_batches]
-    logging.info('# minibatches: ' + str(len(minibatch)))
 
-    return minibatch
+    return bounds
+
+
+class ShardIterator(chainer.dataset.Iterator):
+    '''Iterator of minibatches streamed from the shards made by json2shards.py
+
+    Shards are read sequentially (in a shuffled order) in a background thread.
+    Their utterances are accumulated in a buffer, which is shuffled and split
+    into minibatches of similar lengths as make_batchset when it is full.
+    The minibatches have the features attached, so converter_kaldi does not read them.
+    A snapshot only stores the epoch, i.e., a resumed epoch starts from its beginning.
+
+    Args:
+        shard_dir (str): Directory of the shards with index.json.
+        batch_size (int): Batch size of short utterances (see make_batchset).
+        max_length_in (int): Input length from which the batch size is reduced.
+        max_length_out (int): Output length from which the batch size is reduced.
+        buffer_size (int): Number of utterances shuffled together.
+        shuffle (bool): Shuffle the shards and the utterances.
+        repeat (bool): Repeat the epochs.
+        transform: Function applied to the features and the key of each utterance (e.g. FeatTransform).
+        n_read_ahead (int): Number of shards read ahead in the background thread.
+        seed (int): Seed of the shuffling.
+
+    '''
+
+    def __init__(self, shard_dir, batch_size, max_length_in, max_length_out, buffer_size=5000,
+                 shuffle=True, repeat=True, transform=None, n_read_ahead=2, seed=1):
+        with open(os.path.join(shard_dir, 'index.json'), 'rb') as f:
+            index = json.loads(f.read().decode('utf-8'))
+        self.shards = [os.path.join(shard_dir, shard['file']) for shard in index['shards']]
+        self.n_utts = index['n_utts']
+        if self.n_utts == 0:
+            raise ValueError('no utterances in the shards: ' + shard_dir)
+        self.batch_size = batch_size
+        self.max_length_in = max_length_in
+        self.max_length_out = max_length_out
+        self.buffer_size = buffer_size
+        self.shuffle = shuffle
+        self.repeat = repeat
+        self.transform = transform
+        self.n_read_ahead = n_read_ahead
+        self.rng = np.random.RandomState(seed)
+        self.reset()
+
+    def reset(self):
+        self.epoch = 0
+        self.is_new_epoch = False
+        self.current_utts = 0
+        self.previous_epoch_detail = -1.
+        self.batches = None
+
+    @property
+    def epoch_detail(self):
+        return self.epoch + float(self.current_utts) / max(self.n_utts, 1)
+
+    def _read_shards(self):
+        order = np.arange(len(self.shards))
+        if self.shuffle:
+            self.rng.shuffle(order)
+        for i in order:
+            utts = lazy_io.read_shard(self.shards[i])
+            attach_token_arrays(info for _, info in utts)
+            if self.transform is not None:
+                for key, info in utts:
+                    info['feat'] = self.transform(info['feat'], key)
+            yield utts
+
+    def _split(self, buffer):
+        if self.shuffle:
+            self.rng.shuffle(buffer)
+        # stable sort keeps the shuffled order of the utterances of the same length
+        buffer.sort(key=lambda utt: int(utt[1]['ilen']), reverse=True)
+        batches = split_batches(buffer, self.batch_size, self.max_length_in, self.max_length_out)
+        if self.shuffle:
+            self.rng.shuffle(batches)
+        return batches
+
+    def _epoch_batches(self):
+        shards = self._read_shards()
+        if self.n_read_ahead > 0:
+            shards = PrefetchIterator(shards, self.n_read_ahead)
+        buffer = []
+        for utts in shards:
+            buffer.extend(utts)
+            if len(buffer) >= self.buffer_size:
+                for batch in self._split(buffer):
+                    yield batch
+                buffer = []
+        for batch in self._split(buffer):
+            yield batch
+
+    def __next__(self):
+        if self.batches is None:
+            if not self.repeat and self.epoch > 0:
+                raise StopIteration
+            self.batches = self._epoch_batches()
+        self.previous_epoch_detail = self.epoch_detail
+        batch = next(self.batches, None)
+        if batch is None:
+            # the end of the epoch
+            self.batches = None
+            self.current_utts = 0
+            self.epoch += 1
+            return self.__next__()
+        self.current_utts += len(batch)
+        self.is_new_epoch = self.current_utts == self.n_utts
+        if self.is_new_epoch:
+            # the next call starts a new epoch
+            self.batches = None
+            self.current_utts = 0
+            self.epoch += 1
+        # batch size is 1 as chainer.iterators.SerialIterator(minibatches, 1)
+        return [batch]
+
+    def serialize(self, serializer):
+        self.epoch = serializer('epoch', self.epoch)
+        self.is_new_epoch = serializer('is_new_epoch', self.is_new_epoch)
+
+
+def make_feat_iterator(feat, data_json, args, transform=None, train=True):
+    '''Make a minibatch iterator and a reader of the features of --train-feat or --valid-feat
+
+    :param str feat: Kaldi scp, "store:<dir>", "wav:<data dir>" or "shard:<dir>" made by json2shards.py
+    :param dict data_json: utterance dicts of the label json (not used for the shards)
+    :param Namespace args: training arguments
+    :param transform: function applied to the features (e.g. FeatTransform)
+    :param bool train: training set (shuffled and repeated) or validation set
+    :return: iterator and reader, which is None if the iterator attaches the features
+    :rtype: tuple
+    '''
+    if feat.startswith('shard:'):
+        iterator = ShardIterator(feat[len('shard:'):], args.batch_size, args.maxlen_in, args.maxlen_out,
+                                 args.shuffle_buffer, shuffle=train, repeat=train, transform=transform)
+        return iterator, None
+
+    # make minibatch list (variable length)
+    minibatches = make_batchset(data_json, args.batch_size,
+                                args.maxlen_in, args.maxlen_out, args.minibatches)
+    # hack to make batchsze argument as 1
+    # actual bathsize is included in a list
+    if train:
+        iterator = chainer.iterators.SerialIterator(minibatches, 1)
+    else:
+        iterator = chainer.iterators.SerialIterator(minibatches, 1, repeat=False, shuffle=False)
+
+    # prepare Kaldi reader (or feature store reader)
+    reader = lazy_io.read_dict(feat, coalesce=bool(args.coalesce_reads), fbank_cache=args.fbank_cache)
+    if transform is not None:
+        reader = TransformedDict(reader, transform)
+    if train and args.train_cache_mb > 0:
+        reader = lazy_io.FeatCache(reader, args.train_cache_mb * 1024 ** 2, args.cache_policy)
+    if not train and args.valid_cache_mb > 0:
+        # validation features are read in the same order every epoch
+        reader = lazy_io.FeatCache(reader, args.valid_cache_mb * 1024 ** 2, 'pin')
+    return iterator, reader
+
+
+class PrefetchBatchIterator(chainer.dataset.Iterator):
+    '''Iterator loading the next minibatches in background threads
+
+    The epoch information (epoch, is_new_epoch, etc.) follows the minibatches
+    returned by __next__, not those being loaded in the background.
+    Note that a snapshot stores the state of the wrapped iterator, which may be
+    ahead of the returned minibatches by up to n_prefetch + n_workers; the
+    epoch information is restored from it only when loading a snapshot.
+
+    Args:
+        iterator: Chainer iterator of minibatches.
+        load_fn: Function to load a minibatch returned by the iterator.
+        n_prefetch (int): Maximum number of minibatches loaded in advance.
+        n_workers (int): Number of threads to load the minibatches.
+
+    '''
 
+    def __init__(self, iterator, load_fn, n_prefetch, n_workers=1):
+        self.iterator = iterator
+        self.load_fn = load_fn
+        self.n_prefetch = n_prefetch
+        self.n_workers = n_workers
+        self.epoch = iterator.epoch
+        self.is_new_epoch = iterator.is_new_epoch
+        self.epoch_detail = iterator.epoch_detail
+        self.previous_epoch_detail = getattr(iterator, 'previous_epoch_detail', None)
+        self.queue = None
+        self.pool = None
+        # the wrapped iterator is advanced by _dispatch and serialized by the main thread
+        self.lock = threading.Lock()
+
+    def _start(self):
+        # started lazily so that the wrapped iterator can be restored from a snapshot
+        self.queue = six.moves.queue.Queue(self.n_prefetch)
+        self.pool = ThreadPool(self.n_workers)
+        self.thread = threading.Thread(target=self._dispatch)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _dispatch(self):
+        try:
+            while True:
+                with self.lock:
+                    batch = self.iterator.__next__()
+                    state = (self.iterator.epoch, self.iterator.is_new_epoch, self.iterator.epoch_detail,
+                             getattr(self.iterator, 'previous_epoch_detail', None))
+                self.queue.put((self.pool.apply_async(self.load_fn, (batch,)), state))
+        except Exception as e:
+            # e.g. StopIteration at the end of a non-repeating iterator
+            self.queue.put((e, None))
+
+    def __next__(self):
+        if self.queue is None:
+            self._start()
+        result, state = self.queue.get()
+        if state is None:
+            # keep raising the same error for the later calls
+            self.queue.put((result, None))
+            raise result
+        self.epoch, self.is_new_epoch, self.epoch_detail, self.previous_epoch_detail = state
+        return result.get()
+
+    def serialize(self, serializer):
+        with self.lock:
+            self.iterator.serialize(serializer)
+            if isinstance(serializer, chainer.serializer.Deserializer):
+                self.epoch = self.iterator.epoch
+                self.is_new_epoch = self.iterator.is_new_epoch
+                self.epoch_detail = self.iterator.epoch_detail
+                self.previous_epoch_detail = getattr(self.iterator, 'previous_epoch_detail', None)
+
+    def finalize(self):
+        if self.pool is not None:
+            self.pool.terminate()
+        self.iterator.finalize()
+
+
+class InterleavedBatchIterator(chainer.dataset.Iterator):
+    '''Iterator interleaving the minibatches of audio and augmenting text
+
+    augment_ratio augmenting minibatches are followed by one audio minibatch.
+    Each source is loaded by its own PrefetchBatchIterator, so that the audio
+    features are read while the augmenting minibatches are trained, and vice versa.
+    __next__ returns (loaded minibatch, whether it is an augmenting minibatch).
+    The epoch information follows the audio minibatches.
 
-# TODO(watanabe) perform mean and variance normalization during the python program
-# and remove the data dump process in run.sh
+    Args:
+        audio_iter: Chainer iterator of the audio minibatches.
+        augment_iter: Chainer iterator of the augmenting minibatches.
+        audio_load_fn: Function to load a minibatch returned by audio_iter.
+        augment_load_fn: Function to load a minibatch returned by augment_iter.
+        augment_ratio (int): Number of augmenting minibatches per audio minibatch.
+        n_prefetch (int): Maximum number of audio minibatches loaded in advance
+            (augment_ratio times as many augmenting minibatches). If 0, they are loaded in __next__.
+        n_workers (int): Number of threads to load the audio minibatches.
+
+    '''
+
+    SOURCES = ('audio', 'augment')
+
+    def __init__(self, audio_iter, augment_iter, audio_load_fn, augment_load_fn, augment_ratio,
+                 n_prefetch=0, n_workers=1):
+        if n_prefetch > 0:
+            # augmenting minibatches are loaded by a single thread (converter_augment seeks shared files)
+            self.sources = {'audio': (PrefetchBatchIterator(audio_iter, audio_load_fn, n_prefetch, n_workers), None),
+                            'augment': (PrefetchBatchIterator(augment_iter, augment_load_fn,
+                                                              n_prefetch * augment_ratio), None)}
+        else:
+            self.sources = {'audio': (audio_iter, audio_load_fn), 'augment': (augment_iter, augment_load_fn)}
+        self.augment_ratio = augment_ratio
+        self.position = 0
+        self.epoch = audio_iter.epoch
+        self.is_new_epoch = audio_iter.is_new_epoch
+        self.epoch_detail = audio_iter.epoch_detail
+        self.previous_epoch_detail = getattr(audio_iter, 'previous_epoch_detail', None)
+        self.start_time = None
+        self.stats = dict((name, {'batches': 0, 'utts': 0, 'wait': 0.0}) for name in self.SOURCES)
+
+    def __next__(self):
+        if self.start_time is None:
+            self.start_time = time.time()
+        is_aug = self.position < self.augment_ratio
+        name = 'augment' if is_aug else 'audio'
+        iterator, load_fn = self.sources[name]
+        start = time.time()
+        batch = iterator.__next__()
+        if load_fn is not None:
+            batch = load_fn(batch)
+        stats = self.stats[name]
+        stats['wait'] += time.time() - start
+        stats['batches'] += 1
+        stats['utts'] += len(batch)
+        self.position = (self.position + 1) % (self.augment_ratio + 1)
+        if is_aug:
+            self.is_new_epoch = False
+            self.previous_epoch_detail = self.epoch_detail
+        else:
+            self.epoch = iterator.epoch
+            self.is_new_epoch = iterator.is_new_epoch
+            self.epoch_detail = iterator.epoch_detail
+            self.previous_epoch_detail = getattr(iterator, 'previous_epoch_detail', None)
+        return batch, is_aug
+
+    def throughput(self):
+        '''Utterances per second and fraction of the time waiting for each source
+
+        :return: e.g. {'audio/utts_per_sec': 50.0, 'audio/wait_ratio': 0.1, ...}
+        :rtype: dict
+        '''
+        elapsed = max(time.time() - self.start_time, 1e-8) if self.start_time is not None else 1e-8
+        result = {}
+        for name in self.SOURCES:
+            result[name + '/utts_per_sec'] = self.stats[name]['utts'] / elapsed
+            result[name + '/wait_ratio'] = self.stats[name]['wait'] / elapsed
+        return result
+
+    def __str__(self):
+        elapsed = time.time() - self.start_time if self.start_time is not None else 0.0
+        return ', '.join('%s: %d batches, %d utts (%.1f utts/sec), waited %.2f sec' % (
+            name, self.stats[name]['batches'], self.stats[name]['utts'],
+            self.stats[name]['utts'] / max(elapsed, 1e-8), self.stats[name]['wait']) for name in self.SOURCES)
+
+    def serialize(self, serializer):
+        audio_iter = self.sources['audio'][0]
+        try:
+            audio_iter.serialize(serializer['audio'])
+        except KeyError:
+            if not isinstance(serializer, chainer.serializer.Deserializer):
+                raise
+            # snapshots taken before the interleaving have the state of the audio iterator
+            # at the top level, and the augmenting minibatches start from the beginning
+            logging.warning('no interleaving state in the snapshot, resume the audio iterator only')
+            audio_iter.serialize(serializer)
+        else:
+            self.sources['augment'][0].serialize(serializer['augment'])
+            self.position = serializer('position', self.position)
+        self.epoch = audio_iter.epoch
+        self.is_new_epoch = audio_iter.is_new_epoch
+        self.epoch_detail = audio_iter.epoch_detail
+
+    def finalize(self):
+        for name in self.SOURCES:
+            self.sources[name][0].finalize()
+
+
+def load_kaldi_batch(batch, reader):
+    '''Read features of a minibatch (e.g. in a prefetching thread)
+
+    The utterance dicts are copied so that the same utterance can be in
+    multiple minibatches being loaded at the same time.
+    '''
+    batch = [(data[0], dict(data[1])) for data in batch]
+    converter_kaldi(batch, reader)
+
+    return batch
+
+
+# mean and variance normalization (and deltas) can be performed by the reader
+# (see feat_transform.TransformedDict) instead of the data dump process in run.sh
 def converter_kaldi(batch, reader):
-    for data in batch:
-        feat = reader[data[0].encode('ascii', 'ignore')]
+    if reader is None:
+        # features are attached by ShardIterator
+        return batch
+    keys = [data[0].encode('ascii', 'ignore') for data in batch]
+    if hasattr(reader, 'read_batch'):
+        # read in the order of ark files and offsets
+        feats = reader.read_batch(keys)
+    else:
+        feats = [reader[key] for key in keys]
+    for data, feat in zip(batch, feats):
         data[1]['feat'] = feat
 
     return batch
@@ -198,3 +653,264 @@ def _adadelta_eps_decay(trainer, eps_decay):
         for p in optimizer.param_groups:
             p["eps"] *= eps_decay
             logging.info('adadelta eps decayed to ' + str(p["eps"]))
+
+
+# * -------------------- background I/O related -------------------- *
+class PrefetchIterator(six.Iterator):
+    '''Iterator reading items ahead in a background thread
+
+    Items are stored in a bounded queue so that reading (e.g. a Kaldi
+    feature pipe) and their consumer (e.g. decoding) run concurrently.
+
+    Args:
+        iterable: Iterable to be read in the background.
+        maxsize (int): Maximum number of items read ahead.
+
+    '''
+
+    def __init__(self, iterable, maxsize):
+        self.iterable = iterable
+        self.queue = six.moves.queue.Queue(maxsize)
+        self.wait_time = 0.0  # time (sec) the consumer waited for the items
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _run(self):
+        try:
+            for item in self.iterable:
+                self.queue.put((item, None))
+            self.queue.put((None, StopIteration()))
+        except Exception as e:
+            logging.exception('failed to read an item in the background')
+            self.queue.put((None, e))
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        start = time.time()
+        item, error = self.queue.get()
+        self.wait_time += time.time() - start
+        if error is not None:
+            # keep raising the same error for the later calls
+            self.queue.put((None, error))
+            raise error
+        return item
+
+
+class BackgroundWriter(object):
+    '''Apply a function (e.g. writing results) to items in a background thread
+
+    Args:
+        fn: Function applied to each item.
+        maxsize (int): Maximum number of pending items (0 means unlimited).
+
+    '''
+
+    def __init__(self, fn, maxsize=0):
+        self.fn = fn
+        self.queue = six.moves.queue.Queue(maxsize)
+        self.wait_time = 0.0  # time (sec) the producer waited for the queue
+        self.error = None
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            if self.error is None:
+                try:
+                    self.fn(item)
+                except Exception as e:
+                    logging.exception('failed to write an item in the background')
+                    self.error = e
+
+    def put(self, item):
+        start = time.time()
+        self.queue.put(item)
+        self.wait_time += time.time() - start
+
+    def close(self):
+        '''Wait for all the pending items to be processed'''
+        start = time.time()
+        self.queue.put(None)
+        self.thread.join()
+        self.wait_time += time.time() - start
+        if self.error is not None:
+            raise self.error
+
+
+def report_io_wait(reader, writer, elapsed):
+    '''Log how much of the elapsed time was spent on waiting for I/O
+
+    :param reader: PrefetchIterator of the inputs (other iterators are not measured)
+    :param BackgroundWriter writer: writer of the results
+    :param float elapsed: total elapsed time (sec)
+    '''
+    elapsed = max(elapsed, 1e-8)
+    if isinstance(reader, PrefetchIterator):
+        logging.info('waited %.2f sec (%.1f%% of %.2f sec) for reading inputs'
+                     % (reader.wait_time, 100.0 * reader.wait_time / elapsed, elapsed))
+    logging.info('waited %.2f sec (%.1f%% of %.2f sec) for writing results'
+                 % (writer.wait_time, 100.0 * writer.wait_time / elapsed, elapsed))
+
+
+# * -------------------- recognition server related -------------------- *
+class DynamicBatcher(object):
+    '''Group concurrent requests into batches within a latency budget
+
+    A worker thread waits for the first request, then keeps collecting
+    requests until the batch is full or max_latency seconds have passed,
+    and processes them with a single call of process_fn.
+
+    Args:
+        process_fn: Function mapping a list of requests to a list of results.
+        batch_size (int): Maximum number of requests in a batch.
+        max_latency (float): Maximum waiting time (sec) to fill a batch.
+
+    '''
+
+    def __init__(self, process_fn, batch_size, max_latency):
+        self.process_fn = process_fn
+        self.batch_size = batch_size
+        self.max_latency = max_latency
+        self.queue = six.moves.queue.Queue()
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def __call__(self, request):
+        '''Submit a request and wait for its result'''
+        slot = {'request': request, 'done': threading.Event()}
+        self.queue.put(slot)
+        slot['done'].wait()
+        if 'error' in slot:
+            raise slot['error']
+        return slot['result']
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+
+    def _run(self):
+        while True:
+            slot = self.queue.get()
+            if slot is None:
+                break
+            slots = [slot]
+            deadline = time.time() + self.max_latency
+            while len(slots) < self.batch_size:
+                timeout = deadline - time.time()
+                if timeout <= 0:
+                    break
+                try:
+                    slot = self.queue.get(timeout=timeout)
+                except six.moves.queue.Empty:
+                    break
+                if slot is None:
+                    self.queue.put(None)
+                    break
+                slots.append(slot)
+
+            logging.info('process a batch of %d requests' % len(slots))
+            try:
+                results = self.process_fn([s['request'] for s in slots])
+                for s, result in zip(slots, results):
+                    s['result'] = result
+            except Exception as e:
+                logging.exception('failed to process a batch')
+                for s in slots:
+                    s['error'] = e
+            for s in slots:
+                s['done'].set()
+
+
+# plain file paths without whitespace or shell syntax
+REQUEST_PATH_PATTERN = re.compile(r'^(?!-)[\w./+-]+$')
+
+
+def check_request_file(path):
+    '''Check a file path of a recognition request
+
+    Only plain paths of existing files are accepted, so that a client can neither make
+    Kaldi run a command (e.g. an rxfilename "cmd |") nor inject shell syntax into the
+    feature extraction pipeline of wav requests.
+
+    Args:
+        path (str): File path of the request.
+
+    Returns:
+        str: The path.
+
+    '''
+    if not isinstance(path, six.string_types) or REQUEST_PATH_PATTERN.match(path) is None:
+        raise ValueError('invalid file path in the request: %r' % (path,))
+    if not os.path.isfile(path):
+        raise ValueError('no such file: %s' % path)
+    return path
+
+
+def check_request_feat(feat):
+    '''Check an ark specifier "path:offset" of a recognition request (see check_request_file)
+
+    Args:
+        feat (str): Ark specifier of the request.
+
+    Returns:
+        str: The ark specifier.
+
+    '''
+    if not isinstance(feat, six.string_types):
+        raise ValueError('invalid feat in the request: %r' % (feat,))
+    m = re.match(r'^(.+):(\d+)$', feat)
+    if m is None:
+        raise ValueError('feat must be an ark specifier path:offset: %r' % (feat,))
+    check_request_file(m.group(1))
+    return feat
+
+
+def make_recog_server(host, port, load_fn, batcher):
+    '''Make a threaded HTTP server for recognition requests
+
+    Each request is a POST of a json object, e.g. {"key": "utt1", "feat": "feats.ark:10"}
+    or {"key": "utt1", "wav": "/path/to/utt1.wav"}. Features are loaded by load_fn in
+    the handler thread, and recognition is performed in batches by batcher. The paths
+    in the requests should be checked by load_fn (see check_request_feat).
+
+    Args:
+        host (str): Host name to bind.
+        port (int): Port number to bind.
+        load_fn: Function mapping a request json object to a feature matrix.
+        batcher (DynamicBatcher): Batcher running recognition.
+
+    '''
+    class RecogRequestHandler(six.moves.BaseHTTPServer.BaseHTTPRequestHandler):
+        def do_POST(self):
+            try:
+                length = int(self.headers.get('Content-Length', 0))
+                req = json.loads(self.rfile.read(length).decode('utf-8'))
+                result = batcher(load_fn(req))
+                result['key'] = req.get('key')
+                code = 200
+            except Exception as e:
+                result = {'key': None, 'error': str(e)}
+                code = 500
+            body = json.dumps(result, ensure_ascii=False).encode('utf_8')
+            self.send_response(code)
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logging.debug(format % args)
+
+    class ThreadedHTTPServer(six.moves.socketserver.ThreadingMixIn,
+                             six.moves.BaseHTTPServer.HTTPServer):
+        daemon_threads = True
+
+    return ThreadedHTTPServer((host, port), RecogRequestHandler)
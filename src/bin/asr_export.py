@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+# Copyright 2018 Johns Hopkins University (Shinji Watanabe)
+#  Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+
+import argparse
+import logging
+import os
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    # general configuration
+    parser.add_argument('--verbose', '-V', default=1, type=int,
+                        help='Verbose option')
+    # model (parameter) related
+    parser.add_argument('--model', type=str, required=True,
+                        help='Model file parameters to read')
+    parser.add_argument('--model-conf', type=str, required=True,
+                        help='Model config file')
+    parser.add_argument('--outdir', type=str, required=True,
+                        help='Output directory of the traced encoder, decoder step and CTC modules')
+    args = parser.parse_args()
+
+    # logging info
+    if args.verbose > 0:
+        logging.basicConfig(
+            level=logging.INFO, format="%(asctime)s (%(module)s:%(lineno)d) %(levelname)s: %(message)s")
+    else:
+        logging.basicConfig(
+            level=logging.WARN, format="%(asctime)s (%(module)s:%(lineno)d) %(levelname)s: %(message)s")
+        logging.warning("Skip DEBUG/INFO messages")
+
+    # display PYTHONPATH
+    logging.info('python path = ' + os.environ['PYTHONPATH'])
+
+    # export (only pytorch backend is supported)
+    from asr_pytorch import export
+    export(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -29,14 +29,21 @@ def main():
                         help='Verbose option')
     # task related
     parser.add_argument('--recog-feat', type=str, required=True,
-                        help='Filename of recognition feature data (Kaldi scp)')
+                        help='Filename of recognition feature data (Kaldi scp, '
+                             'or wav:<data dir> to compute filterbank features from wav.scp)')
+    parser.add_argument('--fbank-cache', type=str, default=None,
+                        help='Directory to cache the filterbank features computed for wav:<data dir>')
     parser.add_argument('--recog-label', type=str, required=True,
-                        help='Filename of recognition label data (json)')
+                        help='Filename of recognition label data (json, or manifest made by json2manifest.py)')
     parser.add_argument('--result-label', type=str, required=True,
                         help='Filename of result label data (json)')
     # model (parameter) related
-    parser.add_argument('--model', type=str, required=True,
-                        help='Model file parameters to read')
+    model_group = parser.add_mutually_exclusive_group(required=True)
+    model_group.add_argument('--model', type=str,
+                             help='Model file parameters to read')
+    model_group.add_argument('--exported-model', type=str,
+                             help='Directory of traced modules written by asr_export.py '
+                                  '(used instead of --model, pytorch backend only)')
     parser.add_argument('--model-conf', type=str, required=True,
                         help='Model config file')
     # search related
@@ -54,11 +61,35 @@ def main():
                         help='Input length ratio to obtain min output length')
     parser.add_argument('--ctc-weight', default=0.0, type=float,
                         help='CTC weight in joint decoding')
+    # streaming related
+    parser.add_argument('--chunk-size', default=0, type=int,
+                        help='Number of frames in a chunk for streaming CTC recognition with '
+                             'a latency-controlled encoder. If chunk-size=0 (default), '
+                             'the whole utterance is encoded at once')
+    parser.add_argument('--right-context', default=0, type=int,
+                        help='Number of look-ahead frames of each chunk in streaming recognition')
+    # feature transformation related
+    parser.add_argument('--cmvn', type=str, default=None,
+                        help='CMVN statistics (cmvn.ark of compute-cmvn-stats) applied to the features on the fly. '
+                             'Do not use them if the features of --recog-feat are already normalized')
+    parser.add_argument('--utt2spk', type=str, default=None,
+                        help='utt2spk file to apply per-speaker CMVN statistics (global statistics if not given)')
+    parser.add_argument('--norm-vars', default=1, type=int, choices=[0, 1],
+                        help='Normalize variances as well as means in CMVN')
+    parser.add_argument('--delta-order', default=0, type=int,
+                        help='Order of the deltas computed on the fly (2 as add-deltas, 0 for no deltas)')
     # rnnlm related
     parser.add_argument('--rnnlm', type=str, default=None,
                         help='RNNLM model file to read')
     parser.add_argument('--lm-weight', default=0.1, type=float,
                         help='RNNLM weight.')
+    # inference related
+    parser.add_argument('--quantize', default=None, type=str, choices=['int8'],
+                        help='Apply dynamic quantization with a specified type to the model and RNNLM '
+                             '(pytorch backend with CPU only)')
+    parser.add_argument('--read-ahead', default=8, type=int,
+                        help='Number of utterances whose features are read ahead in a background thread. '
+                             'If read-ahead=0, features are read synchronously')
     args = parser.parse_args()
 
     # logging info
@@ -81,6 +112,19 @@ def main():
     np.random.seed(args.seed)
     logging.info('set random seed = %d' % args.seed)
 
+    # check quantization availability
+    if args.quantize and (args.backend != 'pytorch' or int(args.gpu) >= 0):
+        raise ValueError('quantization is only supported with the pytorch backend on CPU.')
+    if args.quantize and args.exported_model:
+        raise ValueError('quantization is not supported with exported modules.')
+    if args.quantize and args.chunk_size > 0:
+        # the streaming encoder reads the LSTM weights, which quantized LSTMs do not have
+        raise ValueError('quantization is not supported in streaming recognition (chunk-size > 0).')
+    if args.exported_model and args.backend != 'pytorch':
+        raise ValueError('exported modules are only supported with the pytorch backend.')
+    if args.chunk_size > 0 and (args.backend != 'pytorch' or args.exported_model):
+        raise ValueError('streaming recognition is only supported with the pytorch backend.')
+
     # recog
     logging.info('backend = ' + args.backend)
     if args.backend == "chainer":
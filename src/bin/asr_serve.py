@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+# Copyright 2018 Johns Hopkins University (Shinji Watanabe)
+#  Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+
+import argparse
+import logging
+import os
+import random
+
+import numpy as np
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    # general configuration
+    parser.add_argument('--seed', default=1, type=int,
+                        help='Random seed')
+    parser.add_argument('--verbose', '-V', default=1, type=int,
+                        help='Verbose option')
+    # server related
+    parser.add_argument('--host', default='localhost', type=str,
+                        help='Host name to bind')
+    parser.add_argument('--port', default=8080, type=int,
+                        help='Port number to bind')
+    parser.add_argument('--batch-size', default=8, type=int,
+                        help='Maximum number of requests decoded in a batch')
+    parser.add_argument('--max-latency', default=50.0, type=float,
+                        help='Maximum time (msec) to wait for filling a batch')
+    parser.add_argument('--wav-feat', type=str, default=None,
+                        help='Kaldi rxspecifier to compute features of a wav request, '
+                             'where {wav} is replaced with the wav path, e.g. '
+                             '"compute-fbank-feats --config=conf/fbank.conf \'scp:echo utt {wav} |\' ark:- '
+                             '| apply-cmvn --norm-vars=true cmvn.ark ark:- ark:- |". '
+                             'The wav path is shell-quoted, and only plain paths of existing files are accepted')
+    # model (parameter) related
+    parser.add_argument('--model', type=str, required=True,
+                        help='Model file parameters to read')
+    parser.add_argument('--model-conf', type=str, required=True,
+                        help='Model config file')
+    # search related
+    parser.add_argument('--nbest', type=int, default=1,
+                        help='Output N-best hypotheses')
+    parser.add_argument('--beam-size', type=int, default=1,
+                        help='Beam size')
+    parser.add_argument('--penalty', default=0.0, type=float,
+                        help='Incertion penalty')
+    parser.add_argument('--maxlenratio', default=0.0, type=float,
+                        help='Input length ratio to obtain max output length.'
+                        + 'If maxlenratio=0.0 (default), it uses a end-detect function'
+                        + 'to automatically find maximum hypothesis lengths')
+    parser.add_argument('--minlenratio', default=0.0, type=float,
+                        help='Input length ratio to obtain min output length')
+    parser.add_argument('--ctc-weight', default=0.0, type=float,
+                        help='CTC weight in joint decoding')
+    # rnnlm related
+    parser.add_argument('--rnnlm', type=str, default=None,
+                        help='RNNLM model file to read')
+    parser.add_argument('--lm-weight', default=0.1, type=float,
+                        help='RNNLM weight.')
+    # inference related
+    parser.add_argument('--quantize', default=None, type=str, choices=['int8'],
+                        help='Apply dynamic quantization with a specified type to the model and RNNLM')
+    args = parser.parse_args()
+
+    # logging info
+    if args.verbose == 1:
+        logging.basicConfig(
+            level=logging.INFO, format="%(asctime)s (%(module)s:%(lineno)d) %(levelname)s: %(message)s")
+    elif args.verbose == 2:
+        logging.basicConfig(level=logging.DEBUG,
+                            format="%(asctime)s (%(module)s:%(lineno)d) %(levelname)s: %(message)s")
+    else:
+        logging.basicConfig(
+            level=logging.WARN, format="%(asctime)s (%(module)s:%(lineno)d) %(levelname)s: %(message)s")
+        logging.warning("Skip DEBUG/INFO messages")
+
+    # display PYTHONPATH
+    logging.info('python path = ' + os.environ['PYTHONPATH'])
+
+    # seed setting
+    random.seed(args.seed)
+    np.random.seed(args.seed)
+    logging.info('set random seed = %d' % args.seed)
+
+    # serve (only pytorch backend is supported, which runs on CPU)
+    from asr_pytorch import serve
+    serve(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -47,13 +47,30 @@ def main():
     parser.add_argument('--is-rep-aug', type=int, required=False, default=0, choices=[0, 1],
                         help='is the augment data repeated to reflect speech timing?')
     parser.add_argument('--train-feat', type=str, required=True,
-                        help='Filename of train feature data (Kaldi scp)')
+                        help='Filename of train feature data (Kaldi scp, store:<dir> made by feats2store.py, '
+                             'wav:<data dir> to compute filterbank features from wav.scp, '
+                             'or shard:<dir> made by json2shards.py)')
     parser.add_argument('--valid-feat', type=str, required=True,
-                        help='Filename of validation feature data (Kaldi scp)')
+                        help='Filename of validation feature data (Kaldi scp, store:<dir> made by feats2store.py, '
+                             'wav:<data dir> to compute filterbank features from wav.scp, '
+                             'or shard:<dir> made by json2shards.py)')
+    parser.add_argument('--fbank-cache', type=str, default=None,
+                        help='Directory to cache the filterbank features computed for wav:<data dir>')
+    parser.add_argument('--shuffle-buffer', default=5000, type=int,
+                        help='Number of utterances shuffled together when reading shard:<dir>')
     parser.add_argument('--train-label', type=str, required=True,
-                        help='Filename of train label data (json)')
+                        help='Filename of train label data (json, or manifest made by json2manifest.py)')
     parser.add_argument('--valid-label', type=str, required=True,
-                        help='Filename of validation label data (json)')
+                        help='Filename of validation label data (json, or manifest made by json2manifest.py)')
+    # feature transformation related
+    parser.add_argument('--cmvn', type=str, default=None,
+                        help='CMVN statistics (cmvn.ark of compute-cmvn-stats) applied to the features on the fly')
+    parser.add_argument('--utt2spk', type=str, default=None,
+                        help='utt2spk file to apply per-speaker CMVN statistics (global statistics if not given)')
+    parser.add_argument('--norm-vars', default=1, type=int, choices=[0, 1],
+                        help='Normalize variances as well as means in CMVN')
+    parser.add_argument('--delta-order', default=0, type=int,
+                        help='Order of the deltas computed on the fly (2 as add-deltas, 0 for no deltas)')
     # network archtecture
     # encoder
     parser.add_argument('--etype', default='blstmp', type=str,
@@ -117,6 +134,22 @@ def main():
                         help='Batch size is reduced if the input sequence length > ML')
     parser.add_argument('--maxlen-out', default=150, type=int, metavar='ML',
                         help='Batch size is reduced if the output sequence length > ML')
+    parser.add_argument('--coalesce-reads', default=0, type=int, choices=[0, 1],
+                        help='Read the utterances of a minibatch stored next to each other '
+                             'in the same ark file with single reads')
+    parser.add_argument('--prefetch-batches', default=0, type=int,
+                        help='Number of minibatches loaded in advance in background threads. '
+                             'If prefetch-batches=0 (default), minibatches are loaded in the updater. '
+                             'With --augment-ratio, augment-ratio times as many augmenting minibatches are loaded')
+    parser.add_argument('--prefetch-workers', default=1, type=int,
+                        help='Number of threads to load the minibatches in advance')
+    parser.add_argument('--train-cache-mb', default=0, type=int,
+                        help='Memory budget (MB) to cache the training features in RAM (0 disables the cache)')
+    parser.add_argument('--valid-cache-mb', default=0, type=int,
+                        help='Memory budget (MB) to cache the validation features in RAM (0 disables the cache). '
+                             'The features read first are kept in the cache')
+    parser.add_argument('--cache-policy', default='lru', type=str, choices=['lru', 'pin'],
+                        help='Eviction policy of the training feature cache')
     # optimization related
     parser.add_argument('--opt', default='adadelta', type=str,
                         choices=['adadelta', 'adam'],
@@ -161,16 +161,16 @@ class E2E(chainer.Chain):
         '''
         # utt list of frame x dim
         xs = [i[1]['feat'] for i in data]
+        # utt list of olen (token ids are parsed when the data is loaded)
+        ys = [d[1]['tokenid_array'] if 'tokenid_array' in d[1]
+              else np.fromiter(map(int, d[1]['tokenid'].split()), dtype=np.int32) for d in data]
         # remove 0-output-length utterances
-        tids = [d[1]['tokenid'].split() for d in data]
-        filtered_index = list(filter(lambda i: len(tids[i]) > 0, range(len(xs))))
+        filtered_index = list(filter(lambda i: len(ys[i]) > 0, range(len(xs))))
         if len(filtered_index) != len(xs):
             logging.warning('Target sequences include empty tokenid (batch %d -> %d).' % (
                 len(xs), len(filtered_index)))
         xs = [xs[i] for i in filtered_index]
-        # utt list of olen
-        ys = [self.xp.array(np.fromiter(map(int, tids[i]), dtype=np.int32))
-              for i in filtered_index]
+        ys = [self.xp.array(ys[i], dtype=np.int32) for i in filtered_index]
         ys = [chainer.Variable(y) for y in ys]
 
         # subsample frame
@@ -6,6 +6,7 @@
 
 from __future__ import division
 
+import copy
 import logging
 import math
 import sys
@@ -39,6 +40,27 @@ def to_cuda(m, x):
     return x.cuda(device_id)
 
 
+def quantize_dynamic(m, dtype='int8'):
+    '''Convert LSTM, LSTMCell and Linear layers into dynamically quantized ones
+
+    Weights are stored as int8 and activations are quantized on the fly,
+    so the converted model can be used only for CPU inference.
+
+    :param torch.nn.Module m: model to be converted (e.g. E2E or RNNLM)
+    :param str dtype: quantized data type (only 'int8' is supported)
+    :return: converted copy of the model
+    :rtype: torch.nn.Module
+    '''
+    if dtype != 'int8':
+        raise NotImplementedError('only int8 dynamic quantization is supported.')
+    if not hasattr(torch, 'quantization'):
+        raise NotImplementedError(
+            'dynamic quantization is not supported in pytorch ' + torch.__version__)
+    m.eval()
+    return torch.quantization.quantize_dynamic(
+        m, {torch.nn.LSTM, torch.nn.LSTMCell, torch.nn.Linear}, dtype=torch.qint8)
+
+
 def lecun_normal_init_parameters(module):
     for p in module.parameters():
         data = p.data
@@ -283,18 +305,17 @@ class E2E(torch.nn.Module):
         '''
         # utt list of frame x dim
         xs = [d[1]['feat'] for d in data]
+        # utt list of olen (token ids are parsed when the data is loaded)
+        ys = [d[1]['tokenid_array'] if 'tokenid_array' in d[1]
+              else np.fromiter(map(int, d[1]['tokenid'].split()), dtype=np.int64) for d in data]
         # remove 0-output-length utterances
-        tids = [d[1]['tokenid'].split() for d in data]
-        filtered_index = filter(lambda i: len(tids[i]) > 0, range(len(xs)))
+        filtered_index = filter(lambda i: len(ys[i]) > 0, range(len(xs)))
         sorted_index = sorted(filtered_index, key=lambda i: -len(xs[i]))
         if len(sorted_index) != len(xs):
             logging.warning('Target sequences include empty tokenid (batch %d -> %d).' % (
                 len(xs), len(sorted_index)))
         xs = [xs[i] for i in sorted_index]
-        # utt list of olen
-        ys = [np.fromiter(map(int, tids[i]), dtype=np.int64)
-              for i in sorted_index]
-        ys = [to_cuda(self, Variable(torch.from_numpy(y))) for y in ys]
+        ys = [to_cuda(self, Variable(torch.from_numpy(ys[i].astype(np.int64)))) for i in sorted_index]
         if not is_aug:
             # subsample frame
             xs = [xx[::self.subsample[0], :] for xx in xs]
@@ -357,6 +378,58 @@ class E2E(torch.nn.Module):
             self.train()
         return y
 
+    def recognize_batch(self, xs, recog_args, char_list, rnnlm=None):
+        '''E2E greedy/beam search for a batch of utterances
+
+        The encoder is run once over the padded batch (utterance by utterance
+        for VGG encoders). The greedy search decodes the whole batch in parallel,
+        while the beam search is performed utterance by utterance over the
+        batched encoder outputs. The results are the same as those of recognize.
+
+        :param list xs: list of input acoustic features (T_i x D)
+        :param recog_args:
+        :param char_list:
+        :return: list of token id sequences (greedy) or N-best hypotheses (beam)
+        '''
+        prev = self.training
+        self.eval()
+        # subsample frame and sort by length for the packed encoder
+        xs = [x[::self.subsample[0], :] for x in xs]
+        sorted_index = sorted(range(len(xs)), key=lambda i: -len(xs[i]))
+        ilens = np.fromiter((xs[i].shape[0] for i in sorted_index), dtype=np.int64)
+        hs = [to_cuda(self, Variable(torch.from_numpy(
+            np.array(xs[i], dtype=np.float32)), volatile=True)) for i in sorted_index]
+
+        # 1. encoder
+        if self.etype.startswith('vgg'):
+            # the convolution over the padded frames changes the outputs of the shorter utterances
+            hs = [self.enc(h.unsqueeze(0), [h.size(0)])[0][0] for h in hs]
+            hlens = [h.size(0) for h in hs]
+            hpad = pad_list(hs, 0.0)
+        else:
+            hpad, hlens = self.enc(pad_list(hs, 0.0), ilens)
+            hlens = [int(l) for l in hlens]
+
+        # 2. decoder
+        if recog_args.beam_size == 1:
+            ys = self.dec.recognize_batch(hpad, hlens, recog_args, rnnlm)
+        else:
+            if recog_args.ctc_weight > 0.0:
+                lpz = self.ctc.log_softmax(hpad).data
+            ys = []
+            for i, l in enumerate(hlens):
+                lpz_i = lpz[i, :l] if recog_args.ctc_weight > 0.0 else None
+                ys.append(self.dec.recognize_beam(hpad[i, :l], lpz_i, recog_args, char_list, rnnlm))
+
+        # restore the original order
+        ys_orig = [None] * len(ys)
+        for i, y in zip(sorted_index, ys):
+            ys_orig[i] = y
+
+        if prev:
+            self.train()
+        return ys_orig
+
 
 # ------------- CTC Network --------------------------------------------------------------------------------------------
 class _ChainerLikeCTC(warp_ctc._CTC):
@@ -1761,6 +1834,83 @@ class Decoder(torch.nn.Module):
 
         return y_seq
 
+    def recognize_batch(self, hpad, hlens, recog_args, rnnlm=None):
+        '''greedy search implementation over a padded batch
+
+        The hypotheses are the same as those of recognize for each utterance.
+        The decoder LSTMs, the output layer and the RNNLM are run over the batch,
+        while the attention is computed over the unpadded encoder hidden states
+        of each utterance, as the attention weights are not masked by the lengths.
+
+        :param Variable hpad: padded encoder hidden states (B x T_max x D_enc)
+        :param list hlens: encoder hidden state lengths (B)
+        :param Namespace recog_args:
+        :return: list of token id sequences (ending with eos unless the max output length is reached)
+        :rtype: list
+        '''
+        batch = hpad.size(0)
+        logging.info('input lengths: ' + str(hlens))
+        # initialization
+        c_list = [self.zero_state(hpad)]
+        z_list = [self.zero_state(hpad)]
+        for l in six.moves.range(1, self.dlayers):
+            c_list.append(self.zero_state(hpad))
+            z_list.append(self.zero_state(hpad))
+        state = None
+        # each utterance has its own copy of the attention (sharing the parameters) for its states
+        atts = [copy.copy(self.att) for _ in six.moves.range(batch)]
+        for att in atts:
+            att.reset()  # reset pre-computation of h
+        att_ws = [None] * batch
+
+        # number of decoding steps of each utterance as recognize
+        maxlens = [int(recog_args.maxlenratio * l) for l in hlens]
+        minlens = [int(recog_args.minlenratio * l) for l in hlens]
+        logging.info('max output lengths: ' + str(maxlens))
+        logging.info('min output lengths: ' + str(minlens))
+        nsteps = [max(0, maxlen - minlen) for maxlen, minlen in zip(maxlens, minlens)]
+        y_seqs = [[] for _ in six.moves.range(batch)]
+        ended = [n == 0 for n in nsteps]
+
+        # preprate sos
+        vy = Variable(hpad.data.new(batch).zero_().long() + self.sos, volatile=True)
+        for i in six.moves.range(max(nsteps + [0])):
+            ey = self.embed(vy)           # utt x zdim
+            att_cs = []
+            for b in six.moves.range(batch):
+                if ended[b]:
+                    # the hypothesis is finished, and the context is not used
+                    att_cs.append(Variable(hpad.data.new(1, hpad.size(2)).zero_(), volatile=True))
+                    continue
+                att_c, att_ws[b] = atts[b](hpad[b:b + 1, :hlens[b]], [hlens[b]], z_list[0][b:b + 1], att_ws[b])
+                att_cs.append(att_c)
+            ey = torch.cat((ey, torch.cat(att_cs, dim=0)), dim=1)   # utt x (zdim + hdim)
+            z_list[0], c_list[0] = self.decoder[0](ey, (z_list[0], c_list[0]))
+            for l in six.moves.range(1, self.dlayers):
+                z_list[l], c_list[l] = self.decoder[l](
+                    z_list[l - 1], (z_list[l], c_list[l]))
+            if rnnlm:
+                state, z_rnnlm = rnnlm.predictor(state, vy)
+                final_z = (1 - recog_args.lm_weight) * F.log_softmax(self.output(z_list[-1]), dim=1) \
+                    + recog_args.lm_weight * F.log_softmax(z_rnnlm, dim=1)
+            else:
+                final_z = F.log_softmax(self.output(z_list[-1]), dim=1)
+            ys = final_z.data.max(1)[1]
+
+            for b in six.moves.range(batch):
+                if ended[b]:
+                    continue
+                y = int(ys[b])
+                y_seqs[b].append(y)
+                # terminate decoding
+                ended[b] = y == self.eos or i + 1 == nsteps[b]
+
+            if all(ended):
+                break
+            vy = Variable(ys, volatile=True)
+
+        return y_seqs
+
     def recognize_beam(self, h, lpz, recog_args, char_list, rnnlm=None):
         '''beam search implementation
 
@@ -6,6 +6,7 @@
 import json
 import logging
 import numpy as np
+import os
 import six
 import sys
 
@@ -52,14 +53,20 @@ def label_smoothing_dist(odim, lsm_type, transcript=None, blank=0):
     :return:
     '''
     if transcript is not None:
-        with open(transcript, 'rb') as f:
-            trans_json = json.load(f)['utts']
+        if os.path.isdir(transcript):
+            # columnar manifest made by json2manifest.py
+            tokens = np.load(os.path.join(transcript, 'tokens.npy'), mmap_mode='r')
+            offsets = np.load(os.path.join(transcript, 'token_offsets.npy'))
+            trans_ids = (tokens[start:end] for start, end in zip(offsets[:-1], offsets[1:]))
+        else:
+            with open(transcript, 'rb') as f:
+                trans_json = json.load(f)['utts']
+            trans_ids = (np.array([int(n) for n in v['tokenid'].split()]) for v in trans_json.values())
 
     if lsm_type == 'unigram':
         assert transcript is not None, 'transcript is required for %s label smoothing' % lsm_type
         labelcount = np.zeros(odim)
-        for k, v in trans_json.items():
-            ids = np.array([int(n) for n in v['tokenid'].split()])
+        for ids in trans_ids:
             # to avoid an error when there is no text in an uttrance
             if len(ids) > 0:
                 labelcount[ids] += 1
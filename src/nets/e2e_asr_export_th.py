@@ -0,0 +1,392 @@
+#!/usr/bin/env python
+
+# Copyright 2018 Johns Hopkins University (Shinji Watanabe)
+#  Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+# TorchScript export of the pytorch E2E model for python-light inference.
+# The encoder, one decoder step and the CTC projection are traced into
+# separate modules, and ExportedE2E drives them with the greedy search or a
+# batched beam search.
+
+from __future__ import division
+
+import json
+import logging
+import os
+
+import numpy as np
+import six
+import torch
+import torch.nn.functional as F
+
+from ctc_prefix_score import CTCPrefixScore
+from e2e_asr_attctc_th import AttAdd
+from e2e_asr_attctc_th import AttDot
+from e2e_asr_attctc_th import AttLoc
+from e2e_asr_attctc_th import BLSTM
+from e2e_asr_attctc_th import BLSTMP
+from e2e_asr_attctc_th import CTC_SCORING_RATIO
+from e2e_asr_attctc_th import NoAtt
+from e2e_asr_attctc_th import VGG2L
+from e2e_asr_common import end_detect
+
+ENCODER_FILE = 'encoder.pt'
+DECODER_STEP_FILE = 'decoder_step.pt'
+CTC_FILE = 'ctc.pt'
+META_FILE = 'model.json'
+
+
+def _vgg2l(vgg, xs):
+    '''VGG2L forward for a single utterance without padding'''
+    xs = xs.view(xs.size(0), xs.size(1), vgg.in_channel,
+                 xs.size(2) // vgg.in_channel).transpose(1, 2)
+    xs = F.relu(vgg.conv1_1(xs))
+    xs = F.relu(vgg.conv1_2(xs))
+    xs = F.max_pool2d(xs, 2, stride=2, ceil_mode=True)
+    xs = F.relu(vgg.conv2_1(xs))
+    xs = F.relu(vgg.conv2_2(xs))
+    xs = F.max_pool2d(xs, 2, stride=2, ceil_mode=True)
+    xs = xs.transpose(1, 2).contiguous()
+    return xs.view(xs.size(0), xs.size(1), xs.size(2) * xs.size(3))
+
+
+def _blstm(blstm, xs):
+    '''BLSTM forward for a single utterance without packing'''
+    ys, _ = blstm.nblstm(xs)
+    return torch.tanh(blstm.l_last(ys))
+
+
+def _blstmp(blstmp, xs):
+    '''BLSTMP forward for a single utterance without packing'''
+    for layer in six.moves.range(blstmp.elayers):
+        ys, _ = getattr(blstmp, 'bilstm' + str(layer))(xs)
+        sub = blstmp.subsample[layer + 1]
+        if sub > 1:
+            ys = ys[:, ::sub]
+        xs = torch.tanh(getattr(blstmp, 'bt' + str(layer))(ys))
+    return xs
+
+
+class EncoderExport(torch.nn.Module):
+    '''Encoder of a single utterance (1 x T x idim) for tracing
+
+    It returns the encoder states and their attention pre-computation,
+    which is computed only once per utterance in the decoder.
+
+    :param Encoder enc: encoder of the E2E model
+    :param torch.nn.Module att: attention of the E2E model
+    '''
+
+    def __init__(self, enc, att):
+        super(EncoderExport, self).__init__()
+        self.enc = enc
+        self.att = att
+
+    def _rnn(self, rnn, xs):
+        if isinstance(rnn, BLSTMP):
+            return _blstmp(rnn, xs)
+        elif isinstance(rnn, BLSTM):
+            return _blstm(rnn, xs)
+        raise NotImplementedError('unsupported encoder: ' + rnn.__class__.__name__)
+
+    def forward(self, xs):
+        if isinstance(self.enc.enc1, VGG2L):
+            hs = self._rnn(self.enc.enc2, _vgg2l(self.enc.enc1, xs))
+        else:
+            hs = self._rnn(self.enc.enc1, xs)
+
+        if isinstance(self.att, AttDot):
+            pre_compute_enc_h = torch.tanh(self.att.mlp_enc(hs))
+        elif isinstance(self.att, (AttAdd, AttLoc)):
+            pre_compute_enc_h = self.att.mlp_enc(hs)
+        else:
+            pre_compute_enc_h = hs
+        return hs, pre_compute_enc_h
+
+
+class DecoderStepExport(torch.nn.Module):
+    '''One decoder step (embed + attention + LSTMCell stack + output) for tracing
+
+    All the inputs are batched over hypotheses (B), and the decoder states
+    are stacked over layers so that the step has a fixed signature.
+
+    :param Decoder dec: decoder of the E2E model
+    '''
+
+    def __init__(self, dec):
+        super(DecoderStepExport, self).__init__()
+        if not isinstance(dec.att, (NoAtt, AttDot, AttAdd, AttLoc)):
+            raise NotImplementedError('export supports only noatt, dot, add, and location attention.')
+        self.dec = dec
+
+    def _attend(self, enc_h, pre_compute_enc_h, dec_z, att_prev, scaling=2.0):
+        att = self.dec.att
+        if isinstance(att, NoAtt):
+            return torch.mean(enc_h, dim=1), att_prev
+        dec_z_tiled = att.mlp_dec(dec_z).unsqueeze(1)
+        if isinstance(att, AttDot):
+            e = torch.sum(pre_compute_enc_h * torch.tanh(dec_z_tiled), dim=2)
+        elif isinstance(att, AttAdd):
+            e = att.gvec(torch.tanh(pre_compute_enc_h + dec_z_tiled)).squeeze(2)
+        else:
+            att_conv = att.loc_conv(att_prev.unsqueeze(1).unsqueeze(1))
+            att_conv = att.mlp_att(att_conv.squeeze(2).transpose(1, 2))
+            e = att.gvec(torch.tanh(att_conv + pre_compute_enc_h + dec_z_tiled)).squeeze(2)
+        w = F.softmax(scaling * e, dim=1)
+        return torch.sum(enc_h * w.unsqueeze(2), dim=1), w
+
+    def forward(self, vy, enc_h, pre_compute_enc_h, att_prev, z_prev, c_prev):
+        '''DecoderStepExport forward
+
+        :param LongTensor vy: previous output labels (B)
+        :param Tensor enc_h: encoder states (B x T x D_enc)
+        :param Tensor pre_compute_enc_h: attention pre-computation (B x T x D_att)
+        :param Tensor att_prev: previous attention weights (B x T)
+        :param Tensor z_prev: previous hidden states (L x B x D_dec)
+        :param Tensor c_prev: previous cell states (L x B x D_dec)
+        :return: log probabilities (B x odim), new states and attention weights
+        '''
+        att_c, att_w = self._attend(enc_h, pre_compute_enc_h, z_prev[0], att_prev)
+        h = torch.cat((self.dec.embed(vy), att_c), dim=1)
+        z_list = []
+        c_list = []
+        for l, cell in enumerate(self.dec.decoder):
+            z, c = cell(h, (z_prev[l], c_prev[l]))
+            z_list.append(z)
+            c_list.append(c)
+            h = z
+        local_scores = F.log_softmax(self.dec.output(h), dim=1)
+        return local_scores, torch.stack(z_list), torch.stack(c_list), att_w
+
+
+class CTCExport(torch.nn.Module):
+    '''CTC projection with log_softmax for tracing'''
+
+    def __init__(self, ctc):
+        super(CTCExport, self).__init__()
+        self.ctc = ctc
+
+    def forward(self, hs):
+        return F.log_softmax(self.ctc.ctc_lo(hs), dim=2)
+
+
+def export(e2e, idim, outdir):
+    '''Trace the encoder, the decoder step and the CTC projection and save them
+
+    :param E2E e2e: pytorch E2E model
+    :param int idim: input feature dimension
+    :param str outdir: output directory
+    '''
+    if not hasattr(torch.jit, 'trace') or not hasattr(torch.jit, 'save'):
+        raise NotImplementedError('tracing is not supported in pytorch ' + torch.__version__)
+    e2e.eval()
+    enc = EncoderExport(e2e.enc, e2e.att)
+    dec = DecoderStepExport(e2e.dec)
+    ctc = CTCExport(e2e.ctc)
+
+    # example inputs only determine the graph, not the sequence lengths
+    with torch.no_grad():
+        xs = torch.randn(1, 64, idim)
+        hs, pre_compute_enc_h = enc(xs)
+        tlen = hs.size(1)
+        vy = torch.LongTensor([e2e.sos])
+        att_prev = torch.ones(1, tlen) / tlen
+        z_prev = torch.zeros(e2e.dec.dlayers, 1, e2e.dec.dunits)
+        c_prev = torch.zeros(e2e.dec.dlayers, 1, e2e.dec.dunits)
+        traced_enc = torch.jit.trace(enc, (xs,), check_trace=False)
+        traced_dec = torch.jit.trace(dec, (vy, hs, pre_compute_enc_h, att_prev, z_prev, c_prev),
+                                     check_trace=False)
+        traced_ctc = torch.jit.trace(ctc, (hs,), check_trace=False)
+
+    if not os.path.exists(outdir):
+        os.makedirs(outdir)
+    torch.jit.save(traced_enc, os.path.join(outdir, ENCODER_FILE))
+    torch.jit.save(traced_dec, os.path.join(outdir, DECODER_STEP_FILE))
+    torch.jit.save(traced_ctc, os.path.join(outdir, CTC_FILE))
+    meta = {'idim': idim, 'sos': e2e.sos, 'eos': e2e.eos,
+            'subsample': int(e2e.subsample[0]),
+            'dlayers': e2e.dec.dlayers, 'dunits': e2e.dec.dunits}
+    with open(os.path.join(outdir, META_FILE), 'w') as f:
+        json.dump(meta, f, indent=4, sort_keys=True)
+    logging.info('exported traced modules to ' + outdir)
+
+
+class ExportedE2E(object):
+    '''E2E recognizer driving the exported modules
+
+    It has the same recognize interface (and results) as E2E, but the
+    hypotheses of the beam are scored in a single batched decoder step.
+
+    :param str modeldir: directory written by export
+    '''
+
+    def __init__(self, modeldir):
+        with open(os.path.join(modeldir, META_FILE), 'r') as f:
+            meta = json.load(f)
+        self.sos = meta['sos']
+        self.eos = meta['eos']
+        self.subsample = meta['subsample']
+        self.dlayers = meta['dlayers']
+        self.dunits = meta['dunits']
+        self.enc = torch.jit.load(os.path.join(modeldir, ENCODER_FILE))
+        self.dec = torch.jit.load(os.path.join(modeldir, DECODER_STEP_FILE))
+        self.ctc = torch.jit.load(os.path.join(modeldir, CTC_FILE))
+
+    def recognize(self, x, recog_args, char_list, rnnlm=None):
+        '''Greedy/beam search with the exported modules
+
+        :param ndarray x: input acouctic feature (T x D)
+        :param namespace recog_args: argment namespace contraining options
+        :param list char_list: list of characters
+        :param torch.nn.Module rnnlm: language model module
+        :return: token id sequence (greedy) or N-best hypotheses (beam)
+        '''
+        x = x[::self.subsample, :]
+        with torch.no_grad():
+            xs = torch.from_numpy(np.array(x, dtype=np.float32)).unsqueeze(0)
+            hs, pre_compute_enc_h = self.enc(xs)
+            if recog_args.beam_size == 1:
+                return self._greedy_search(hs, pre_compute_enc_h, recog_args, rnnlm)
+            if recog_args.ctc_weight > 0.0:
+                lpz = self.ctc(hs)[0].numpy()
+            else:
+                lpz = None
+            return self._beam_search(hs, pre_compute_enc_h, lpz, recog_args, char_list, rnnlm)
+
+    def _greedy_search(self, hs, pre_compute_enc_h, recog_args, rnnlm):
+        '''Greedy search with the same rules as Decoder.recognize (without CTC scores)'''
+        tlen = hs.size(1)
+        maxlen = int(recog_args.maxlenratio * tlen)
+        minlen = int(recog_args.minlenratio * tlen)
+        logging.info('max output length: ' + str(maxlen))
+        logging.info('min output length: ' + str(minlen))
+
+        z_prev = torch.zeros(self.dlayers, 1, self.dunits)
+        c_prev = torch.zeros(self.dlayers, 1, self.dunits)
+        a_prev = torch.ones(1, tlen) / tlen
+        rnnlm_state = None
+        y = self.sos
+        y_seq = []
+        for i in six.moves.range(minlen, maxlen):
+            vy = torch.LongTensor([y])
+            local_scores, z_prev, c_prev, a_prev = self.dec(vy, hs, pre_compute_enc_h, a_prev, z_prev, c_prev)
+            if rnnlm:
+                rnnlm_state, z_rnnlm = rnnlm.predictor(rnnlm_state, vy)
+                local_scores = (1 - recog_args.lm_weight) * local_scores \
+                    + recog_args.lm_weight * F.log_softmax(z_rnnlm, dim=1).data
+            y = int(local_scores.max(1)[1][0])
+            y_seq.append(y)
+
+            # terminate decoding
+            if y == self.eos:
+                break
+
+        return y_seq
+
+    def _beam_search(self, hs, pre_compute_enc_h, lpz, recog_args, char_list, rnnlm):
+        tlen = hs.size(1)
+        beam = recog_args.beam_size
+        ctc_weight = recog_args.ctc_weight
+        if recog_args.maxlenratio == 0:
+            maxlen = tlen
+        else:
+            maxlen = max(1, int(recog_args.maxlenratio * tlen))
+        minlen = int(recog_args.minlenratio * tlen)
+        logging.info('max output length: ' + str(maxlen))
+        logging.info('min output length: ' + str(minlen))
+
+        hyp = {'score': 0.0, 'yseq': [self.sos],
+               'z_prev': torch.zeros(self.dlayers, 1, self.dunits),
+               'c_prev': torch.zeros(self.dlayers, 1, self.dunits),
+               'a_prev': torch.ones(1, tlen) / tlen, 'rnnlm_prev': None}
+        if lpz is not None:
+            ctc_prefix_score = CTCPrefixScore(lpz, 0, self.eos, np)
+            hyp['ctc_state_prev'] = ctc_prefix_score.initial_state()
+            hyp['ctc_score_prev'] = 0.0
+            ctc_beam = min(lpz.shape[-1], int(beam * CTC_SCORING_RATIO))
+        hyps = [hyp]
+        ended_hyps = []
+
+        for i in six.moves.range(maxlen):
+            # run one decoder step for all the hypotheses at once
+            n_hyps = len(hyps)
+            vy = torch.LongTensor([h['yseq'][-1] for h in hyps])
+            local_att_scores, z_list, c_list, att_w = self.dec(
+                vy, hs.expand(n_hyps, -1, -1), pre_compute_enc_h.expand(n_hyps, -1, -1),
+                torch.cat([h['a_prev'] for h in hyps]),
+                torch.cat([h['z_prev'] for h in hyps], dim=1),
+                torch.cat([h['c_prev'] for h in hyps], dim=1))
+            if rnnlm:
+                if hyps[0]['rnnlm_prev'] is None:
+                    rnnlm_state = None
+                else:
+                    rnnlm_state = {k: torch.cat([h['rnnlm_prev'][k] for h in hyps])
+                                   for k in hyps[0]['rnnlm_prev']}
+                rnnlm_state, z_rnnlm = rnnlm.predictor(rnnlm_state, vy)
+                local_lm_scores = F.log_softmax(z_rnnlm, dim=1).data
+
+            hyps_best_kept = []
+            for b, hyp in enumerate(hyps):
+                local_scores = local_att_scores[b:b + 1]
+                if rnnlm:
+                    local_scores = local_scores + recog_args.lm_weight * local_lm_scores[b:b + 1]
+                if lpz is not None:
+                    _, local_best_ids = torch.topk(local_att_scores[b:b + 1], ctc_beam, dim=1)
+                    ctc_scores, ctc_states = ctc_prefix_score(
+                        hyp['yseq'], local_best_ids[0].numpy(), hyp['ctc_state_prev'])
+                    local_scores = \
+                        (1.0 - ctc_weight) * local_att_scores[b:b + 1, local_best_ids[0]] \
+                        + ctc_weight * torch.from_numpy(ctc_scores - hyp['ctc_score_prev'])
+                    if rnnlm:
+                        local_scores += recog_args.lm_weight * local_lm_scores[b:b + 1, local_best_ids[0]]
+                    local_best_scores, joint_best_ids = torch.topk(local_scores, beam, dim=1)
+                    local_best_ids = local_best_ids[:, joint_best_ids[0]]
+                else:
+                    local_best_scores, local_best_ids = torch.topk(local_scores, beam, dim=1)
+
+                for j in six.moves.range(beam):
+                    new_hyp = {}
+                    new_hyp['z_prev'] = z_list[:, b:b + 1]
+                    new_hyp['c_prev'] = c_list[:, b:b + 1]
+                    new_hyp['a_prev'] = att_w[b:b + 1]
+                    new_hyp['score'] = hyp['score'] + float(local_best_scores[0, j])
+                    new_hyp['yseq'] = hyp['yseq'] + [int(local_best_ids[0, j])]
+                    if rnnlm:
+                        new_hyp['rnnlm_prev'] = {k: v[b:b + 1] for k, v in rnnlm_state.items()}
+                    else:
+                        new_hyp['rnnlm_prev'] = None
+                    if lpz is not None:
+                        new_hyp['ctc_state_prev'] = ctc_states[int(joint_best_ids[0, j])]
+                        new_hyp['ctc_score_prev'] = ctc_scores[int(joint_best_ids[0, j])]
+                    hyps_best_kept.append(new_hyp)
+
+                hyps_best_kept = sorted(
+                    hyps_best_kept, key=lambda x: x['score'], reverse=True)[:beam]
+            hyps = hyps_best_kept
+
+            # add eos in the final loop to avoid that there are no ended hyps
+            if i == maxlen - 1:
+                for hyp in hyps:
+                    hyp['yseq'].append(self.eos)
+
+            remained_hyps = []
+            for hyp in hyps:
+                if hyp['yseq'][-1] == self.eos:
+                    if len(hyp['yseq']) > minlen:
+                        hyp['score'] += (i + 1) * recog_args.penalty
+                        ended_hyps.append(hyp)
+                else:
+                    remained_hyps.append(hyp)
+
+            if end_detect(ended_hyps, i) and recog_args.maxlenratio == 0.0:
+                logging.info('end detected at %d', i)
+                break
+            hyps = remained_hyps
+            if len(hyps) == 0:
+                logging.info('no hypothesis. Finish decoding.')
+                break
+
+        nbest_hyps = sorted(
+            ended_hyps, key=lambda x: x['score'], reverse=True)[:min(len(ended_hyps), recog_args.nbest)]
+        logging.info('total log probability: ' + str(nbest_hyps[0]['score']))
+        return nbest_hyps
@@ -0,0 +1,305 @@
+#!/usr/bin/env python
+
+# Copyright 2018 Johns Hopkins University (Shinji Watanabe)
+#  Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+# Chunk-wise streaming recognition with the pytorch E2E model.
+# The BLSTM(P) encoder is run in a latency-controlled way, i.e., the forward
+# LSTMs carry their states over fixed-size chunks while the backward LSTMs
+# only see each chunk and a limited right context, and the CTC outputs of
+# every chunk are decoded incrementally.
+
+from __future__ import division
+
+import collections
+import logging
+
+import numpy as np
+import six
+import torch
+import torch.nn.functional as F
+
+from torch.autograd import Variable
+
+from e2e_asr_attctc_th import BLSTM
+from e2e_asr_attctc_th import BLSTMP
+from e2e_asr_attctc_th import linear_tensor
+from e2e_asr_attctc_th import to_cuda
+
+LOGZERO = -10000000000.0
+
+
+def _direction_lstm(lstm, layer, reverse):
+    '''Make a unidirectional LSTM sharing the parameters of one direction of lstm
+
+    :param torch.nn.LSTM lstm: bidirectional LSTM
+    :param int layer: layer index
+    :param bool reverse: use the backward direction
+    :return: one-layer unidirectional LSTM (batch first)
+    :rtype: torch.nn.LSTM
+    '''
+    suffix = '_l%d' % layer + ('_reverse' if reverse else '')
+    w_ih = getattr(lstm, 'weight_ih' + suffix)
+    w_hh = getattr(lstm, 'weight_hh' + suffix)
+    uni = torch.nn.LSTM(w_ih.size(1), w_hh.size(1), num_layers=1, batch_first=True)
+    for name in ['weight_ih', 'weight_hh', 'bias_ih', 'bias_hh']:
+        setattr(uni, name + '_l0', getattr(lstm, name + suffix))
+    return uni
+
+
+def _reverse_time(x):
+    '''Reverse a (B x T x D) variable along the time axis'''
+    idx = torch.arange(x.size(1) - 1, -1, -1).long()
+    if x.is_cuda:
+        idx = idx.cuda(x.get_device())
+    return x.index_select(1, Variable(idx))
+
+
+class _LCBLSTMLayer(object):
+    '''Latency-controlled BLSTM layer
+
+    :param torch.nn.LSTM lstm: bidirectional LSTM
+    :param int layer: layer index in lstm
+    :param int sub: subsampling factor applied to the outputs
+    :param function proj: projection applied to the outputs
+    '''
+
+    def __init__(self, lstm, layer, sub, proj):
+        self.fwd = _direction_lstm(lstm, layer, False)
+        self.bwd = _direction_lstm(lstm, layer, True)
+        self.sub = sub
+        self.proj = proj
+        self.state = None
+
+    def reset(self):
+        self.state = None
+
+    def __call__(self, xc, xr):
+        '''Process a chunk xc (1 x N x D) with its right context xr (1 x R x D)'''
+        # forward direction: only the state at the end of the chunk is carried
+        yc_f, self.state = self.fwd(xc, self.state)
+        if xr is not None:
+            yr_f, _ = self.fwd(xr, self.state)
+            x = torch.cat([xc, xr], dim=1)
+        else:
+            x = xc
+        # backward direction: start from zero state at the end of the right context
+        y_b = _reverse_time(self.bwd(_reverse_time(x))[0])
+        yc = torch.cat([yc_f, y_b[:, :xc.size(1)]], dim=2)
+        yr = torch.cat([yr_f, y_b[:, xc.size(1):]], dim=2) if xr is not None else None
+
+        if self.sub > 1:
+            yc = yc[:, ::self.sub]
+            yr = yr[:, ::self.sub] if yr is not None else None
+        yc = self.proj(yc)
+        yr = self.proj(yr) if yr is not None else None
+        return yc, yr
+
+
+class StreamingEncoder(object):
+    '''Chunk-wise latency-controlled encoder sharing the parameters of E2E.enc
+
+    Frames are counted after the input subsampling of E2E. Outputs of
+    a chunk are available once chunk_size + right_context frames are read.
+
+    :param E2E e2e: pytorch E2E model with blstm or blstmp encoder
+    :param int chunk_size: number of frames in a chunk
+    :param int right_context: number of look-ahead frames for a chunk
+    '''
+
+    def __init__(self, e2e, chunk_size, right_context):
+        enc1 = e2e.enc.enc1
+        if isinstance(enc1, BLSTMP):
+            self.layers = [_LCBLSTMLayer(getattr(enc1, 'bilstm%d' % i), 0, enc1.subsample[i + 1],
+                                         self._projection(getattr(enc1, 'bt%d' % i)))
+                           for i in six.moves.range(enc1.elayers)]
+        elif isinstance(enc1, BLSTM):
+            nlayers = enc1.nblstm.num_layers
+            self.layers = [_LCBLSTMLayer(enc1.nblstm, i, 1, lambda x: x)
+                           for i in six.moves.range(nlayers - 1)]
+            self.layers.append(_LCBLSTMLayer(enc1.nblstm, nlayers - 1, 1,
+                                             self._projection(enc1.l_last)))
+        else:
+            raise NotImplementedError('streaming supports only blstm and blstmp encoders.')
+        total_sub = int(np.prod([l.sub for l in self.layers]))
+        if chunk_size <= 0 or chunk_size % total_sub != 0:
+            raise ValueError('chunk size must be a positive multiple of the subsampling factor (%d)'
+                             % total_sub)
+        self.e2e = e2e
+        self.input_sub = int(e2e.subsample[0])
+        self.chunk_size = chunk_size
+        self.right_context = right_context
+        self.reset()
+
+    @staticmethod
+    def _projection(linear):
+        return lambda x: torch.tanh(linear_tensor(linear, x))
+
+    def reset(self):
+        '''reset states for a new utterance'''
+        for l in self.layers:
+            l.reset()
+        self.buffer = []
+        self.n_read = 0
+
+    def accept(self, x):
+        '''Read input frames and encode all the chunks that become available
+
+        :param ndarray x: input acoustic features (T x D)
+        :return: encoder outputs of the completed chunks (T' x D_enc) or None
+        '''
+        # input subsampling with the frame index of the whole utterance
+        start = (-self.n_read) % self.input_sub
+        self.n_read += len(x)
+        self.buffer.extend(x[start::self.input_sub])
+        hs = []
+        while len(self.buffer) >= self.chunk_size + self.right_context:
+            hs.append(self._encode_chunk())
+        return torch.cat(hs, dim=0) if hs else None
+
+    def finish(self):
+        '''Encode the remaining frames at the end of the utterance'''
+        hs = []
+        while len(self.buffer) > 0:
+            hs.append(self._encode_chunk())
+        return torch.cat(hs, dim=0) if hs else None
+
+    def _encode_chunk(self):
+        n = min(self.chunk_size, len(self.buffer))
+        xc = self._to_variable(self.buffer[:n])
+        xr = self.buffer[n:n + self.right_context]
+        xr = self._to_variable(xr) if len(xr) > 0 else None
+        del self.buffer[:n]
+        for layer in self.layers:
+            xc, xr = layer(xc, xr)
+        return xc[0]
+
+    def _to_variable(self, frames):
+        x = np.array(frames, dtype=np.float32)[None]
+        return to_cuda(self.e2e, Variable(torch.from_numpy(x), volatile=True))
+
+
+class CTCGreedyDecoder(object):
+    '''Incremental CTC best path decoder
+
+    :param int blank: blank label id
+    '''
+
+    def __init__(self, blank=0):
+        self.blank = blank
+        self.reset()
+
+    def reset(self):
+        self.prev = self.blank
+        self.yseq = []
+
+    def __call__(self, lpz):
+        '''Decode CTC log probabilities of new frames (T x odim)'''
+        for y in np.argmax(lpz, axis=1):
+            if y != self.blank and y != self.prev:
+                self.yseq.append(int(y))
+            self.prev = y
+        return self.best()
+
+    def best(self):
+        return list(self.yseq)
+
+
+class CTCPrefixBeamDecoder(object):
+    '''Incremental CTC prefix beam search
+
+    :param int beam: beam size
+    :param int blank: blank label id
+    '''
+
+    def __init__(self, beam, blank=0):
+        self.beam = beam
+        self.blank = blank
+        self.reset()
+
+    def reset(self):
+        # prefix -> (log prob ending with blank, log prob ending with non-blank)
+        self.hyps = {(): (0.0, LOGZERO)}
+
+    def __call__(self, lpz):
+        '''Decode CTC log probabilities of new frames (T x odim)'''
+        for lp in lpz:
+            # consider only the top labels of the frame
+            cands = [c for c in np.argsort(lp)[::-1][:self.beam + 1] if c != self.blank]
+            next_hyps = collections.defaultdict(lambda: (LOGZERO, LOGZERO))
+            for prefix, (p_b, p_nb) in six.iteritems(self.hyps):
+                p_total = np.logaddexp(p_b, p_nb)
+                n_b, n_nb = next_hyps[prefix]
+                next_hyps[prefix] = (np.logaddexp(n_b, p_total + lp[self.blank]), n_nb)
+                last = prefix[-1] if prefix else None
+                if last is not None and last not in cands:
+                    # keep repeating the last label without emitting it again
+                    n_b, n_nb = next_hyps[prefix]
+                    next_hyps[prefix] = (n_b, np.logaddexp(n_nb, p_nb + lp[last]))
+                for c in cands:
+                    new_prefix = prefix + (int(c),)
+                    n_b, n_nb = next_hyps[new_prefix]
+                    if c == last:
+                        next_hyps[new_prefix] = (n_b, np.logaddexp(n_nb, p_b + lp[c]))
+                        n_b, n_nb = next_hyps[prefix]
+                        next_hyps[prefix] = (n_b, np.logaddexp(n_nb, p_nb + lp[c]))
+                    else:
+                        next_hyps[new_prefix] = (n_b, np.logaddexp(n_nb, p_total + lp[c]))
+            self.hyps = dict(sorted(six.iteritems(next_hyps),
+                                    key=lambda h: -np.logaddexp(*h[1]))[:self.beam])
+        return self.best()
+
+    def best(self):
+        prefix = max(six.iteritems(self.hyps), key=lambda h: np.logaddexp(*h[1]))[0]
+        return list(prefix)
+
+
+class StreamingRecognizer(object):
+    '''Streaming CTC recognizer with a latency-controlled encoder
+
+    :param E2E e2e: pytorch E2E model
+    :param int chunk_size: number of frames in a chunk (after input subsampling)
+    :param int right_context: number of look-ahead frames for a chunk
+    :param int beam: beam size of the CTC prefix search (1 for greedy search)
+    '''
+
+    def __init__(self, e2e, chunk_size, right_context, beam=1):
+        e2e.eval()
+        self.e2e = e2e
+        self.encoder = StreamingEncoder(e2e, chunk_size, right_context)
+        if beam == 1:
+            self.decoder = CTCGreedyDecoder()
+        else:
+            self.decoder = CTCPrefixBeamDecoder(beam)
+
+    def reset(self):
+        self.encoder.reset()
+        self.decoder.reset()
+
+    def accept(self, x):
+        '''Read input frames and return the current best hypothesis'''
+        return self._decode(self.encoder.accept(x))
+
+    def finish(self):
+        '''Flush the remaining frames and return the final hypothesis'''
+        return self._decode(self.encoder.finish())
+
+    def _decode(self, hs):
+        if hs is not None:
+            lpz = F.log_softmax(linear_tensor(self.e2e.ctc.ctc_lo, hs), dim=1)
+            self.decoder(lpz.data.cpu().numpy())
+        return self.decoder.best()
+
+    def recognize(self, x, block_size):
+        '''Simulate streaming recognition of an utterance by feeding blocks of frames
+
+        :param ndarray x: input acoustic features (T x D)
+        :param int block_size: number of input frames fed at once
+        :return: token id sequence
+        :rtype: list
+        '''
+        self.reset()
+        for start in six.moves.range(0, len(x), block_size):
+            y = self.accept(x[start:start + block_size])
+            logging.debug('partial hypothesis at frame %d: %s' % (start + block_size, y))
+        return self.finish()
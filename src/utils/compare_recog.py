@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+# Copyright 2018 Johns Hopkins University (Shinji Watanabe)
+#  Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+# Compare the error rates of two recognition results on the same data,
+# e.g. those of a fp32 model and its int8 dynamically quantized version.
+
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import json
+import logging
+import sys
+
+from score_recog import batch_edit_ops
+from score_recog import encode
+from score_recog import load_char_list
+from score_recog import to_words
+
+
+def error_rates(utts, keys, char_list, eos):
+    '''Compute CER and WER of rec_tokenid against tokenid over keys'''
+    refs = [[char_list[int(i)] for i in utts[k]['tokenid'].split()] for k in keys]
+    hyps = [[char_list[int(i)] for i in utts[k]['rec_tokenid'].split() if int(i) != eos] for k in keys]
+    rates = []
+    for ref_seqs, hyp_seqs in ((refs, hyps), ([to_words(ref) for ref in refs], [to_words(hyp) for hyp in hyps])):
+        vocab = {}
+        n_err = batch_edit_ops(encode(ref_seqs, vocab), encode(hyp_seqs, vocab)).sum()
+        rates.append(100.0 * n_err / max(sum(len(ref) for ref in ref_seqs), 1))
+    return tuple(rates)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('dict', type=str, help='dict')
+    parser.add_argument('base', type=str, help='result json of the baseline (e.g. fp32) model')
+    parser.add_argument('test', type=str, help='result json of the model to be checked (e.g. int8)')
+    parser.add_argument('--threshold', default=0.5, type=float,
+                        help='Maximum allowed absolute degradation of CER (%%)')
+    args = parser.parse_args()
+
+    # logging info
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s (%(module)s:%(lineno)d) %(levelname)s: %(message)s")
+
+    char_list = load_char_list(args.dict)
+    eos = len(char_list) - 1
+    with open(args.base, 'rb') as f:
+        base = json.load(f)['utts']
+    with open(args.test, 'rb') as f:
+        test = json.load(f)['utts']
+    keys = sorted(set(base.keys()) & set(test.keys()))
+    if len(keys) != len(base) or len(keys) != len(test):
+        logging.warning('compare only %d common utterances (%d and %d)' % (len(keys), len(base), len(test)))
+
+    base_cer, base_wer = error_rates(base, keys, char_list, eos)
+    test_cer, test_wer = error_rates(test, keys, char_list, eos)
+    n_diff = sum(1 for k in keys if base[k]['rec_tokenid'] != test[k]['rec_tokenid'])
+    print('#utts: %d (%d hypotheses differ)' % (len(keys), n_diff))
+    print('CER: %.2f -> %.2f (%+.2f)' % (base_cer, test_cer, test_cer - base_cer))
+    print('WER: %.2f -> %.2f (%+.2f)' % (base_wer, test_wer, test_wer - base_wer))
+    if test_cer - base_cer > args.threshold:
+        logging.warning('CER degradation exceeds the threshold (%.2f)' % args.threshold)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
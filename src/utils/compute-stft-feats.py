@@ -3,27 +3,42 @@
 # Copyright 2017 Johns Hopkins University (Shinji Watanabe)
 #  Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
 
-import sys
 import argparse
+import functools
 import logging
-import ConfigParser
-import StringIO
+import math
+import multiprocessing
+import struct
+import sys
+
+from six.moves import configparser
+from six.moves import StringIO
 
 # numerical modules
 import numpy as np
 import scipy.io.wavfile as wav
 
-# from python_speech_features
-from python_speech_features import sigproc
-
 # for kaldi io
 import kaldi_io
 
+WINDOWS = {'rectangular': np.ones, 'hamming': np.hamming, 'hanning': np.hanning}
 
-def cspec(signal, samplerate=16000, winlen=0.025, winstep=0.01,
-          nfft=512, preemph=0.97,
-          winfunc=lambda x: np.ones((x,))):
-    """Compute STFT coeeficients from an audio signal.
+
+def num_frames(num_samples, frame_len, frame_step):
+    """Number of frames of a signal as python_speech_features.sigproc.framesig"""
+    if num_samples <= frame_len:
+        return 1
+    return 1 + int(math.ceil((num_samples - frame_len) / float(frame_step)))
+
+
+def cspec_blocks(signal, samplerate=16000, winlen=0.025, winstep=0.01,
+                 nfft=512, preemph=0.97,
+                 winfunc=lambda x: np.ones((x,)), block_size=1024):
+    """Compute STFT coeeficients from an audio signal block by block.
+    Only the samples of the current block (and the overlap with the next one)
+    are read and framed at a time, so the signal can be a np.memmap of a long file.
+    Frames are views of the signal made with stride tricks; the last frame is
+    padded with zeros as python_speech_features.sigproc.framesig.
     :param signal: the audio signal from which to compute features. Should be an N*1 array
     :param samplerate: the samplerate of the signal we are working with.
     :param winlen: the length of the analysis window in seconds. Default is 0.025s (25 milliseconds)
@@ -32,16 +47,123 @@ def cspec(signal, samplerate=16000, winlen=0.025, winstep=0.01,
     :param preemph: apply preemphasis filter with preemph as coefficient. 0 is no filter. Default is 0.97.
     :param winfunc: the analysis window to apply to each frame. By default no window is applied.
         You can use numpy window functions here e.g. winfunc=np.hamming
-    :returns: 2 values. The first is a numpy array of size (NUMFRAMES by nfilt) containing features.
-        Each row holds 1 feature vector. The second return value is the energy in each frame (total energy, unwindowed)
+    :param block_size: number of frames transformed by a batched FFT at once.
+    :returns: generator of complex64 numpy arrays of size (block_size by nfft / 2 + 1), the last one may be shorter.
     """
-    signal = sigproc.preemphasis(signal, preemph)
-    frames = sigproc.framesig(signal, winlen*samplerate, winstep*samplerate, winfunc)
-    if np.shape(frames)[1] > nfft:
+    frame_len = int(math.floor(winlen * samplerate + 0.5))
+    frame_step = int(math.floor(winstep * samplerate + 0.5))
+    if frame_len > nfft:
         logging.warn('frame length (%d) is greater than FFT size (%d), frame will be truncated. '
-                     + 'Increase NFFT to avoid.', np.shape(frames)[1], nfft)
+                     + 'Increase NFFT to avoid.', frame_len, nfft)
+    window = winfunc(frame_len).astype(np.float32)
+    n_frames = num_frames(len(signal), frame_len, frame_step)
+    for start in range(0, n_frames, block_size):
+        end = min(start + block_size, n_frames)
+        s_start = start * frame_step
+        s_end = (end - 1) * frame_step + frame_len
+        # the previous sample is needed for the preemphasis
+        seg = np.asarray(signal[max(s_start - 1, 0):s_end], dtype=np.float32)
+        if s_start > 0:
+            seg = seg[1:] - preemph * seg[:-1]
+        else:
+            seg = np.append(seg[:1], seg[1:] - preemph * seg[:-1])
+        if len(seg) < s_end - s_start:
+            seg = np.concatenate((seg, np.zeros(s_end - s_start - len(seg), dtype=np.float32)))
+        frames = np.lib.stride_tricks.as_strided(
+            seg, shape=(end - start, frame_len), strides=(frame_step * seg.strides[0], seg.strides[0]))
+        yield np.fft.rfft(frames * window, nfft, axis=1).astype(np.complex64)
+
+
+def cspec(signal, samplerate=16000, winlen=0.025, winstep=0.01,
+          nfft=512, preemph=0.97,
+          winfunc=lambda x: np.ones((x,)), block_size=1024):
+    """Compute STFT coeeficients from an audio signal.
+    See cspec_blocks for the parameters.
+    :returns: a complex64 numpy array of size (NUMFRAMES by nfft / 2 + 1) containing the STFT coefficients.
+    """
+    frame_len = int(math.floor(winlen * samplerate + 0.5))
+    frame_step = int(math.floor(winstep * samplerate + 0.5))
+    spec = np.empty((num_frames(len(signal), frame_len, frame_step), nfft // 2 + 1), dtype=np.complex64)
+    start = 0
+    for block in cspec_blocks(signal, samplerate, winlen, winstep, nfft, preemph, winfunc, block_size):
+        spec[start:start + len(block)] = block
+        start += len(block)
+    return spec
+
 
-    return np.fft.rfft(frames, nfft)
+def to_feat(spec, complex_format):
+    """Convert complex STFT coefficients to float32 features"""
+    if complex_format == 'real-imaginary':
+        return np.hstack((spec.real, spec.imag)).astype(np.float32)
+    else:
+        return np.hstack((np.abs(spec), np.angle(spec))).astype(np.float32)
+
+
+def stft_options(args):
+    return dict(winlen=args.frame_length / 1000.0, winstep=args.frame_shift / 1000.0,
+                nfft=args.fft_size, winfunc=WINDOWS[args.window_type], block_size=args.block_size)
+
+
+def compute_feat(entry, args):
+    """Compute the STFT features of (utt_id, WAV) as float32 array"""
+    (rate, sig) = wav.read(entry[1])
+    return entry[0], to_feat(cspec(sig, samplerate=rate, **stft_options(args)), args.complex_format)
+
+
+class ArkStreamWriter(object):
+    """Write matrices to a Kaldi binary ark incrementally, a block of rows at a time.
+    :param wspecifier: "ark:<file>", "ark:-" or "ark,scp:<file>,<scp file>"
+    """
+
+    def __init__(self, wspecifier):
+        opts, target = wspecifier.split(':', 1)
+        opts = opts.split(',')
+        if 'ark' not in opts:
+            sys.exit('streaming mode only supports ark wspecifiers: ' + wspecifier)
+        self.scp = None
+        if 'scp' in opts:
+            target, scp = target.split(',', 1)
+            self.scp = open(scp, 'w')
+        if target == '-':
+            if self.scp is not None:
+                sys.exit('scp cannot be written with the standard output: ' + wspecifier)
+            self.fd = getattr(sys.stdout, 'buffer', sys.stdout)
+        else:
+            self.fd = open(target, 'wb')
+        self.target = target
+        self.remaining = 0
+
+    def start(self, key, rows, cols):
+        assert self.remaining == 0, 'previous matrix is not completed'
+        self.fd.write((key + ' ').encode('utf-8'))
+        if self.scp is not None:
+            self.scp.write('%s %s:%d\n' % (key, self.target, self.fd.tell()))
+        self.fd.write(b'\0BFM ' + struct.pack('<bibi', 4, rows, 4, cols))
+        self.remaining = rows
+
+    def write_rows(self, rows):
+        self.remaining -= len(rows)
+        assert self.remaining >= 0, 'too many rows'
+        self.fd.write(np.ascontiguousarray(rows, dtype=np.float32).tobytes())
+
+    def close(self):
+        self.fd.flush()
+        if self.target != '-':
+            self.fd.close()
+        if self.scp is not None:
+            self.scp.close()
+
+
+def write_feat_streaming(writer, entry, args):
+    """Compute the STFT features of a memory-mapped WAV block by block and write them incrementally"""
+    (rate, sig) = wav.read(entry[1], mmap=True)
+    if sig.ndim != 1:
+        sys.exit('streaming mode supports only single-channel WAV: ' + entry[1])
+    frame_len = int(math.floor(args.frame_length / 1000.0 * rate + 0.5))
+    frame_step = int(math.floor(args.frame_shift / 1000.0 * rate + 0.5))
+    writer.start(entry[0], num_frames(len(sig), frame_len, frame_step), 2 * (args.fft_size // 2 + 1))
+    for block in cspec_blocks(sig, samplerate=rate, **stft_options(args)):
+        writer.write_rows(to_feat(block, args.complex_format))
 
 
 def main():
@@ -52,11 +174,22 @@ def main():
                         help='Frame length in milliseconds (float, default = 25)')
     parser.add_argument('--frame-shift', type=float, default=10,
                         help='Frame shift in milliseconds (float, default = 10)')
-    parser.add_argument('--window-type', type=str, default='hamming',
-                        help='Type of window ("hamming"|"hanning") (string, default = "hamming")')
+    parser.add_argument('--fft-size', type=int, default=512,
+                        help='FFT size (int, default = 512)')
+    parser.add_argument('--window-type', type=str, default='rectangular', choices=sorted(WINDOWS),
+                        help='Type of window ("rectangular"|"hamming"|"hanning") (string, default = "rectangular")')
     parser.add_argument('--complex-format', type=str, default='real-imaginary',
+                        choices=['real-imaginary', 'magnitude-phase'],
                         help='Format of complex numbers ("real-imaginary"|"magnitude-phase") '
                              + '(string, default = "real-imaginary")')
+    parser.add_argument('--nj', type=int, default=1,
+                        help='Number of processes (int, default = 1)')
+    parser.add_argument('--block-size', type=int, default=1024,
+                        help='Number of frames transformed at once (int, default = 1024)')
+    parser.add_argument('--streaming', type=int, default=0, choices=[0, 1],
+                        help='Memory-map each WAV and write its features block by block, so that the memory '
+                             'does not depend on the length of the recordings. Only with an ark wspecifier '
+                             'and --nj 1 (int, default = 0)')
     parser.add_argument('wav_scp', metavar='IN', type=str,
                         help='WAV scp files (do not accept command line)')
     parser.add_argument('feats_wspecifier', metavar='OUT', type=str,
@@ -67,8 +200,8 @@ def main():
     if args.config is not None:
         ini_str = '[root]\n' + open(args.config, 'r').read()
         ini_str = ini_str.replace('--', '').replace('-', '_')  # remove '--' in the kaldi config
-        ini_fp = StringIO.StringIO(ini_str)
-        config = ConfigParser.RawConfigParser()
+        ini_fp = StringIO(ini_str)
+        config = configparser.RawConfigParser()
         config.readfp(ini_fp)
 
         # set config file values as defaults
@@ -82,22 +215,34 @@ def main():
 
     with open(args.wav_scp, 'r') as f:
         scp = [x.split() for x in f.readlines()]  # list of [utt_id, wav_name]
-
-    writer = kaldi_io.BaseFloatMatrixWriter(args.feats_wspecifier)
-
     for x in scp:
         if len(x) != 2:
             sys.exit("wav.scp must be (utt_id, WAV)")
-        (rate, sig) = wav.read(x[1])
-        feat = cspec(sig, samplerate=rate)
-        if args.complex_format is 'real-imaginary':
-            feat = np.hstack((feat.real, feat.imag))
-        elif args.complex_format is 'magnitude-phase':
-            feat = np.hstack((feat.absolute, feat.angles))
-        else:
-            sys.exit("do not support a complex number format of " + args.complex_format)
-        writer.write(x[0], feat)
+
+    if args.streaming:
+        if args.nj > 1:
+            sys.exit('streaming mode does not support --nj > 1')
+        writer = ArkStreamWriter(args.feats_wspecifier)
+        for x in scp:
+            write_feat_streaming(writer, x, args)
+        writer.close()
+        return
+
+    writer = kaldi_io.BaseFloatMatrixWriter(args.feats_wspecifier)
+
+    # features are computed in parallel and written in the order of wav.scp
+    fn = functools.partial(compute_feat, args=args)
+    if args.nj > 1:
+        pool = multiprocessing.Pool(args.nj)
+        feats = pool.imap(fn, scp, chunksize=4)
+    else:
+        feats = (fn(x) for x in scp)
+    for utt_id, feat in feats:
+        writer.write(utt_id, feat)
+    if args.nj > 1:
+        pool.close()
+        pool.join()
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
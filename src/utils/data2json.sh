@@ -8,8 +8,10 @@
 nlsyms=""
 lang=""
 feat="" # feat.scp
+fbank=false # lengths of the filterbank features computed from wav.scp (wav:<data-dir> of asr_train.py)
 oov="<unk>"
 bpecode=""
+nj=1 # number of processes reading the feature headers, tokenizing the text and merging the scp files
 
 . utils/parse_options.sh
 
@@ -25,19 +27,23 @@ rm -f ${tmpdir}/*.scp
 
 # input, which is not necessary for decoding mode, and make it as an option
 if [ ! -z ${feat} ]; then
-    feat-to-len scp:${feat} ark,t:${tmpdir}/ilen.scp
-    feat-to-dim scp:${feat} ark,t:${tmpdir}/idim.scp
+    feat-to-shape.py --nj ${nj} --ilen ${tmpdir}/ilen.scp --idim ${tmpdir}/idim.scp ${feat}
+elif ${fbank}; then
+    fbank.py ${dir} ${tmpdir}/ilen.scp ${tmpdir}/idim.scp
 fi
 
 # output
 if [ ! -z ${bpecode} ]; then
     paste -d " " <(awk '{print $1}' ${dir}/text) <(cut -f 2- -d" " ${dir}/text | apply_bpe.py -c ${bpecode}) > ${tmpdir}/token.scp
+    cat ${tmpdir}/token.scp | utils/sym2int.pl --map-oov ${oov} -f 2- ${dic} > ${tmpdir}/tokenid.scp
 elif [ ! -z ${nlsyms} ]; then
-    text2token.py -s 1 -n 1 -l ${nlsyms} ${dir}/text > ${tmpdir}/token.scp
+    # token ids are written by text2token.py (as sym2int.pl)
+    text2token.py -s 1 -n 1 -l ${nlsyms} --nj ${nj} --dict ${dic} --oov ${oov} --tokenid ${tmpdir}/tokenid.scp \
+        ${dir}/text > ${tmpdir}/token.scp
 else
-    text2token.py -s 1 -n 1 ${dir}/text > ${tmpdir}/token.scp
+    text2token.py -s 1 -n 1 --nj ${nj} --dict ${dic} --oov ${oov} --tokenid ${tmpdir}/tokenid.scp \
+        ${dir}/text > ${tmpdir}/token.scp
 fi
-cat ${tmpdir}/token.scp | utils/sym2int.pl --map-oov ${oov} -f 2- ${dic} > ${tmpdir}/tokenid.scp
 cat ${tmpdir}/tokenid.scp | awk '{print $1 " " NF-1}' > ${tmpdir}/olen.scp 
 # +2 comes from CTC blank and EOS
 vocsize=`tail -n 1 ${dic} | awk '{print $2}'`
@@ -49,10 +55,5 @@ if [ ! -z ${lang} ]; then
     awk -v lang=${lang} '{print $1 " " lang}' ${dir}/text > ${tmpdir}/lang.scp
 fi
 
-rm -f ${tmpdir}/*.json
-for x in ${dir}/text ${dir}/utt2spk ${tmpdir}/*.scp; do
-    k=`basename ${x} .scp`
-    cat ${x} | scp2json.py --key ${k} > ${tmpdir}/${k}.json
-done
-mergejson.py ${tmpdir}/*.json 
+mergescp.py --nj ${nj} ${dir}/text ${dir}/utt2spk ${tmpdir}/*.scp
 rm -fr ${tmpdir}
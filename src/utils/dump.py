@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+# Copyright 2018 Johns Hopkins University (Shinji Watanabe)
+#  Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+# Dump features with CMVN (and deltas) applied as dump.sh does, using a
+# process pool instead of Kaldi pipes. Features are written as sharded
+# ark/scp files or as a feature store. Completed shards are skipped when the
+# same command is run again, so that a partially completed dump is resumed.
+# The shards and the options are recorded in layout.json of the output
+# directory, and a dump is resumed only when they are the same.
+
+from __future__ import division
+
+import argparse
+import hashlib
+import io
+import json
+import logging
+import multiprocessing
+import os
+import re
+import shutil
+
+import kaldi_io_py
+
+from feat_transform import make_transform
+import lazy_io
+
+
+def read_scp(scp):
+    '''Read scp into a list of (key, rxfile)'''
+    with io.open(scp, 'r', encoding='utf-8') as f:
+        return [tuple(line.rstrip('\n').split(' ', 1)) for line in f if line.strip()]
+
+
+def split_list(entries, n):
+    '''Split a list into n contiguous parts as utils/split_scp.pl'''
+    n = min(n, max(len(entries), 1))
+    return [entries[len(entries) * i // n:len(entries) * (i + 1) // n] for i in range(n)]
+
+
+def shard_layout(shards, args):
+    '''Shards (hashes of their entries) and options determining the dumped features'''
+    return {'format': args.format,
+            'dtype': args.dtype,
+            'cmvnark': os.path.abspath(args.cmvnark),
+            'utt2spk': os.path.abspath(args.utt2spk) if args.utt2spk is not None else None,
+            'norm_vars': args.norm_vars,
+            'delta_order': args.delta_order,
+            'shards': [hashlib.md5(u''.join(u'%s %s\n' % entry for entry in entries).encode('utf-8')).hexdigest()
+                       for entries in shards]}
+
+
+def find_shards(dumpdir):
+    '''Names of the completed shards in a directory'''
+    return [x for x in os.listdir(dumpdir) if re.match(r'^(feats\.\d+\.scp|store\.\d+)$', x)]
+
+
+def dump_shard(job):
+    '''Dump the features of a shard (run in a worker process)'''
+    n, entries, args = job
+    transform = make_transform(args.cmvnark, args.utt2spk, bool(args.norm_vars), args.delta_order)
+    reader = lazy_io.ArkReader()
+
+    def feats():
+        for key, rxfile in entries:
+            rxfile = lazy_io.parse_rxfile(rxfile)
+            if isinstance(rxfile, tuple):
+                mat = reader.read(*rxfile)
+            else:
+                mat = kaldi_io_py.read_mat(rxfile)
+            yield key, transform(mat, key) if transform is not None else mat
+
+    if args.format == 'store':
+        # the shard is renamed when it is completed
+        outdir = os.path.join(args.dumpdir, 'store.%d' % n)
+        if os.path.exists(outdir + '.tmp'):
+            shutil.rmtree(outdir + '.tmp')
+        with lazy_io.FeatStoreWriter(outdir + '.tmp', args.dtype) as writer:
+            for key, mat in feats():
+                writer.write(key, mat)
+        os.rename(outdir + '.tmp', outdir)
+    else:
+        # the scp is written when the ark is completed
+        ark = os.path.join(args.dumpdir, 'feats.%d.ark' % n)
+        scp = []
+        with open(ark, 'wb') as f:
+            for key, mat in feats():
+                f.write((key + ' ').encode('utf-8'))
+                scp.append(u'%s %s:%d\n' % (key, ark, f.tell()))
+                kaldi_io_py.write_mat(f, mat)
+        with io.open(os.path.join(args.dumpdir, 'feats.%d.scp.tmp' % n), 'w', encoding='utf-8') as f:
+            f.writelines(scp)
+        os.rename(os.path.join(args.dumpdir, 'feats.%d.scp.tmp' % n),
+                  os.path.join(args.dumpdir, 'feats.%d.scp' % n))
+    reader.close()
+    return n, len(entries)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('scp', type=str,
+                        help='feats.scp of the source features')
+    parser.add_argument('cmvnark', type=str,
+                        help='CMVN statistics (cmvn.ark of compute-cmvn-stats)')
+    parser.add_argument('dumpdir', type=str,
+                        help='Output directory')
+    parser.add_argument('--nj', default=multiprocessing.cpu_count(), type=int,
+                        help='Number of worker processes')
+    parser.add_argument('--nshards', default=0, type=int,
+                        help='Number of output shards (default: nj, or that of the dump being resumed). '
+                             'More shards make the unit of resuming smaller')
+    parser.add_argument('--utt2spk', type=str, default=None,
+                        help='utt2spk file to apply per-speaker CMVN statistics (global statistics if not given)')
+    parser.add_argument('--norm-vars', default=1, type=int, choices=[0, 1],
+                        help='Normalize variances as well as means in CMVN')
+    parser.add_argument('--delta-order', default=0, type=int,
+                        help='Order of the deltas (2 as add-deltas, 0 for no deltas)')
+    parser.add_argument('--format', default='ark', type=str, choices=['ark', 'store'],
+                        help='Output format: Kaldi ark/scp (feats.scp) or feature store (store/)')
+    parser.add_argument('--dtype', default='float32', type=str, choices=['float32', 'float16'],
+                        help='Data type of the feature store')
+    args = parser.parse_args()
+
+    # logging info
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s (%(module)s:%(lineno)d) %(levelname)s: %(message)s")
+
+    if not os.path.exists(args.dumpdir):
+        os.makedirs(args.dumpdir)
+    args.dumpdir = os.path.abspath(args.dumpdir)
+    entries = read_scp(args.scp)
+    nshards = args.nshards if args.nshards > 0 else args.nj
+    layout_file = os.path.join(args.dumpdir, 'layout.json')
+    if os.path.exists(layout_file):
+        with io.open(layout_file, 'r', encoding='utf-8') as f:
+            prev_layout = json.load(f)
+        if args.nshards <= 0:
+            # the number of shards of the previous run is used regardless of --nj
+            nshards = len(prev_layout['shards'])
+    else:
+        prev_layout = None
+    shards = split_list(entries, nshards)
+    layout = shard_layout(shards, args)
+    if prev_layout is not None:
+        if prev_layout != layout:
+            raise ValueError('%s was dumped from different utterances, shards or options (see %s). '
+                             'Remove the directory to dump again' % (args.dumpdir, layout_file))
+    else:
+        if len(find_shards(args.dumpdir)) > 0:
+            raise ValueError('%s has shards of an unknown layout (e.g. %s). Remove them to dump again'
+                             % (args.dumpdir, find_shards(args.dumpdir)[0]))
+        with io.open(layout_file, 'wb') as f:
+            f.write(json.dumps(layout, indent=4, sort_keys=True, ensure_ascii=False).encode('utf-8'))
+
+    # skip the completed shards
+    def done(n):
+        if args.format == 'store':
+            return os.path.exists(os.path.join(args.dumpdir, 'store.%d' % n))
+        return os.path.exists(os.path.join(args.dumpdir, 'feats.%d.scp' % n))
+    jobs = [(n, entries, args) for n, entries in enumerate(shards, 1) if not done(n)]
+    if len(jobs) < len(shards):
+        logging.info('resume dumping: %d of %d shards are already completed' % (len(shards) - len(jobs), len(shards)))
+
+    pool = multiprocessing.Pool(min(args.nj, max(len(jobs), 1)))
+    try:
+        for n, n_utts in pool.imap_unordered(dump_shard, jobs):
+            logging.info('dumped %d utterances in shard %d' % (n_utts, n))
+    finally:
+        pool.close()
+        pool.join()
+
+    # concatenate the shards
+    if args.format == 'store':
+        lazy_io.merge_stores([os.path.join(args.dumpdir, 'store.%d' % n) for n in range(1, len(shards) + 1)],
+                             os.path.join(args.dumpdir, 'store'))
+        logging.info('succeeded dumping features to %s' % os.path.join(args.dumpdir, 'store'))
+    else:
+        with io.open(os.path.join(args.dumpdir, 'feats.scp'), 'w', encoding='utf-8') as f:
+            for n in range(1, len(shards) + 1):
+                with io.open(os.path.join(args.dumpdir, 'feats.%d.scp' % n), 'r', encoding='utf-8') as g:
+                    shutil.copyfileobj(g, f)
+        logging.info('succeeded dumping features to %s' % os.path.join(args.dumpdir, 'feats.scp'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,276 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+# Copyright 2018 Johns Hopkins University (Shinji Watanabe)
+#  Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+# Log-mel filterbank features computed in python from the audio of a Kaldi
+# data directory (wav.scp and optionally segments), with the configuration of
+# the recipes (conf/fbank.conf) and the defaults of compute-fbank-feats.
+# The training and recognition scripts read them with "wav:<data dir>"
+# instead of the dumped features, so that training can start without
+# make_fbank_pitch.sh and dump.sh. Run as a script, it writes the number of
+# frames and the dimension of each utterance for data2json.sh.
+
+from __future__ import division
+
+import argparse
+import io
+import json
+import logging
+import os
+import subprocess
+import wave
+
+import numpy as np
+
+import kaldi_io_py
+
+FLT_EPSILON = np.finfo(np.float32).eps
+
+
+def mel_scale(freq):
+    return 1127.0 * np.log(1.0 + freq / 700.0)
+
+
+def mel_banks(num_bins, nfft, samplerate, low_freq=20.0, high_freq=0.0):
+    '''Triangular mel filters of Kaldi's MelBanks
+
+    :param int num_bins: number of mel bins
+    :param int nfft: FFT size
+    :param int samplerate: sampling frequency
+    :param float low_freq: low cutoff frequency
+    :param float high_freq: high cutoff frequency (if <= 0, offset from the Nyquist frequency)
+    :return: filter weights (nfft / 2 + 1 x num_bins), which are zero at the Nyquist frequency
+    :rtype: ndarray
+    '''
+    nyquist = 0.5 * samplerate
+    if high_freq <= 0.0:
+        high_freq += nyquist
+    mel_low, mel_high = mel_scale(low_freq), mel_scale(high_freq)
+    delta = (mel_high - mel_low) / (num_bins + 1)
+    left = mel_low + delta * np.arange(num_bins)
+    center, right = left + delta, left + 2 * delta
+    mel = mel_scale(np.arange(nfft // 2) * samplerate / float(nfft))[:, None]
+    weights = np.where(mel <= center, (mel - left) / (center - left), (right - mel) / (right - center))
+    weights[(mel <= left) | (mel >= right)] = 0.0
+    return np.vstack((weights, np.zeros((1, num_bins)))).astype(np.float32)
+
+
+class Fbank(object):
+    '''Log-mel filterbank as compute-fbank-feats (with --dither=0)
+
+    :param int samplerate: sampling frequency
+    :param int num_mel_bins: number of mel bins
+    :param float frame_length: frame length in milliseconds
+    :param float frame_shift: frame shift in milliseconds
+    :param float preemph: preemphasis coefficient
+    :param float low_freq: low cutoff frequency of the mel bins
+    :param float high_freq: high cutoff frequency of the mel bins (if <= 0, offset from the Nyquist frequency)
+    '''
+
+    def __init__(self, samplerate=16000, num_mel_bins=80, frame_length=25.0, frame_shift=10.0,
+                 preemph=0.97, low_freq=20.0, high_freq=0.0):
+        self.samplerate = samplerate
+        self.num_mel_bins = num_mel_bins
+        self.frame_len = int(samplerate * frame_length / 1000.0)
+        self.frame_step = int(samplerate * frame_shift / 1000.0)
+        self.preemph = preemph
+        self.nfft = 1 << (self.frame_len - 1).bit_length()
+        # povey window
+        self.window = (0.5 - 0.5 * np.cos(2 * np.pi * np.arange(self.frame_len) / (self.frame_len - 1))) ** 0.85
+        self.window = self.window.astype(np.float32)
+        self.banks = mel_banks(num_mel_bins, self.nfft, samplerate, low_freq, high_freq)
+        self.config = dict(samplerate=samplerate, num_mel_bins=num_mel_bins, frame_length=frame_length,
+                           frame_shift=frame_shift, preemph=preemph, low_freq=low_freq, high_freq=high_freq)
+
+    def num_frames(self, num_samples):
+        '''Number of frames of num_samples samples (--snip-edges=true)'''
+        if num_samples < self.frame_len:
+            return 0
+        return 1 + (num_samples - self.frame_len) // self.frame_step
+
+    def __call__(self, signal):
+        '''Compute the features (T x num_mel_bins) of a signal in the range of int16'''
+        n_frames = self.num_frames(len(signal))
+        signal = np.ascontiguousarray(signal, dtype=np.float32)
+        frames = np.lib.stride_tricks.as_strided(
+            signal, shape=(n_frames, self.frame_len),
+            strides=(self.frame_step * signal.strides[0], signal.strides[0]))
+        # remove DC offset, preemphasis and windowing of each frame
+        frames = frames - frames.mean(axis=1, keepdims=True)
+        frames = np.hstack((frames[:, :1] * (1 - self.preemph), frames[:, 1:] - self.preemph * frames[:, :-1]))
+        spec = np.fft.rfft(frames * self.window, self.nfft, axis=1)
+        power = (spec.real ** 2 + spec.imag ** 2).astype(np.float32)
+        return np.log(np.maximum(power.dot(self.banks), FLT_EPSILON))
+
+
+def read_table(filename):
+    '''Read a Kaldi table (e.g. wav.scp) into a list of (key, value)'''
+    with io.open(filename, 'r', encoding='utf-8') as f:
+        return [tuple(line.strip().split(None, 1)) for line in f if line.strip()]
+
+
+def read_segments(filename):
+    '''Read segments into a list of (utt, (reco, start, end))'''
+    segments = []
+    for utt, value in read_table(filename):
+        reco, start, end = value.split()
+        segments.append((utt, (reco, float(start), float(end))))
+    return segments
+
+
+def read_wav(rxfile, start=0.0, end=None):
+    '''Read samples of a wav.scp entry as int16
+
+    :param str rxfile: WAV file, or command ending with "|" writing WAV to the standard output
+    :param float start: start time in seconds
+    :param float end: end time in seconds (None for the end of the file)
+    :return: sampling frequency and samples of the first channel
+    :rtype: tuple
+    '''
+    if rxfile.endswith('|'):
+        f = io.BytesIO(subprocess.check_output(rxfile[:-1], shell=True))
+    else:
+        f = open(rxfile, 'rb')
+    w = wave.open(f)
+    try:
+        if w.getsampwidth() != 2:
+            raise ValueError('only 16 bit PCM WAV is supported: ' + rxfile)
+        rate = w.getframerate()
+        begin = int(start * rate)
+        w.setpos(begin)
+        n = w.getnframes() - begin if end is None else int(end * rate) - begin
+        data = np.frombuffer(w.readframes(n), dtype='<i2')
+        return rate, data[::w.getnchannels()]
+    finally:
+        w.close()
+        f.close()
+
+
+def num_samples(rxfile, start=0.0, end=None):
+    '''Number of samples of a wav.scp entry (read from the header unless it is a command)'''
+    if rxfile.endswith('|'):
+        rate, data = read_wav(rxfile, start, end)
+        return rate, len(data)
+    w = wave.open(rxfile, 'rb')
+    try:
+        rate = w.getframerate()
+        total = w.getnframes()
+    finally:
+        w.close()
+    begin = int(start * rate)
+    return rate, (total if end is None else min(int(end * rate), total)) - begin
+
+
+class WavFbankDict(object):
+    '''Lazy dictionary of filterbank features computed from a Kaldi data directory
+
+    :param str data_dir: directory with wav.scp (and segments)
+    :param Fbank fbank: feature extractor (Fbank() if None)
+    :param str cache_dir: directory to keep the computed features as .npy files (None for no cache)
+    '''
+
+    def __init__(self, data_dir, fbank=None, cache_dir=None):
+        self.fbank = fbank if fbank is not None else Fbank()
+        wavs = dict(read_table(os.path.join(data_dir, 'wav.scp')))
+        if os.path.exists(os.path.join(data_dir, 'segments')):
+            self.entries = [(utt, (wavs[reco], start, end))
+                            for utt, (reco, start, end) in read_segments(os.path.join(data_dir, 'segments'))]
+        else:
+            self.entries = [(utt, (rxfile, 0.0, None)) for utt, rxfile in sorted(wavs.items())]
+        self.index = dict(self.entries)
+        self.cache_dir = cache_dir
+        if cache_dir is not None:
+            self._check_cache()
+
+    def _check_cache(self):
+        # the cached features must be computed with the same configuration
+        config_file = os.path.join(self.cache_dir, 'fbank.json')
+        if os.path.exists(config_file):
+            with open(config_file, 'r') as f:
+                if json.load(f) != self.fbank.config:
+                    raise ValueError('fbank configuration differs from the one of the cache: ' + self.cache_dir)
+        else:
+            if not os.path.exists(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            with open(config_file, 'w') as f:
+                json.dump(self.fbank.config, f)
+
+    def compute(self, key):
+        '''Compute the features of utterance key (str)'''
+        rxfile, start, end = self.index[key]
+        rate, signal = read_wav(rxfile, start, end)
+        if rate != self.fbank.samplerate:
+            raise ValueError('sampling frequency of %s is %d, not %d' % (key, rate, self.fbank.samplerate))
+        return self.fbank(signal)
+
+    def __getitem__(self, item):
+        key = item.decode('utf-8') if isinstance(item, bytes) else item
+        if self.cache_dir is None:
+            return self.compute(key)
+        path = os.path.join(self.cache_dir, key.replace(os.sep, '_') + '.npy')
+        if os.path.exists(path):
+            return np.load(path)
+        feat = self.compute(key)
+        # written atomically since several workers may compute the same utterance
+        tmp = '%s.%d.tmp' % (path, os.getpid())
+        with open(tmp, 'wb') as f:
+            np.save(f, feat)
+        os.rename(tmp, path)
+        return feat
+
+    def read_batch(self, items):
+        return [self[item] for item in items]
+
+    def items(self):
+        '''Generator of (key, features) in the order of the data directory'''
+        for key, _ in self.entries:
+            yield key, self[key]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('data_dir', type=str,
+                        help='Kaldi data directory with wav.scp (and segments)')
+    parser.add_argument('ilen', type=str,
+                        help='Output file of the number of frames of each utterance')
+    parser.add_argument('idim', type=str,
+                        help='Output file of the feature dimension of each utterance')
+    parser.add_argument('--num-mel-bins', default=80, type=int,
+                        help='Number of mel bins')
+    parser.add_argument('--samplerate', default=16000, type=int,
+                        help='Sampling frequency')
+    parser.add_argument('--cmvn', type=str, default=None,
+                        help='Output file of the global CMVN statistics (as compute-cmvn-stats). '
+                             'All the features are computed if given, otherwise only the headers are read')
+    parser.add_argument('--cache-dir', type=str, default=None,
+                        help='Directory to cache the features computed for --cmvn')
+    args = parser.parse_args()
+
+    # logging info
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s (%(module)s:%(lineno)d) %(levelname)s: %(message)s")
+
+    fbank = Fbank(args.samplerate, args.num_mel_bins)
+    feats = WavFbankDict(args.data_dir, fbank, args.cache_dir)
+    stats = np.zeros((2, args.num_mel_bins + 1))
+    with io.open(args.ilen, 'w', encoding='utf-8') as flen, io.open(args.idim, 'w', encoding='utf-8') as fdim:
+        for key, (rxfile, start, end) in feats.entries:
+            if args.cmvn is not None:
+                feat = feats[key]
+                n_frames = len(feat)
+                stats[0, :-1] += feat.sum(axis=0)
+                stats[1, :-1] += (feat.astype(np.float64) ** 2).sum(axis=0)
+                stats[0, -1] += n_frames
+            else:
+                n_frames = fbank.num_frames(num_samples(rxfile, start, end)[1])
+            flen.write(u'%s %d\n' % (key, n_frames))
+            fdim.write(u'%s %d\n' % (key, args.num_mel_bins))
+    if args.cmvn is not None:
+        with open(args.cmvn, 'wb') as f:
+            kaldi_io_py.write_mat(f, stats)
+    logging.info('processed %d utterances in %s' % (len(feats.entries), args.data_dir))
+
+
+if __name__ == '__main__':
+    main()
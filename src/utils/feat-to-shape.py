@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+# Copyright 2018 Johns Hopkins University (Shinji Watanabe)
+#  Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+# Get the lengths and dimensions of Kaldi features as feat-to-len and
+# feat-to-dim, reading only the matrix headers (including compressed
+# matrices) at the offsets of feats.scp. The ark files are processed in
+# parallel, and the results are written as ilen.scp/idim.scp of data2json.sh
+# or into the ilen/idim columns of a manifest made by json2manifest.py.
+
+import argparse
+import io
+import logging
+import multiprocessing
+import os
+
+import numpy as np
+
+import lazy_io
+
+
+def read_scp(path):
+    '''List of (key, rxfile) of an scp, where rxfile is parsed by lazy_io.parse_rxfile'''
+    entries = []
+    fd = lazy_io.open_or_fd(path)
+    try:
+        for line in fd:
+            key, rxfile = line.decode('utf-8').split(' ', 1)
+            entries.append((key, lazy_io.parse_rxfile(rxfile)))
+    finally:
+        if fd is not path:
+            fd.close()
+    return entries
+
+
+def read_shapes(entries):
+    '''(rows, cols) of the matrices of (key, rxfile) entries, read in the order of the offsets'''
+    reader = lazy_io.ArkReader(max_open=1)
+    shapes = [None] * len(entries)
+    for i in sorted(range(len(entries)), key=lambda i: entries[i][1] if isinstance(entries[i][1], tuple)
+                    else (entries[i][1], -1)):
+        rxfile = entries[i][1]
+        if isinstance(rxfile, tuple):
+            shapes[i] = reader.read_shape(*rxfile)
+        else:
+            # pipes and other rxfiles are read as a whole
+            shapes[i] = lazy_io.read_mat(rxfile).shape
+    reader.close()
+    return shapes
+
+
+def make_jobs(entries, nj):
+    '''Split entries into jobs of the same ark file with up to len(entries) / nj entries'''
+    groups = {}
+    for i, (_, rxfile) in enumerate(entries):
+        groups.setdefault(rxfile[0] if isinstance(rxfile, tuple) else None, []).append(i)
+    size = max(1, -(-len(entries) // nj))
+    jobs = []
+    for _, indices in sorted(groups.items(), key=lambda group: group[1][0]):
+        for start in range(0, len(indices), size):
+            jobs.append(indices[start:start + size])
+    return jobs
+
+
+def write_scp(path, keys, values):
+    with io.open(path, 'w', encoding='utf-8') as f:
+        f.writelines(u'%s %d\n' % (key, value) for key, value in zip(keys, values))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('scp', type=str,
+                        help='feats.scp of the features')
+    parser.add_argument('--ilen', type=str, default=None,
+                        help='Output file of the number of frames (as feat-to-len ark,t:)')
+    parser.add_argument('--idim', type=str, default=None,
+                        help='Output file of the feature dimension (as feat-to-dim ark,t:)')
+    parser.add_argument('--manifest', type=str, default=None,
+                        help='Manifest directory whose ilen/idim columns are written')
+    parser.add_argument('--nj', default=1, type=int,
+                        help='Number of processes reading the headers in parallel')
+    args = parser.parse_args()
+
+    # logging info
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s (%(module)s:%(lineno)d) %(levelname)s: %(message)s")
+
+    if args.ilen is None and args.idim is None and args.manifest is None:
+        parser.error('at least one of --ilen, --idim and --manifest is required')
+
+    entries = read_scp(args.scp)
+    jobs = make_jobs(entries, args.nj)
+    if args.nj > 1 and len(jobs) > 1:
+        pool = multiprocessing.Pool(min(args.nj, len(jobs)))
+        results = pool.map(read_shapes, [[entries[i] for i in job] for job in jobs], chunksize=1)
+        pool.close()
+        pool.join()
+    else:
+        results = [read_shapes([entries[i] for i in job]) for job in jobs]
+    shapes = np.zeros((len(entries), 2), dtype=np.int64)
+    for job, result in zip(jobs, results):
+        shapes[job] = result
+    logging.info('read the headers of %d matrices in %d jobs' % (len(entries), len(jobs)))
+
+    keys = [key for key, _ in entries]
+    if args.ilen is not None:
+        write_scp(args.ilen, keys, shapes[:, 0])
+    if args.idim is not None:
+        write_scp(args.idim, keys, shapes[:, 1])
+    if args.manifest is not None:
+        index = dict((key, i) for i, key in enumerate(keys))
+        manifest_keys = lazy_io.Manifest(args.manifest).keys()
+        missing = [key for key in manifest_keys if key not in index]
+        if len(missing) > 0:
+            raise ValueError('%d utterances of the manifest are not in %s (e.g. %s)'
+                             % (len(missing), args.scp, missing[0]))
+        rows = np.array([index[key] for key in manifest_keys], dtype=np.int64)
+        for j, name in enumerate(['ilen', 'idim']):
+            np.save(os.path.join(args.manifest, name + '.npy'), shapes[rows, j].astype(np.int32))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+
+# Copyright 2018 Johns Hopkins University (Shinji Watanabe)
+#  Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+# Feature normalization and delta computation done in python, which give the
+# same results as "apply-cmvn --norm-vars=true ... | add-deltas ..." of Kaldi.
+
+import io
+
+import numpy as np
+
+import kaldi_io_py
+
+
+def read_utt2spk(utt2spk_file):
+    '''Read utt2spk file into a dict'''
+    utt2spk = {}
+    with io.open(utt2spk_file, 'r', encoding='utf-8') as f:
+        for line in f:
+            utt, spk = line.split()
+            utt2spk[utt] = spk
+    return utt2spk
+
+
+class CMVN(object):
+    '''Mean and variance normalization with Kaldi CMVN statistics
+
+    :param str stats_file: output of compute-cmvn-stats, i.e., global statistics
+        (a single matrix), or per-speaker statistics (an ark) if utt2spk is given
+    :param str utt2spk: utt2spk file to look up the statistics of each utterance
+    :param bool norm_vars: normalize variances as well as means
+    '''
+
+    def __init__(self, stats_file, utt2spk=None, norm_vars=True):
+        self.norm_vars = norm_vars
+        if utt2spk is None:
+            self.utt2spk = None
+            self.stats = {None: self._parse(kaldi_io_py.read_mat(stats_file))}
+        else:
+            self.utt2spk = read_utt2spk(utt2spk)
+            self.stats = dict((spk, self._parse(stats))
+                              for spk, stats in kaldi_io_py.read_mat_ark(stats_file))
+
+    def _parse(self, stats):
+        # stats: [[sum_1, ..., sum_D, count], [sum of squares_1, ..., sum of squares_D, 0]]
+        count = stats[0, -1]
+        mean = stats[0, :-1] / count
+        if self.norm_vars:
+            var = np.maximum(stats[1, :-1] / count - mean * mean, 1e-20)
+            scale = 1.0 / np.sqrt(var)
+        else:
+            scale = np.ones_like(mean)
+        return mean.astype(np.float32), scale.astype(np.float32)
+
+    def __call__(self, x, key=None):
+        '''Normalize features x (T x D) of utterance key'''
+        mean, scale = self.stats[self.utt2spk[key] if self.utt2spk is not None else None]
+        return (x - mean) * scale
+
+
+def delta_filters(order, window=2):
+    '''Filters of delta features of each order as Kaldi's DeltaFeatures
+
+    :param int order: maximum order of the deltas
+    :param int window: window size of each delta
+    :return: list of filters, whose i-th element has the length of 2 * i * window + 1
+    :rtype: list
+    '''
+    filters = [np.ones(1)]
+    normalizer = 2.0 * sum(j * j for j in range(1, window + 1))
+    for _ in range(order):
+        # scales[j + k] += j * prev_scales[k] for j in [-window, window]
+        filters.append(np.convolve(filters[-1], np.arange(-window, window + 1)) / normalizer)
+    return filters
+
+
+def add_deltas(x, order=2, window=2):
+    '''Append delta features to x (T x D) as "add-deltas" of Kaldi
+
+    :param ndarray x: input features (T x D)
+    :param int order: order of the deltas
+    :param int window: window size of each delta
+    :return: features with deltas (T x D * (order + 1))
+    :rtype: ndarray
+    '''
+    if order == 0:
+        return x
+    filters = delta_filters(order, window)
+    n_pad = order * window
+    # frames are repeated at the edges
+    xpad = np.pad(x, ((n_pad, n_pad), (0, 0)), mode='edge')
+    n_frames = len(x)
+    ys = [x]
+    for f in filters[1:]:
+        offset = n_pad - (len(f) - 1) // 2
+        y = np.zeros_like(x)
+        for j, c in enumerate(f):
+            if c != 0:
+                y += c * xpad[offset + j:offset + j + n_frames]
+        ys.append(y)
+    return np.concatenate(ys, axis=1)
+
+
+class FeatTransform(object):
+    '''CMVN followed by delta computation
+
+    :param CMVN cmvn: CMVN applied first (or None)
+    :param int delta_order: order of the deltas (0 for no deltas)
+    '''
+
+    def __init__(self, cmvn=None, delta_order=0):
+        self.cmvn = cmvn
+        self.delta_order = delta_order
+
+    def __call__(self, x, key=None):
+        if self.cmvn is not None:
+            x = self.cmvn(x, key)
+        return add_deltas(x, self.delta_order).astype(np.float32)
+
+
+class TransformedDict(object):
+    '''Lazy dictionary applying a transform to the matrices read by another one
+
+    :param reader: lazy dictionary with __getitem__ (and optionally read_batch)
+    :param FeatTransform transform: transform applied to each matrix
+    '''
+
+    def __init__(self, reader, transform):
+        self.reader = reader
+        self.transform = transform
+
+    def __getitem__(self, item):
+        return self.transform(self.reader[item], item.decode('utf-8'))
+
+    def read_batch(self, items):
+        if hasattr(self.reader, 'read_batch'):
+            mats = self.reader.read_batch(items)
+        else:
+            mats = [self.reader[item] for item in items]
+        return [self.transform(mat, item.decode('utf-8')) for item, mat in zip(items, mats)]
+
+    def close(self):
+        if hasattr(self.reader, 'close'):
+            self.reader.close()
+
+
+def make_transform(cmvn=None, utt2spk=None, norm_vars=True, delta_order=0):
+    '''Make FeatTransform from the options (returns None if nothing is applied)'''
+    if cmvn is None and delta_order == 0:
+        return None
+    return FeatTransform(CMVN(cmvn, utt2spk, norm_vars) if cmvn is not None else None, delta_order)
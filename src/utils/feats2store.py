@@ -0,0 +1,34 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+# Copyright 2018 Johns Hopkins University (Shinji Watanabe)
+#  Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+# Copy Kaldi features into a consolidated feature store, which can be
+# given to asr_train.py as --train-feat store:<outdir>.
+
+import argparse
+import logging
+
+import lazy_io
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('rspecifier', type=str,
+                        help='Kaldi rspecifier of the features (e.g. scp:data/train/feats.scp)')
+    parser.add_argument('outdir', type=str,
+                        help='Output directory of the feature store')
+    parser.add_argument('--dtype', default='float32', type=str, choices=['float32', 'float16'],
+                        help='Data type of the stored features')
+    args = parser.parse_args()
+
+    # logging info
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s (%(module)s:%(lineno)d) %(levelname)s: %(message)s")
+
+    n = lazy_io.write_store(args.rspecifier, args.outdir, args.dtype)
+    logging.info('wrote %d matrices to %s' % (n, args.outdir))
+
+
+if __name__ == '__main__':
+    main()
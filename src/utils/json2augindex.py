@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+# Copyright 2018 Johns Hopkins University (Shinji Watanabe)
+#  Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+# Convert the augmenting text corpus of data.json (added by add2json.py) into
+# int32 token arrays with offsets, which are sliced with np.memmap in training
+# instead of reading and mapping the .src/.tgt lines in every minibatch.
+# The directory of the arrays is recorded in data.json as aug/index.
+
+import argparse
+import io
+import json
+import logging
+import os
+
+import lazy_io
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('json', type=str,
+                        help='data.json with the augmenting data (updated in place)')
+    parser.add_argument('outdir', type=str,
+                        help='Output directory of the token arrays')
+    args = parser.parse_args()
+
+    # logging info
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s (%(module)s:%(lineno)d) %(levelname)s: %(message)s")
+
+    with io.open(args.json, 'rb') as f:
+        data_json = json.loads(f.read().decode('utf-8'))
+    if 'aug' not in data_json:
+        raise ValueError(args.json + ' has no augmenting data (see add2json.py)')
+    aug = data_json['aug']
+    n = lazy_io.write_augment_index(aug['ifilename'], aug['ofilename'], aug['idict'], aug['odict'], args.outdir)
+    if n != len(aug['sentences']):
+        raise ValueError('%d sentences in %s, but %d in %s' % (n, aug['ifilename'], len(aug['sentences']), args.json))
+    aug['index'] = os.path.abspath(args.outdir)
+    with io.open(args.json, 'wb') as f:
+        f.write(json.dumps(data_json, indent=4).encode('utf-8'))
+    logging.info('wrote %d augmenting sentences to %s' % (n, args.outdir))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,38 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+# Copyright 2018 Johns Hopkins University (Shinji Watanabe)
+#  Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+# Convert data.json into a columnar manifest (numpy arrays of the lengths,
+# dims, token ids and speakers), which is loaded with mmap by asr_train.py
+# and asr_recog.py when it is given as --train-label, --valid-label or
+# --recog-label instead of data.json.
+
+import argparse
+import io
+import json
+import logging
+
+import lazy_io
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('json', type=str,
+                        help='data.json of the utterances')
+    parser.add_argument('outdir', type=str,
+                        help='Output directory of the manifest')
+    args = parser.parse_args()
+
+    # logging info
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s (%(module)s:%(lineno)d) %(levelname)s: %(message)s")
+
+    with io.open(args.json, 'rb') as f:
+        utts = json.loads(f.read().decode('utf-8'))['utts']
+    lazy_io.write_manifest(sorted(utts.items()), args.outdir)
+    logging.info('wrote %d utterances to %s' % (len(utts), args.outdir))
+
+
+if __name__ == '__main__':
+    main()
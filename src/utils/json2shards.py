@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+# Copyright 2018 Johns Hopkins University (Shinji Watanabe)
+#  Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+# Convert data.json and feats.scp into shards, i.e., sequential files of the
+# features and the json info of utterances, grouped by length buckets.
+# The shards are given to asr_train.py as --train-feat shard:<outdir>.
+
+from __future__ import division
+
+import argparse
+import io
+import json
+import logging
+import os
+
+import lazy_io
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('json', type=str,
+                        help='data.json of the utterances')
+    parser.add_argument('scp', type=str,
+                        help='feats.scp of the features')
+    parser.add_argument('outdir', type=str,
+                        help='Output directory of the shards')
+    parser.add_argument('--n-buckets', default=10, type=int,
+                        help='Number of length buckets, which have the same number of utterances')
+    parser.add_argument('--utts-per-shard', default=1000, type=int,
+                        help='Maximum number of utterances in a shard')
+    args = parser.parse_args()
+
+    # logging info
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s (%(module)s:%(lineno)d) %(levelname)s: %(message)s")
+
+    with open(args.json, 'rb') as f:
+        utts = sorted(json.load(f)['utts'].items(), key=lambda utt: int(utt[1]['ilen']))
+    reader = lazy_io.read_dict_scp(args.scp, coalesce=True)
+    if not os.path.exists(args.outdir):
+        os.makedirs(args.outdir)
+
+    shards = []
+    n_buckets = min(args.n_buckets, max(len(utts), 1))
+    for b in range(n_buckets):
+        bucket = utts[len(utts) * b // n_buckets:len(utts) * (b + 1) // n_buckets]
+        for start in range(0, len(bucket), args.utts_per_shard):
+            chunk = bucket[start:start + args.utts_per_shard]
+            mats = reader.read_batch([key.encode('utf-8') for key, _ in chunk])
+            filename = 'shard.%d.%d' % (b, start // args.utts_per_shard)
+            lazy_io.write_shard(os.path.join(args.outdir, filename),
+                                [(key, info, mat) for (key, info), mat in zip(chunk, mats)])
+            shards.append({'file': filename, 'bucket': b, 'n_utts': len(chunk),
+                           'min_ilen': int(chunk[0][1]['ilen']), 'max_ilen': int(chunk[-1][1]['ilen'])})
+    reader.close()
+
+    with io.open(os.path.join(args.outdir, 'index.json'), 'wb') as f:
+        f.write(json.dumps({'n_utts': len(utts), 'shards': shards}, indent=4).encode('utf-8'))
+    logging.info('wrote %d utterances into %d shards in %s' % (len(utts), len(shards), args.outdir))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,20 @@
 # Copyright 2017 Shigeki Karita
 #  Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+import collections
+import io
+import json
+import os
+import re
+import struct
+import threading
+
+import numpy as np
+
+import kaldi_io_py
 from kaldi_io_py import open_or_fd, read_mat, _read_mat_binary
 
+from fbank import WavFbankDict
+
 
 def read_mat_scp(file_or_fd):
     """ generator(key,mat) = read_mat_scp(file_or_fd)
@@ -28,26 +41,733 @@ def read_mat_scp(file_or_fd):
         if fd is not file_or_fd : fd.close()
 
 
+def _read_int32(fd):
+    size, value = struct.unpack('<bi', fd.read(5))
+    assert size == 4
+    return value
+
+
+def _read_compressed_mat(fd, fmt):
+    """ mat = _read_compressed_mat(fd, fmt)
+   Reads a kaldi compressed matrix (after its "CM", "CM2" or "CM3" token) and
+   decompresses it into float32 with vectorized operations.
+    """
+    min_value, value_range, rows, cols = struct.unpack('<ffii', fd.read(16))
+    if fmt == 'CM':
+        # one byte per element with per-column headers (0, 25, 75, 100 percentiles)
+        headers = np.frombuffer(fd.read(cols * 8), dtype=np.uint16).reshape(cols, 4)
+        p0, p25, p75, p100 = (min_value + value_range / 65535.0 * headers.astype(np.float32)).T[:, :, None]
+        data = np.frombuffer(fd.read(rows * cols), dtype=np.uint8).reshape(cols, rows).astype(np.float32)
+        mat = np.where(data <= 64, p0 + (p25 - p0) * data / 64.0,
+                       np.where(data <= 192, p25 + (p75 - p25) * (data - 64) / 128.0,
+                                p75 + (p100 - p75) * (data - 192) / 63.0))
+        # data is stored column by column
+        return np.ascontiguousarray(mat.T, dtype=np.float32)
+    elif fmt == 'CM2':
+        data = np.frombuffer(fd.read(rows * cols * 2), dtype=np.uint16)
+        scale = value_range / 65535.0
+    else:
+        data = np.frombuffer(fd.read(rows * cols), dtype=np.uint8)
+        scale = value_range / 255.0
+    return (min_value + scale * data.astype(np.float32)).reshape(rows, cols)
+
+
+def _read_mat_into(fd):
+    """ mat = _read_mat_into(fd)
+   Reads a binary float/double matrix at the current position of fd directly into
+   a newly allocated array, or a compressed matrix decompressed into float32.
+   Other matrix types are read by kaldi_io_py.read_mat.
+    """
+    start = fd.tell()
+    if fd.read(2) == b'\0B':
+        header = fd.read(3)
+        if header in (b'FM ', b'DM '):
+            rows = _read_int32(fd)
+            cols = _read_int32(fd)
+            mat = np.empty((rows, cols), dtype='float32' if header == b'FM ' else 'float64')
+            if fd.readinto(mat) != mat.nbytes:
+                raise IOError('unexpected end of ark file at offset %d' % start)
+            return mat
+        elif header == b'CM ':
+            return _read_compressed_mat(fd, 'CM')
+        elif header in (b'CM2', b'CM3') and fd.read(1) == b' ':
+            return _read_compressed_mat(fd, header.decode())
+    fd.seek(start)
+    return read_mat(fd)
+
+
+def _read_mat_shape(fd):
+    """ (rows, cols) = _read_mat_shape(fd)
+   Reads only the header of a binary (or compressed) matrix at the current position of fd.
+   Other matrix types are read by kaldi_io_py.read_mat.
+    """
+    start = fd.tell()
+    if fd.read(2) == b'\0B':
+        header = fd.read(3)
+        if header in (b'FM ', b'DM '):
+            return _read_int32(fd), _read_int32(fd)
+        elif header == b'CM ' or header in (b'CM2', b'CM3') and fd.read(1) == b' ':
+            return struct.unpack('<ffii', fd.read(16))[2:]
+    fd.seek(start)
+    return read_mat(fd).shape
+
+
+def parse_rxfile(rxfile):
+    """ (path, offset) or rxfile = parse_rxfile(rxfile)
+   Parses an ark specifier "path:offset" of scp. Other specifiers (e.g. pipes)
+   are returned as they are.
+    """
+    rxfile = rxfile.strip()
+    m = re.match(r'^(.+):(\d+)$', rxfile)
+    if m is None or rxfile.endswith('|'):
+        return rxfile
+    return m.group(1), int(m.group(2))
+
+
+class ArkReader(object):
+    """ Reads matrices from ark files by (path, offset).
+   Open file handles are kept in a bounded LRU pool so that the utterances
+   of the same ark are read without opening and closing the file again.
+   Each thread has its own pool, so that multiple threads can read at once.
+   max_open : maximum number of ark files kept open by each thread.
+    """
+
+    def __init__(self, max_open=32):
+        self.max_open = max_open
+        self.local = threading.local()
+        self.pools = []
+        self.lock = threading.Lock()
+
+    @property
+    def fds(self):
+        fds = getattr(self.local, 'fds', None)
+        if fds is None:
+            fds = self.local.fds = collections.OrderedDict()
+            with self.lock:
+                self.pools.append(fds)
+        return fds
+
+    def _get_fd(self, path):
+        fds = self.fds
+        fd = fds.pop(path, None)
+        if fd is None:
+            fd = io.open(path, 'rb')
+            if len(fds) >= self.max_open:
+                fds.popitem(last=False)[1].close()
+        # the most recently used handle is kept at the end
+        fds[path] = fd
+        return fd
+
+    def read(self, path, offset):
+        fd = self._get_fd(path)
+        fd.seek(offset)
+        return _read_mat_into(fd)
+
+    def read_shape(self, path, offset):
+        fd = self._get_fd(path)
+        fd.seek(offset)
+        return _read_mat_shape(fd)
+
+    def read_bytes(self, path, offset, size):
+        fd = self._get_fd(path)
+        fd.seek(offset)
+        return fd.read(size)
+
+    def close(self):
+        with self.lock:
+            for fds in self.pools:
+                for fd in fds.values():
+                    fd.close()
+                fds.clear()
+
+
 class ScpLazyDict(object):
-    def __init__(self, loader_dict):
+    """ Lazy dictionary reading kaldi matrices according to kaldi scp.
+   loader_dict : dict of key -> (ark path, offset) or any rxfile of read_mat.
+   ark_reader : ArkReader used for (ark path, offset).
+   coalesce : read the utterances adjacent in the same ark with single reads
+       in read_batch (up to max_coalesce_bytes).
+    """
+
+    def __init__(self, loader_dict, ark_reader=None, coalesce=False, max_coalesce_bytes=64 * 1024 * 1024):
         self.loader_dict = loader_dict
+        self.ark_reader = ark_reader if ark_reader is not None else ArkReader()
+        self.coalesce = coalesce
+        self.max_coalesce_bytes = max_coalesce_bytes
+        self._next_offsets = None
 
     def __getitem__(self, item):
-        return read_mat(self.loader_dict[item.decode('utf-8')])
+        rxfile = self.loader_dict[item.decode('utf-8')]
+        if isinstance(rxfile, tuple):
+            return self.ark_reader.read(*rxfile)
+        return read_mat(rxfile)
+
+    def read_batch(self, items):
+        """ mats = read_batch(items)
+       Reads the matrices of items in the order of ark files and offsets so that
+       the disk is accessed sequentially, and returns them in the order of items.
+        """
+        mats = [None] * len(items)
+        arks = []
+        for i, item in enumerate(items):
+            rxfile = self.loader_dict[item.decode('utf-8')]
+            if isinstance(rxfile, tuple):
+                arks.append((rxfile, i))
+            else:
+                mats[i] = read_mat(rxfile)
+        arks.sort()
+
+        # make runs of the utterances stored next to each other
+        runs = []
+        sizes = {}
+        for (path, offset), i in arks:
+            if self.coalesce and runs and runs[-1][0] == path \
+                    and self._next_offset(path, runs[-1][2][-1][0]) == offset \
+                    and self._end_offset(path, offset, sizes) - runs[-1][1] <= self.max_coalesce_bytes:
+                runs[-1][2].append((offset, i))
+            else:
+                runs.append((path, offset, [(offset, i)]))
+
+        for path, start, entries in runs:
+            if len(entries) == 1:
+                mats[entries[0][1]] = self.ark_reader.read(path, start)
+                continue
+            end = self._end_offset(path, entries[-1][0], sizes)
+            buf = io.BytesIO(self.ark_reader.read_bytes(path, start, end - start))
+            for offset, i in entries:
+                buf.seek(offset - start)
+                mats[i] = _read_mat_into(buf)
+        return mats
 
+    def _next_offset(self, path, offset, default=None):
+        # offset of the next utterance in the same ark, i.e., the end of the utterance
+        if self._next_offsets is None:
+            offsets = collections.defaultdict(list)
+            for rxfile in self.loader_dict.values():
+                if isinstance(rxfile, tuple):
+                    offsets[rxfile[0]].append(rxfile[1])
+            self._next_offsets = {}
+            for p, o in offsets.items():
+                o.sort()
+                self._next_offsets.update(((p, a), b) for a, b in zip(o[:-1], o[1:]))
+        return self._next_offsets.get((path, offset), default)
 
-def read_dict_scp(file_or_fd):
+    def _end_offset(self, path, offset, sizes):
+        # end of the utterance, where the size of the ark is got once per path (cached in sizes)
+        end = self._next_offset(path, offset)
+        if end is None:
+            if path not in sizes:
+                sizes[path] = os.path.getsize(path)
+            end = sizes[path]
+        return end
+
+    def close(self):
+        self.ark_reader.close()
+
+
+def read_dict_scp(file_or_fd, max_open=32, coalesce=False):
     """ ScpLazyDict = read_mat_scp(file_or_fd)
     Returns LazyScpDict with __getitem__ to read kaldi ark according to kaldi scp.
     file_or_fd : scp, gzipped scp, pipe or opened file descriptor.
+    max_open : maximum number of ark files kept open.
+    coalesce : read adjacent utterances in the same ark with single reads.
     """
     fd = open_or_fd(file_or_fd)
     d = dict()
     try:
         for line in fd:
-            key, rxfile = line.decode('utf-8').split(' ')
-            d[key] = rxfile
+            key, rxfile = line.decode('utf-8').split(' ', 1)
+            d[key] = parse_rxfile(rxfile)
     finally:
         if fd is not file_or_fd:
             fd.close()
-    return ScpLazyDict(d)
+    return ScpLazyDict(d, ArkReader(max_open), coalesce)
+
+
+class FeatStoreWriter(object):
+    """ Writes matrices into a consolidated feature store, i.e., a directory with
+   feats.bin : all the matrices as a flat float32/float16 array,
+   keys.txt : utterance keys (one per line),
+   offsets.npy, shapes.npy : element offset and (rows, cols) of each matrix,
+   meta.json : dtype of feats.bin.
+   dtype : 'float32' or 'float16'.
+    """
+
+    def __init__(self, dirname, dtype='float32'):
+        if dtype not in ('float32', 'float16'):
+            raise ValueError('dtype must be float32 or float16: ' + dtype)
+        if not os.path.exists(dirname):
+            os.makedirs(dirname)
+        self.dirname = dirname
+        self.dtype = dtype
+        self.fd = io.open(os.path.join(dirname, 'feats.bin'), 'wb')
+        self.keys = []
+        self.offsets = []
+        self.shapes = []
+        self.n_elements = 0
+
+    def write(self, key, mat):
+        mat = np.ascontiguousarray(mat, dtype=self.dtype)
+        self.fd.write(mat.tobytes())
+        self.keys.append(key)
+        self.offsets.append(self.n_elements)
+        self.shapes.append(mat.shape)
+        self.n_elements += mat.size
+
+    def close(self):
+        self.fd.close()
+        with io.open(os.path.join(self.dirname, 'keys.txt'), 'w', encoding='utf-8') as f:
+            f.writelines(u'%s\n' % key for key in self.keys)
+        np.save(os.path.join(self.dirname, 'offsets.npy'), np.array(self.offsets, dtype=np.int64))
+        np.save(os.path.join(self.dirname, 'shapes.npy'), np.array(self.shapes, dtype=np.int64).reshape(-1, 2))
+        with io.open(os.path.join(self.dirname, 'meta.json'), 'wb') as f:
+            f.write(json.dumps({'dtype': self.dtype}).encode('utf-8'))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class FeatStore(object):
+    """ Reads matrices of a consolidated feature store written by FeatStoreWriter
+   (or merged by merge_stores). Matrices are returned as slices of read-only
+   np.memmap (converted to float32 if they are stored in float16).
+   dirname : directory of the feature store.
+    """
+
+    def __init__(self, dirname):
+        with io.open(os.path.join(dirname, 'keys.txt'), 'r', encoding='utf-8') as f:
+            self.index = dict((key, i) for i, key in enumerate(f.read().splitlines()))
+        self.offsets = np.load(os.path.join(dirname, 'offsets.npy'))
+        self.shapes = np.load(os.path.join(dirname, 'shapes.npy'))
+        with io.open(os.path.join(dirname, 'meta.json'), 'rb') as f:
+            meta = json.loads(f.read().decode('utf-8'))
+        # a merged store refers to the data files of multiple stores
+        files = meta.get('files', ['feats.bin'])
+        if len(files) > 1:
+            self.file_ids = np.load(os.path.join(dirname, 'file_ids.npy'))
+        else:
+            self.file_ids = np.zeros(len(self.offsets), dtype=np.int64)
+        self.data = []
+        for filename in files:
+            filename = os.path.join(dirname, filename)
+            if os.path.getsize(filename) > 0:
+                self.data.append(np.memmap(filename, dtype=meta['dtype'], mode='r'))
+            else:
+                self.data.append(np.zeros(0, dtype=meta['dtype']))
+
+    def __len__(self):
+        return len(self.index)
+
+    def _read(self, i):
+        rows, cols = self.shapes[i]
+        data = self.data[self.file_ids[i]]
+        mat = data[self.offsets[i]:self.offsets[i] + rows * cols].reshape(rows, cols)
+        if mat.dtype != np.float32:
+            mat = mat.astype(np.float32)
+        return mat
+
+    def __getitem__(self, item):
+        return self._read(self.index[item.decode('utf-8')])
+
+    def read_batch(self, items):
+        """ mats = read_batch(items)
+       Reads the matrices of items in the order of their files and offsets and
+       returns them in the order of items.
+        """
+        indices = [self.index[item.decode('utf-8')] for item in items]
+        mats = [None] * len(items)
+        for j in sorted(range(len(items)), key=lambda j: (self.file_ids[indices[j]], self.offsets[indices[j]])):
+            mats[j] = self._read(indices[j])
+        return mats
+
+    def close(self):
+        self.data = []
+
+
+def merge_stores(dirnames, outdir):
+    """ merge_stores(dirnames, outdir)
+   Makes a feature store in outdir which refers to the data files of the stores
+   in dirnames without copying them.
+    """
+    keys, offsets, shapes, file_ids, files, dtypes = [], [], [], [], [], set()
+    if not os.path.exists(outdir):
+        os.makedirs(outdir)
+    for i, dirname in enumerate(dirnames):
+        with io.open(os.path.join(dirname, 'keys.txt'), 'r', encoding='utf-8') as f:
+            keys.extend(f.read().splitlines())
+        offsets.append(np.load(os.path.join(dirname, 'offsets.npy')))
+        shapes.append(np.load(os.path.join(dirname, 'shapes.npy')))
+        file_ids.append(np.full(len(offsets[-1]), i, dtype=np.int64))
+        with io.open(os.path.join(dirname, 'meta.json'), 'rb') as f:
+            dtypes.add(json.loads(f.read().decode('utf-8'))['dtype'])
+        files.append(os.path.relpath(os.path.join(dirname, 'feats.bin'), outdir))
+    if len(dtypes) != 1:
+        raise ValueError('stores to be merged must have the same dtype: ' + str(sorted(dtypes)))
+    with io.open(os.path.join(outdir, 'keys.txt'), 'w', encoding='utf-8') as f:
+        f.writelines(u'%s\n' % key for key in keys)
+    np.save(os.path.join(outdir, 'offsets.npy'), np.concatenate(offsets))
+    np.save(os.path.join(outdir, 'shapes.npy'), np.concatenate(shapes).reshape(-1, 2))
+    np.save(os.path.join(outdir, 'file_ids.npy'), np.concatenate(file_ids))
+    with io.open(os.path.join(outdir, 'meta.json'), 'wb') as f:
+        f.write(json.dumps({'dtype': dtypes.pop(), 'files': files}).encode('utf-8'))
+
+
+class FeatCache(object):
+    """ Caches the matrices of a lazy dictionary (e.g. ScpLazyDict) in RAM.
+   reader : lazy dictionary with __getitem__ (and optionally read_batch).
+   max_bytes : memory budget of the cached matrices.
+   policy : 'lru' evicts the least recently used matrices to keep the budget,
+       'pin' keeps the matrices read first as long as they fit in the budget
+       (suitable for a set read in the same order every epoch).
+    """
+
+    def __init__(self, reader, max_bytes, policy='lru'):
+        if policy not in ('lru', 'pin'):
+            raise ValueError('policy must be lru or pin: ' + policy)
+        self.reader = reader
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self.cache = collections.OrderedDict()
+        self.n_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def _get(self, item):
+        with self.lock:
+            mat = self.cache.get(item)
+            if mat is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                if self.policy == 'lru':
+                    # the most recently used matrix is kept at the end
+                    self.cache[item] = self.cache.pop(item)
+        return mat
+
+    def _put(self, item, mat):
+        if mat.nbytes > self.max_bytes:
+            return
+        with self.lock:
+            if item in self.cache:
+                return
+            if self.policy == 'lru':
+                while self.n_bytes + mat.nbytes > self.max_bytes:
+                    self.n_bytes -= self.cache.popitem(last=False)[1].nbytes
+            elif self.n_bytes + mat.nbytes > self.max_bytes:
+                return
+            self.cache[item] = mat
+            self.n_bytes += mat.nbytes
+
+    def __getitem__(self, item):
+        mat = self._get(item)
+        if mat is None:
+            mat = self.reader[item]
+            self._put(item, mat)
+        return mat
+
+    def read_batch(self, items):
+        """ mats = read_batch(items)
+       Returns the cached matrices and reads the others with read_batch of the reader.
+        """
+        mats = [self._get(item) for item in items]
+        missed = [j for j, mat in enumerate(mats) if mat is None]
+        if len(missed) > 0:
+            if hasattr(self.reader, 'read_batch'):
+                loaded = self.reader.read_batch([items[j] for j in missed])
+            else:
+                loaded = [self.reader[items[j]] for j in missed]
+            for j, mat in zip(missed, loaded):
+                mats[j] = mat
+                self._put(items[j], mat)
+        return mats
+
+    def hit_rate(self):
+        n = self.hits + self.misses
+        return float(self.hits) / n if n > 0 else 0.0
+
+    def __str__(self):
+        return 'hits=%d misses=%d (hit rate %.1f%%), %d matrices in %.1f MB' % (
+            self.hits, self.misses, 100.0 * self.hit_rate(), len(self.cache), self.n_bytes / 1024.0 ** 2)
+
+    def close(self):
+        self.cache.clear()
+        self.n_bytes = 0
+        if hasattr(self.reader, 'close'):
+            self.reader.close()
+
+
+MANIFEST_COLUMNS = ('ilen', 'idim', 'olen', 'odim')
+
+
+def write_manifest(utts, dirname):
+    """ n = write_manifest(utts, dirname)
+   Writes utterance dicts of data.json into a columnar manifest, i.e., a directory with
+   keys.txt : utterance keys (one per line),
+   ilen.npy, idim.npy, olen.npy, odim.npy : int32 columns,
+   tokens.npy, token_offsets.npy : int32 token ids of all the utterances and their offsets,
+   speakers.txt, spk_ids.npy : speakers and int32 speaker index of each utterance (-1 if unknown).
+   utts : iterable of (key, info) in the order to be written.
+   Returns the number of utterances.
+    """
+    if not os.path.exists(dirname):
+        os.makedirs(dirname)
+    keys, tokens = [], []
+    columns = dict((name, []) for name in MANIFEST_COLUMNS)
+    speakers, spk_ids = collections.OrderedDict(), []
+    for key, info in utts:
+        keys.append(key)
+        for name in MANIFEST_COLUMNS:
+            columns[name].append(int(info[name]))
+        tokens.append(np.array([int(t) for t in info['tokenid'].split()], dtype=np.int32))
+        spk = info.get('utt2spk')
+        spk_ids.append(speakers.setdefault(spk, len(speakers)) if spk is not None else -1)
+    with io.open(os.path.join(dirname, 'keys.txt'), 'w', encoding='utf-8') as f:
+        f.writelines(u'%s\n' % key for key in keys)
+    for name in MANIFEST_COLUMNS:
+        np.save(os.path.join(dirname, name + '.npy'), np.array(columns[name], dtype=np.int32))
+    offsets = np.zeros(len(tokens) + 1, dtype=np.int64)
+    np.cumsum([len(t) for t in tokens], out=offsets[1:])
+    np.save(os.path.join(dirname, 'tokens.npy'),
+            np.concatenate(tokens) if len(tokens) > 0 else np.zeros(0, dtype=np.int32))
+    np.save(os.path.join(dirname, 'token_offsets.npy'), offsets)
+    with io.open(os.path.join(dirname, 'speakers.txt'), 'w', encoding='utf-8') as f:
+        f.writelines(u'%s\n' % spk for spk in speakers)
+    np.save(os.path.join(dirname, 'spk_ids.npy'), np.array(spk_ids, dtype=np.int32))
+    return len(keys)
+
+
+class Manifest(object):
+    """ Reads a columnar manifest written by write_manifest with np.memmap.
+   The columns (e.g. manifest.ilen) are numpy arrays in the order of manifest.keys().
+   It can be used in place of the 'utts' dictionary of data.json for lookups:
+   manifest[key] makes the utterance dict (with 'tokenid' as a string) on demand.
+   dirname : directory of the manifest.
+    """
+
+    def __init__(self, dirname):
+        with io.open(os.path.join(dirname, 'keys.txt'), 'r', encoding='utf-8') as f:
+            self.key_list = f.read().splitlines()
+        with io.open(os.path.join(dirname, 'speakers.txt'), 'r', encoding='utf-8') as f:
+            self.speakers = f.read().splitlines()
+        for name in MANIFEST_COLUMNS + ('spk_ids',):
+            setattr(self, name, np.load(os.path.join(dirname, name + '.npy'), mmap_mode='r'))
+        self.tokens = np.load(os.path.join(dirname, 'tokens.npy'), mmap_mode='r')
+        offsets = np.load(os.path.join(dirname, 'token_offsets.npy'), mmap_mode='r')
+        self.token_starts, self.token_ends = offsets[:-1], offsets[1:]
+        self.index = None
+
+    def info(self, i):
+        """ info = info(i)
+       Returns the utterance dict of the i-th utterance for the minibatches,
+       with the token ids as 'tokenid_array' (int32 view of the token array).
+        """
+        info = {'ilen': int(self.ilen[i]), 'idim': int(self.idim[i]),
+                'olen': int(self.olen[i]), 'odim': int(self.odim[i]),
+                'tokenid_array': self.tokens[self.token_starts[i]:self.token_ends[i]]}
+        if self.spk_ids[i] >= 0:
+            info['utt2spk'] = self.speakers[self.spk_ids[i]]
+        return info
+
+    def subset(self, keys):
+        """ manifest = subset(keys)
+       Returns a manifest of the given keys sharing the token array.
+        """
+        rows = np.array([self._index()[key] for key in keys], dtype=np.int64)
+        manifest = Manifest.__new__(Manifest)
+        manifest.__dict__.update(self.__dict__)
+        manifest.key_list = [self.key_list[i] for i in rows]
+        for name in MANIFEST_COLUMNS + ('spk_ids', 'token_starts', 'token_ends'):
+            setattr(manifest, name, getattr(self, name)[rows])
+        manifest.index = None
+        return manifest
+
+    def _index(self):
+        # the key index is only made for lookups by key (e.g. in recognition)
+        if self.index is None:
+            self.index = dict((key, i) for i, key in enumerate(self.key_list))
+        return self.index
+
+    def keys(self):
+        return list(self.key_list)
+
+    def __len__(self):
+        return len(self.key_list)
+
+    def __contains__(self, key):
+        return key in self._index()
+
+    def __getitem__(self, key):
+        info = self.info(self._index()[key])
+        info['tokenid'] = ' '.join(str(t) for t in info.pop('tokenid_array'))
+        return info
+
+    def items(self):
+        for key in self.key_list:
+            yield key, self[key]
+
+
+def merge_manifests(dirnames, outdir):
+    """ merge_manifests(dirnames, outdir)
+   Concatenates the manifests in dirnames (e.g. written in parallel) into outdir.
+    """
+    if not os.path.exists(outdir):
+        os.makedirs(outdir)
+    keys, speakers = [], collections.OrderedDict()
+    columns = dict((name, []) for name in MANIFEST_COLUMNS + ('tokens', 'token_offsets', 'spk_ids'))
+    n_tokens = 0
+    for dirname in dirnames:
+        manifest = Manifest(dirname)
+        keys.extend(manifest.key_list)
+        for name in MANIFEST_COLUMNS + ('tokens',):
+            columns[name].append(np.asarray(getattr(manifest, name)))
+        columns['token_offsets'].append(np.asarray(manifest.token_starts) + n_tokens)
+        n_tokens += len(manifest.tokens)
+        spk_map = np.array([speakers.setdefault(spk, len(speakers)) for spk in manifest.speakers] + [-1],
+                           dtype=np.int32)
+        columns['spk_ids'].append(spk_map[np.asarray(manifest.spk_ids)])
+    columns['token_offsets'].append(np.array([n_tokens], dtype=np.int64))
+    with io.open(os.path.join(outdir, 'keys.txt'), 'w', encoding='utf-8') as f:
+        f.writelines(u'%s\n' % key for key in keys)
+    with io.open(os.path.join(outdir, 'speakers.txt'), 'w', encoding='utf-8') as f:
+        f.writelines(u'%s\n' % spk for spk in speakers)
+    for name, values in columns.items():
+        np.save(os.path.join(outdir, name + '.npy'), np.concatenate(values))
+
+
+def write_augment_index(ifilename, ofilename, idict, odict, dirname):
+    """ n = write_augment_index(ifilename, ofilename, idict, odict, dirname)
+   Converts the augmenting text corpus (.src/.tgt files of add2json.py) into int32 token
+   arrays of the sentences in the order of lines, i.e., a directory with
+   src.npy, src_offsets.npy : input tokens (with <s> and </s>) mapped by idict and their offsets,
+   tgt.npy, tgt_offsets.npy : output tokens (without the first "aug" token) mapped by odict
+       (<unk> for unknown tokens) and their offsets.
+   Returns the number of sentences.
+    """
+    if not os.path.exists(dirname):
+        os.makedirs(dirname)
+    srcs, tgts = [], []
+    with io.open(ifilename, 'r', encoding='utf-8') as fi, io.open(ofilename, 'r', encoding='utf-8') as fo:
+        while True:
+            iline, oline = fi.readline(), fo.readline()
+            if not iline or not oline:
+                break
+            itoks = iline.split()
+            otoks = oline.split()[1:]
+            if len(itoks) == 0 or len(otoks) == 0:
+                raise ValueError('empty augmenting sentence at line %d' % (len(srcs) + 1))
+            srcs.append([idict['<s>']] + [idict[tok] for tok in itoks] + [idict['</s>']])
+            tgts.append([odict.get(tok, odict['<unk>']) for tok in otoks])
+    for name, sentences in (('src', srcs), ('tgt', tgts)):
+        offsets = np.zeros(len(sentences) + 1, dtype=np.int64)
+        np.cumsum([len(sentence) for sentence in sentences], out=offsets[1:])
+        tokens = np.fromiter((tok for sentence in sentences for tok in sentence), dtype=np.int32, count=offsets[-1])
+        np.save(os.path.join(dirname, name + '.npy'), tokens)
+        np.save(os.path.join(dirname, name + '_offsets.npy'), offsets)
+    return len(srcs)
+
+
+class AugmentIndex(object):
+    """ Reads the token arrays of an augmenting text corpus written by write_augment_index
+   with np.memmap. src(i) and tgt(i) are the tokens of the i-th sentence (line).
+   dirname : directory of the index.
+    """
+
+    def __init__(self, dirname):
+        for name in ('src', 'tgt'):
+            setattr(self, name + '_tokens', np.load(os.path.join(dirname, name + '.npy'), mmap_mode='r'))
+            setattr(self, name + '_offsets', np.load(os.path.join(dirname, name + '_offsets.npy')))
+
+    def __len__(self):
+        return len(self.src_offsets) - 1
+
+    def src(self, i):
+        return self.src_tokens[self.src_offsets[i]:self.src_offsets[i + 1]]
+
+    def tgt(self, i):
+        return self.tgt_tokens[self.tgt_offsets[i]:self.tgt_offsets[i + 1]]
+
+
+def read_label(path):
+    """ utts = read_label(path)
+   Returns the 'utts' dictionary of a json file, or Manifest if path is a directory.
+    """
+    if os.path.isdir(path):
+        return Manifest(path)
+    with io.open(path, 'rb') as f:
+        return json.loads(f.read().decode('utf-8'))['utts']
+
+
+SHARD_MAGIC = b'SHRD'
+
+
+def write_shard(path, utts):
+    """ write_shard(path, utts)
+   Writes utterances into a shard to be read sequentially, i.e., a file of
+   b'SHRD', the length of the header (uint64), the json header with [key, info, rows, cols]
+   of each utterance, and their float32 matrices in the same order.
+   utts : list of (key, info, matrix), where info is the utterance dict of data.json.
+   The shard is written to <path>.tmp and renamed when it is completed.
+    """
+    mats = [np.ascontiguousarray(mat, dtype=np.float32) for _, _, mat in utts]
+    header = json.dumps([[key, info, mat.shape[0], mat.shape[1]]
+                         for (key, info, _), mat in zip(utts, mats)]).encode('utf-8')
+    with io.open(path + '.tmp', 'wb') as f:
+        f.write(SHARD_MAGIC + struct.pack('<Q', len(header)))
+        f.write(header)
+        for mat in mats:
+            f.write(mat.tobytes())
+    os.rename(path + '.tmp', path)
+
+
+def read_shard(path):
+    """ utts = read_shard(path)
+   Reads a whole shard written by write_shard with sequential reads.
+   Returns a list of (key, info), where info['feat'] is the matrix.
+    """
+    with io.open(path, 'rb') as f:
+        magic, header_len = f.read(4), struct.unpack('<Q', f.read(8))[0]
+        if magic != SHARD_MAGIC:
+            raise ValueError('not a shard: ' + path)
+        header = json.loads(f.read(header_len).decode('utf-8'))
+        data = np.frombuffer(f.read(), dtype=np.float32)
+    utts = []
+    offset = 0
+    for key, info, rows, cols in header:
+        info['feat'] = data[offset:offset + rows * cols].reshape(rows, cols)
+        offset += rows * cols
+        utts.append((key, info))
+    return utts
+
+
+def read_dict(rspecifier, max_open=32, coalesce=False, fbank_cache=None):
+    """ reader = read_dict(rspecifier)
+   Returns a lazy dictionary of matrices with __getitem__ and read_batch.
+   rspecifier : "store:<dir>" for a feature store written by FeatStoreWriter,
+       "wav:<data dir>" for filterbank features computed from the audio of a kaldi data directory,
+       otherwise a kaldi scp given to read_dict_scp.
+   fbank_cache : directory to cache the filterbank features of "wav:<data dir>".
+    """
+    if rspecifier.startswith('store:'):
+        return FeatStore(rspecifier[len('store:'):])
+    if rspecifier.startswith('wav:'):
+        return WavFbankDict(rspecifier[len('wav:'):], cache_dir=fbank_cache)
+    return read_dict_scp(rspecifier, max_open, coalesce)
+
+
+def write_store(rspecifier, dirname, dtype='float32'):
+    """ n = write_store(rspecifier, dirname, dtype)
+   Copies all the matrices of a kaldi scp or ark (e.g. "scp:feats.scp") into a
+   feature store and returns the number of matrices.
+    """
+    if rspecifier.startswith('scp'):
+        reader = kaldi_io_py.read_mat_scp(rspecifier)
+    else:
+        reader = kaldi_io_py.read_mat_ark(rspecifier)
+    with FeatStoreWriter(dirname, dtype) as writer:
+        for key, mat in reader:
+            writer.write(key, mat)
+    return len(writer.keys)
@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+# Copyright 2018 Johns Hopkins University (Shinji Watanabe)
+#  Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+# Merge sorted scp/text files (e.g. text, utt2spk, ilen.scp, tokenid.scp)
+# into data.json, as scp2json.py followed by mergejson.py, without loading
+# them into memory. The files are read line by line and joined on the
+# utterance key with a k-way merge, and the utterances are written as soon
+# as they are joined. The files must be sorted (LC_ALL=C) as Kaldi data
+# directories. With --nj, key ranges are merged in parallel.
+
+from __future__ import division
+
+import argparse
+import heapq
+import io
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+
+import lazy_io
+
+
+def seek_key(f, key):
+    '''Move a sorted file to the first line whose key is not less than key (binary search)'''
+    f.seek(0, os.SEEK_END)
+    lo, hi = 0, f.tell()
+    while lo < hi:
+        mid = (lo + hi) // 2
+        f.seek(mid)
+        if mid > 0:
+            # skip the line including mid
+            f.readline()
+        fields = f.readline().split()
+        if len(fields) > 0 and fields[0] < key:
+            lo = mid + 1
+        else:
+            hi = mid
+    f.seek(lo)
+    if lo > 0:
+        f.readline()
+
+
+def read_entries(path, start=None, end=None):
+    '''Generator of (key, value) of a sorted scp/text file in the key range [start, end)'''
+    with io.open(path, 'rb') as f:
+        if start is not None:
+            seek_key(f, start)
+        prev = None
+        for line in f:
+            fields = line.split()
+            if len(fields) == 0:
+                continue
+            key = fields[0]
+            if end is not None and key >= end:
+                break
+            if prev is not None and key < prev:
+                raise ValueError('%s is not sorted: %s after %s' % (path, key.decode('utf-8'), prev.decode('utf-8')))
+            prev = key
+            yield key, b' '.join(fields[1:])
+
+
+def split_keys(path, n):
+    '''Keys splitting a sorted file into about n ranges of the same size'''
+    size = os.path.getsize(path)
+    bounds = set()
+    with io.open(path, 'rb') as f:
+        for i in range(1, n):
+            f.seek(size * i // n)
+            f.readline()
+            fields = f.readline().split()
+            if len(fields) > 0:
+                bounds.add(fields[0])
+    bounds = sorted(bounds)
+    return list(zip([None] + bounds, bounds + [None]))
+
+
+def _tagged(i, entries):
+    for key, value in entries:
+        yield key, i, value
+
+
+def merge_entries(paths, names, start=None, end=None):
+    '''Generator of (key, dict of name -> value) of the keys found in all the files'''
+    streams = [_tagged(i, read_entries(path, start, end)) for i, path in enumerate(paths)]
+    for key, group in itertools.groupby(heapq.merge(*streams), key=lambda entry: entry[0]):
+        group = list(group)
+        if len(set(i for _, i, _ in group)) == len(paths):
+            yield key.decode('utf-8'), dict((names[i], value.decode('utf-8')) for _, i, value in group)
+
+
+def write_json_entries(f, entries):
+    '''Write utterances as the members of "utts" of data.json and return the number of them'''
+    n = 0
+    for key, value in entries:
+        text = json.dumps(value, indent=4, sort_keys=True, ensure_ascii=False).replace(u'\n', u'\n        ')
+        f.write(((u',\n' if n > 0 else u'') + u'        %s: %s' % (json.dumps(key, ensure_ascii=False), text))
+                .encode('utf-8'))
+        n += 1
+    return n
+
+
+def merge_range(job):
+    '''Merge a key range into a part of data.json or a manifest (run in a worker process)'''
+    paths, names, start, end, out, manifest = job
+    entries = merge_entries(paths, names, start, end)
+    if manifest:
+        return lazy_io.write_manifest(entries, out)
+    with io.open(out, 'wb') as f:
+        return write_json_entries(f, entries)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('files', type=str, nargs='+',
+                        help='sorted scp/text files, whose basenames (without .scp) are the keys in the json')
+    parser.add_argument('--nj', default=1, type=int,
+                        help='Number of processes merging key ranges in parallel')
+    parser.add_argument('--manifest', type=str, default=None,
+                        help='Write a manifest (see json2manifest.py) to this directory instead of data.json')
+    args = parser.parse_args()
+
+    # logging info
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s (%(module)s:%(lineno)d) %(levelname)s: %(message)s")
+
+    names = [os.path.basename(x)[:-len('.scp')] if x.endswith('.scp') else os.path.basename(x)
+             for x in args.files]
+    stdout = getattr(sys.stdout, 'buffer', sys.stdout)
+    if args.nj > 1:
+        # merge the key ranges into temporary parts and concatenate them
+        ranges = split_keys(args.files[0], args.nj)
+        tmpdir = tempfile.mkdtemp()
+        try:
+            outs = [os.path.join(tmpdir, 'part.%d' % i) for i in range(len(ranges))]
+            pool = multiprocessing.Pool(min(args.nj, len(ranges)))
+            counts = pool.map(merge_range, [(args.files, names, start, end, out, args.manifest is not None)
+                                            for (start, end), out in zip(ranges, outs)])
+            pool.close()
+            pool.join()
+            if args.manifest is not None:
+                lazy_io.merge_manifests(outs, args.manifest)
+            else:
+                stdout.write(b'{\n    "utts": {\n')
+                for i, out in enumerate(out for out, n in zip(outs, counts) if n > 0):
+                    if i > 0:
+                        stdout.write(b',\n')
+                    with io.open(out, 'rb') as f:
+                        shutil.copyfileobj(f, stdout)
+                stdout.write(b'\n    }\n}\n')
+        finally:
+            shutil.rmtree(tmpdir)
+        n = sum(counts)
+    elif args.manifest is not None:
+        n = lazy_io.write_manifest(merge_entries(args.files, names), args.manifest)
+    else:
+        stdout.write(b'{\n    "utts": {\n')
+        n = write_json_entries(stdout, merge_entries(args.files, names))
+        stdout.write(b'\n    }\n}\n')
+    stdout.flush()
+    logging.info('new json has ' + str(n) + ' utterances')
+
+
+if __name__ == '__main__':
+    main()
@@ -10,6 +10,7 @@ minframes=10
 maxchars=200
 minchars=-1
 nlsyms=""
+nj=1
 
 . utils/parse_options.sh || exit 1;
 
@@ -31,12 +32,12 @@ feat-to-len scp:$sdir/feats.scp ark,t:- \
 echo "remove utterances having more than $maxchars or less than $minchars characters"
 # counting number of chars
 if [ -z ${nlsyms} ]; then
-text2token.py -s 1 -n 1 $sdir/text \
+text2token.py -s 1 -n 1 --nj $nj $sdir/text \
     | awk -v maxchars="$maxchars" '{ if (NF < maxchars + 1) print }' \
     | awk -v minchars="$minchars" '{ if (NF > minchars + 1) print }' \
     | awk '{print $1}' > $odir/tmp/reclist2
 else
-text2token.py -l ${nlsyms} -s 1 -n 1 $sdir/text \
+text2token.py -l ${nlsyms} -s 1 -n 1 --nj $nj $sdir/text \
     | awk -v maxchars="$maxchars" '{ if (NF < maxchars + 1) print }' \
     | awk -v minchars="$minchars" '{ if (NF > minchars + 1) print }' \
     | awk '{print $1}' > $odir/tmp/reclist2
@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+# Copyright 2018 Johns Hopkins University (Shinji Watanabe)
+#  Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+# Score recognition results (data.*.json of asr_recog.py) without sclite.
+# CER (or TER) and WER are computed with Levenshtein alignments vectorized
+# over batches of utterances (in a process pool), and reported with the
+# substitution/deletion/insertion breakdown for each speaker as sclite.
+# The tokens are processed as json2trn.py and score_sclite.sh do.
+
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import io
+import json
+import logging
+import multiprocessing
+import re
+
+import numpy as np
+
+
+def edit_ops(refs, hyps):
+    '''Count the edit operations of the minimum edit distance alignments of pairs
+
+    The dynamic programming is run row by row for all the pairs at once
+    (insertions in a row are taken by a cumulative minimum). Among the
+    alignments with the minimum errors, the one with the fewest deletions is taken.
+
+    :param list refs: int arrays of reference tokens
+    :param list hyps: int arrays of hypothesis tokens
+    :return: (len(refs), 3) array of the numbers of substitutions, insertions and deletions
+    :rtype: numpy.ndarray
+    '''
+    n = len(refs)
+    rlens = np.array([len(r) for r in refs], dtype=np.int64)
+    hlens = np.array([len(h) for h in hyps], dtype=np.int64)
+    if n == 0:
+        return np.zeros((0, 3), dtype=np.int64)
+    max_rlen, max_hlen = int(rlens.max()), int(hlens.max())
+    # padded tokens never match
+    ref = np.full((n, max_rlen), -1, dtype=np.int64)
+    hyp = np.full((n, max_hlen), -2, dtype=np.int64)
+    for i in range(n):
+        ref[i, :rlens[i]] = refs[i]
+        hyp[i, :hlens[i]] = hyps[i]
+
+    # cost = errors * k + deletions (deletions < k), so that the errors are minimized first
+    k = max_rlen + 1
+    # int32 is enough in most cases and halves the memory traffic
+    dtype = np.int32 if (max_rlen + max_hlen + 1) * k < 2 ** 31 else np.int64
+    steps = k * np.arange(max_hlen + 1, dtype=dtype)
+    prev = np.tile(steps, (n, 1))
+    costs = prev[np.arange(n), hlens].copy()
+    for i in range(1, max_rlen + 1):
+        cur = prev + (k + 1)
+        np.minimum(cur[:, 1:], prev[:, :-1] + (hyp != ref[:, i - 1:i]) * dtype(k), out=cur[:, 1:])
+        cur = np.minimum.accumulate(cur - steps, axis=1) + steps
+        done = np.nonzero(rlens == i)[0]
+        costs[done] = cur[done, hlens[done]]
+        prev = cur
+    errors, dels = costs.astype(np.int64) // k, costs.astype(np.int64) % k
+    ins = dels + hlens - rlens
+    return np.stack([errors - ins - dels, ins, dels], axis=1)
+
+
+def _edit_ops_batch(batch):
+    return edit_ops(*batch)
+
+
+def batch_edit_ops(refs, hyps, nj=1, max_cells=2 ** 16):
+    '''edit_ops of many pairs in batches of similar lengths (in nj processes)
+
+    :param list refs: int arrays of reference tokens
+    :param list hyps: int arrays of hypothesis tokens
+    :param int nj: number of processes
+    :param int max_cells: maximum size of a row of the dynamic programming of a batch
+    :return: (len(refs), 3) array of the numbers of substitutions, insertions and deletions
+    :rtype: numpy.ndarray
+    '''
+    order = sorted(range(len(refs)), key=lambda i: (len(refs[i]), len(hyps[i])))
+    batches = []
+    start = 0
+    while start < len(order):
+        end = start + 1
+        max_hlen = len(hyps[order[start]])
+        while end < len(order):
+            max_hlen = max(max_hlen, len(hyps[order[end]]))
+            if (end - start + 1) * (max_hlen + 1) > max_cells:
+                break
+            end += 1
+        batches.append(order[start:end])
+        start = end
+    jobs = [([refs[i] for i in batch], [hyps[i] for i in batch]) for batch in batches]
+    if nj > 1 and len(jobs) > 1:
+        pool = multiprocessing.Pool(nj)
+        results = pool.map(_edit_ops_batch, jobs)
+        pool.close()
+        pool.join()
+    else:
+        results = [edit_ops(*job) for job in jobs]
+    ops = np.zeros((len(refs), 3), dtype=np.int64)
+    for batch, result in zip(batches, results):
+        ops[batch] = result
+    return ops
+
+
+def encode(seqs, vocab):
+    '''Map token sequences to int arrays (new tokens are added to vocab)'''
+    return [np.array([vocab.setdefault(token, len(vocab)) for token in seq], dtype=np.int64) for seq in seqs]
+
+
+def to_words(tokens, space='<space>'):
+    return ''.join(tokens).replace(space, ' ').split()
+
+
+def load_char_list(dict_file):
+    with io.open(dict_file, 'r', encoding='utf-8') as f:
+        char_list = [entry.split(' ')[0] for entry in f.readlines()]
+    char_list.insert(0, '<blank>')
+    char_list.append('<eos>')
+    return char_list
+
+
+def to_tokens(tokenid, char_list, nlsyms=(), bpe=False):
+    '''Tokens of a sequence of token ids as the trn files of score_sclite.sh'''
+    text = ' '.join(char_list[int(i)] for i in tokenid.split()).replace('<eos>', '')
+    if bpe:
+        text = re.sub(r'(@@ )|(@@ ?$)', '', text)
+    return [token for token in text.split() if token not in nlsyms]
+
+
+def score_table(title, spks, lens, ops):
+    '''Lines of a table of the error rates of each speaker and all the utterances
+
+    :param str title: title of the table
+    :param list spks: speaker of each utterance
+    :param numpy.ndarray lens: number of reference tokens of each utterance
+    :param numpy.ndarray ops: substitutions, insertions and deletions of each utterance
+    :return: lines of the table
+    :rtype: list
+    '''
+    names, spk_ids = np.unique(np.array(spks), return_inverse=True)
+    n_spks = len(names)
+    # columns: utterances, words, substitutions, insertions, deletions, utterances with errors
+    columns = [np.ones(len(spks)), lens, ops[:, 0], ops[:, 1], ops[:, 2], ops.sum(axis=1) > 0]
+    counts = np.stack([np.bincount(spk_ids, weights=c, minlength=n_spks) for c in columns], axis=1)
+    rows = [(name, counts[i]) for i, name in enumerate(names)] + [('Sum/Avg', counts.sum(axis=0))]
+    lines = [title,
+             '| %-12s | %6s %8s | %6s %6s %6s %6s %6s %6s |'
+             % ('SPKR', '#Snt', '#Wrd', 'Corr', 'Sub', 'Del', 'Ins', 'Err', 'S.Err')]
+    for name, (n_snt, n_wrd, sub, ins, dels, n_err_snt) in rows:
+        rate = 100.0 / max(n_wrd, 1)
+        lines.append('| %-12s | %6d %8d | %6.1f %6.1f %6.1f %6.1f %6.1f %6.1f |'
+                     % (name, n_snt, n_wrd, rate * (n_wrd - sub - dels), rate * sub, rate * dels, rate * ins,
+                        rate * (sub + ins + dels), 100.0 * n_err_snt / max(n_snt, 1)))
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('dict', type=str, help='dict')
+    parser.add_argument('jsons', type=str, nargs='+', help='result jsons (e.g. data.*.json of asr_recog.py)')
+    parser.add_argument('--nlsyms', type=str, default=None,
+                        help='Non-linguistic symbols excluded from the scoring (as filt.py -v)')
+    parser.add_argument('--bpe', default=0, type=int, choices=[0, 1],
+                        help='Join the BPE units (@@) of the tokens')
+    parser.add_argument('--wer', default=0, type=int, choices=[0, 1],
+                        help='Compute WER (words are split by <space>) in addition to CER')
+    parser.add_argument('--nj', default=1, type=int,
+                        help='Number of processes to compute the alignments')
+    args = parser.parse_args()
+
+    # logging info
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s (%(module)s:%(lineno)d) %(levelname)s: %(message)s")
+
+    char_list = load_char_list(args.dict)
+    nlsyms = set()
+    if args.nlsyms is not None:
+        with io.open(args.nlsyms, 'r', encoding='utf-8') as f:
+            nlsyms = set(line.strip() for line in f)
+    utts = {}
+    for x in args.jsons:
+        with io.open(x, 'rb') as f:
+            utts.update(json.loads(f.read().decode('utf-8'))['utts'])
+    keys = sorted(utts.keys())
+    logging.info('scoring %d utterances' % len(keys))
+
+    spks = [utts[k].get('utt2spk', 'unknown') for k in keys]
+    refs = [to_tokens(utts[k]['tokenid'], char_list, nlsyms, args.bpe) for k in keys]
+    hyps = [to_tokens(utts[k]['rec_tokenid'], char_list, nlsyms, args.bpe) for k in keys]
+    units = [('CER (or TER)', refs, hyps)]
+    if args.wer:
+        units.append(('WER', [to_words(ref) for ref in refs], [to_words(hyp) for hyp in hyps]))
+    for title, ref_seqs, hyp_seqs in units:
+        vocab = {}
+        ops = batch_edit_ops(encode(ref_seqs, vocab), encode(hyp_seqs, vocab), args.nj)
+        lens = np.array([len(ref) for ref in ref_seqs], dtype=np.int64)
+        print('\n'.join(score_table(title, spks, lens, ops)))
+
+
+if __name__ == '__main__':
+    main()
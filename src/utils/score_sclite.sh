@@ -8,6 +8,7 @@
 nlsyms=""
 wer=false
 bpe=false
+sclite=true # score with score_recog.py (without sclite) if false
 
 . utils/parse_options.sh
 
@@ -19,6 +20,19 @@ fi
 dir=$1
 dic=$2
 
+if ! ${sclite}; then
+    # score the result jsons directly (CER, and WER with --wer true, in ${dir}/result.txt)
+    opts=""
+    if [ ! -z ${nlsyms} ]; then
+        opts="--nlsyms ${nlsyms}"
+    fi
+    score_recog.py ${opts} --bpe $(${bpe} && echo 1 || echo 0) --wer $(${wer} && echo 1 || echo 0) \
+        ${dic} ${dir}/data.*.json > ${dir}/result.txt
+    echo "write a CER (or TER) and WER result in ${dir}/result.txt"
+    grep -e Sum/Avg -e SPKR -e CER -e WER ${dir}/result.txt
+    exit 0
+fi
+
 concatjson.py ${dir}/data.*.json > ${dir}/data.json
 json2trn.py ${dir}/data.json ${dic} ${dir}/ref.trn ${dir}/hyp.trn
 
@@ -1,23 +1,98 @@
-#!/usr/bin/env python2
+#!/usr/bin/env python
+# encoding: utf-8
 
 # Copyright 2017 Johns Hopkins University (Shinji Watanabe)
 #  Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
 
-import sys
 import argparse
+import io
+import itertools
+import multiprocessing
 import re
+import sys
 
 
-def exist_or_not(i, match_pos):
-    start_pos = None
-    end_pos = None
-    for pos in match_pos:
-        if pos[0] <= i < pos[1]:
-            start_pos = pos[0]
-            end_pos = pos[1]
-            break
-
-    return start_pos, end_pos
+class Tokenizer(object):
+    '''Split text into characters (or groups of nchar characters) keeping non-linguistic symbols
+
+    All the symbols are matched by a single regex alternation. When symbols overlap
+    at the same position, the one listed first wins.
+
+    :param int nchar: number of characters (or symbols) in a token
+    :param int skip_ncols: number of the first columns (e.g. utterance id) kept as they are
+    :param str space: symbol of the space
+    :param list non_lang_syms: non-linguistic symbols, e.g., <NOISE>
+    :param dict token2id: token to id mapping to make token ids (None not to make them)
+    :param str oov: token mapped to unknown tokens
+    '''
+
+    def __init__(self, nchar=1, skip_ncols=0, space=u'<space>', non_lang_syms=(), token2id=None, oov=u'<unk>'):
+        self.nchar = nchar
+        self.skip_ncols = skip_ncols
+        self.space = space
+        non_lang_syms = [x for x in non_lang_syms if len(x) > 0]
+        if len(non_lang_syms) > 0:
+            self.pattern = re.compile(u'|'.join(re.escape(x) for x in non_lang_syms))
+        else:
+            self.pattern = None
+        self.plain_units = all(u' ' not in x for x in non_lang_syms)
+        self.token2id = token2id
+        if token2id is not None:
+            if oov not in token2id:
+                raise ValueError('%s is not in the dictionary' % oov)
+            self.oov_id = token2id[oov]
+
+    def tokenize(self, text):
+        if self.pattern is None:
+            units = text
+        else:
+            units = []
+            pos = 0
+            for m in self.pattern.finditer(text):
+                units.extend(text[pos:m.start()])
+                units.append(m.group())
+                pos = m.end()
+            units.extend(text[pos:])
+        n = self.nchar
+        if n == 1 and self.plain_units:
+            # each unit is a token, and only the space character is replaced
+            return [self.space if unit == u' ' else unit for unit in units]
+        return [u''.join(units[i:i + n]).replace(u' ', self.space) for i in range(0, len(units), n)]
+
+    def __call__(self, line):
+        '''Tokenize a line of text
+
+        :param unicode line: line of text
+        :return: line of the tokens and that of the token ids (None if token2id is not given)
+        :rtype: tuple
+        '''
+        x = line.split()
+        tokens = self.tokenize(u' '.join(x[self.skip_ncols:]))
+        # the skipped columns and the tokens are always separated by a space as the original print
+        token_line = u' '.join(x[:self.skip_ncols]) + u' ' + u' '.join(tokens)
+        if self.token2id is None:
+            return token_line, None
+        ids = [str(self.token2id.get(token, self.oov_id)) for token in tokens]
+        return token_line, u' '.join(x[:self.skip_ncols] + ids)
+
+
+_tokenizer = None
+
+
+def set_tokenizer(tokenizer):
+    '''Set the tokenizer of the process (sent to each worker process once)'''
+    global _tokenizer
+    _tokenizer = tokenizer
+
+
+def tokenize_chunk(lines):
+    '''Tokenize a chunk of lines (run in a worker process)'''
+    return [_tokenizer(line.decode('utf-8')) for line in lines]
+
+
+def read_dict(path):
+    with io.open(path, 'r', encoding='utf-8') as f:
+        return dict((sym, int(i)) for sym, i in (line.split() for line in f if line.strip()))
 
 
 def main():
@@ -31,61 +106,60 @@ def main():
                         help='space symbol')
     parser.add_argument('--non-lang-syms', '-l', default=None, type=str,
                         help='list of non-linguistic symobles, e.g., <NOISE> etc.')
+    parser.add_argument('--nj', default=1, type=int,
+                        help='number of processes tokenizing chunks of lines in parallel')
+    parser.add_argument('--chunk-size', default=10000, type=int,
+                        help='number of lines tokenized at once by a process')
+    parser.add_argument('--dict', default=None, type=str,
+                        help='dictionary (token id per line) to write the token ids with --tokenid')
+    parser.add_argument('--oov', default='<unk>', type=str,
+                        help='token of the out-of-vocabulary tokens in --dict')
+    parser.add_argument('--tokenid', default=None, type=str,
+                        help='output file of the token ids (as sym2int.pl -f <skip-ncols + 1>-)')
     parser.add_argument('text', type=str, default=False, nargs='?',
                         help='input text')
     args = parser.parse_args()
 
-    rs = []
+    if (args.dict is None) != (args.tokenid is None):
+        parser.error('--dict and --tokenid must be given together')
+
+    nls = []
     if args.non_lang_syms is not None:
-        with open(args.non_lang_syms, 'r') as f:
-            nls = [unicode(x.rstrip(), 'utf_8') for x in f.readlines()]
-            rs = [re.compile(re.escape(x)) for x in nls]
+        with io.open(args.non_lang_syms, 'r', encoding='utf-8') as f:
+            nls = [x.rstrip() for x in f]
+    token2id = read_dict(args.dict) if args.dict is not None else None
+    # command line arguments are bytes in python2
+    space, oov = [x.decode('utf-8') if isinstance(x, bytes) else x for x in (args.space, args.oov)]
+    tokenizer = Tokenizer(args.nchar, args.skip_ncols, space, nls, token2id, oov)
 
     if args.text:
-        f = open(args.text)
+        f = io.open(args.text, 'rb')
     else:
-        f = sys.stdin
-    line = f.readline()
-    n = args.nchar
-    while line:
-        x = unicode(line, 'utf_8').split()
-        print ' '.join(x[:args.skip_ncols]).encode('utf_8'),
-        a = ' '.join(x[args.skip_ncols:])
-
-        # get all matched positions
-        match_pos = []
-        for r in rs:
-            i = 0
-            while i >= 0:
-                m = r.search(a, i)
-                if m:
-                    match_pos.append([m.start(), m.end()])
-                    i = m.end()
-                else:
-                    break
-
-        if len(match_pos) > 0:
-            chars = []
-            i = 0
-            while i < len(a):
-                start_pos, end_pos = exist_or_not(i, match_pos)
-                if start_pos is not None:
-                    chars.append(a[start_pos:end_pos])
-                    i = end_pos
-                else:
-                    chars.append(a[i])
-                    i += 1
-            a = chars
-
-        a = [a[i:i + n] for i in range(0, len(a), n)]
-
-        a_flat = []
-        for z in a:
-            a_flat.append("".join(z))
-
-        a_chars = [z.replace(' ', args.space) for z in a_flat]
-        print ' '.join(a_chars).encode('utf_8')
-        line = f.readline()
+        f = getattr(sys.stdin, 'buffer', sys.stdin)
+    out = getattr(sys.stdout, 'buffer', sys.stdout)
+    tokenid_out = io.open(args.tokenid, 'wb') if args.tokenid is not None else None
+
+    set_tokenizer(tokenizer)
+    pool = multiprocessing.Pool(args.nj, set_tokenizer, (tokenizer,)) if args.nj > 1 else None
+    chunks = iter(lambda: list(itertools.islice(f, args.chunk_size)), [])
+    while True:
+        # a bounded number of chunks are read at once
+        jobs = list(itertools.islice(chunks, max(args.nj, 1) * 4))
+        if len(jobs) == 0:
+            break
+        results = pool.map(tokenize_chunk, jobs) if pool is not None else [tokenize_chunk(job) for job in jobs]
+        for result in results:
+            out.write(u''.join(token_line + u'\n' for token_line, _ in result).encode('utf-8'))
+            if tokenid_out is not None:
+                tokenid_out.write(u''.join(tokenid_line + u'\n' for _, tokenid_line in result).encode('utf-8'))
+    out.flush()
+    if pool is not None:
+        pool.close()
+        pool.join()
+    if tokenid_out is not None:
+        tokenid_out.close()
+    if args.text:
+        f.close()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,179 @@
+# coding: utf-8
+
+# Copyright 2018 Johns Hopkins University (Shinji Watanabe)
+#  Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+
+import time
+
+import numpy
+import pytest
+
+
+def test_attach_token_arrays():
+    pytest.importorskip("chainer")
+    from asr_utils import attach_token_arrays
+
+    utts = [{"tokenid": "3 1 4"}, {"tokenid": ""}, {"tokenid": "15 9"}]
+    tokens, offsets = attach_token_arrays(utts)
+    assert tokens.dtype == numpy.int32
+    numpy.testing.assert_array_equal(tokens, [3, 1, 4, 15, 9])
+    numpy.testing.assert_array_equal(offsets, [0, 3, 3, 5])
+    for utt in utts:
+        numpy.testing.assert_array_equal(utt["tokenid_array"], [int(t) for t in utt["tokenid"].split()])
+
+    # a malformed token is not skipped silently
+    with pytest.raises(ValueError):
+        attach_token_arrays([{"tokenid": "3 1"}, {"tokenid": "4 x 5"}, {"tokenid": "9"}])
+
+
+def test_manifest_batchset(tmpdir):
+    pytest.importorskip("chainer")
+    pytest.importorskip("kaldi_io_py")
+    import lazy_io
+    from asr_utils import make_batchset
+
+    utts = {}
+    for i in range(20):
+        utts["utt%02d" % i] = {"ilen": str(100 * (i % 7) + 1), "idim": "83", "olen": str(i % 3 + 1),
+                               "odim": "50", "tokenid": " ".join(str(i) for _ in range(i % 3 + 1)),
+                               "utt2spk": "spk%d" % (i % 2)}
+    lazy_io.write_manifest(sorted(utts.items()), str(tmpdir))
+    manifest = lazy_io.Manifest(str(tmpdir))
+    assert manifest["utt05"] == dict(utts["utt05"], ilen=501, idim=83, olen=3, odim=50)
+
+    expected = make_batchset(utts, 4, 300, 150)
+    batches = make_batchset(manifest, 4, 300, 150)
+    assert len(batches) == len(expected)
+    for batch, exp in zip(batches, expected):
+        assert [int(info["ilen"]) for _, info in batch] == [int(info["ilen"]) for _, info in exp]
+        for key, info in batch:
+            numpy.testing.assert_array_equal(info["tokenid_array"], [int(t) for t in utts[key]["tokenid"].split()])
+
+
+def test_converter_augment_index(tmpdir):
+    pytest.importorskip("chainer")
+    import lazy_io
+    from asr_utils import converter_augment
+    from asr_utils import converter_augment_index
+
+    tmpdir.join("aug.src").write("a b c\nb\nc a\n")
+    tmpdir.join("aug.tgt").write("aug x y\naug z\naug x q y\n")
+    idict = {"<pad>": 0, "<s>": 1, "</s>": 2, "<unk>": 3, "a": 4, "b": 5, "c": 6}
+    odict = {"<unk>": 1, "x": 2, "y": 3, "z": 4}
+    ifile, ofile = str(tmpdir.join("aug.src")), str(tmpdir.join("aug.tgt"))
+    assert lazy_io.write_augment_index(ifile, ofile, idict, odict, str(tmpdir.join("index"))) == 3
+    index = lazy_io.AugmentIndex(str(tmpdir.join("index")))
+
+    offsets = [(0, 0), (6, 8), (8, 14)]
+    batch = [(str(i), {"ioffset": ioffset, "ooffset": ooffset}) for i, (ioffset, ooffset) in enumerate(offsets)]
+    with open(ifile) as fi, open(ofile) as fo:
+        expected = converter_augment([(k, dict(v)) for k, v in batch], idict, odict, fi, fo)
+    for (_, x), (_, y) in zip(converter_augment_index(batch, index), expected):
+        numpy.testing.assert_array_equal(x["feat"], y["feat"])
+        numpy.testing.assert_array_equal(x["tokenid_array"], y["tokenid_array"])
+        assert x["feat"].dtype == numpy.int64
+
+
+@pytest.mark.parametrize("n_prefetch", [0, 2])
+def test_interleaved_batch_iterator(n_prefetch):
+    chainer = pytest.importorskip("chainer")
+    from asr_utils import InterleavedBatchIterator
+
+    audio = [[("a%d" % i, {})] for i in range(3)]
+    augment = [[("t%d" % i, {}), ("t%d" % i, {})] for i in range(5)]
+    iterator = InterleavedBatchIterator(chainer.iterators.SerialIterator(audio, 1, shuffle=False),
+                                        chainer.iterators.SerialIterator(augment, 1, shuffle=False),
+                                        lambda batch: batch[0], lambda batch: batch[0], 2, n_prefetch)
+    keys = []
+    while iterator.epoch == 0:
+        batch, is_aug = iterator.next()
+        assert is_aug == batch[0][0].startswith("t")
+        assert not is_aug or not iterator.is_new_epoch
+        keys.append(batch[0][0])
+    # two augmenting minibatches per audio minibatch, and the epoch follows the audio
+    assert keys == ["t0", "t1", "a0", "t2", "t3", "a1", "t4", "t0", "a2"]
+    assert iterator.is_new_epoch
+    assert iterator.stats["audio"]["utts"] == 3
+    assert iterator.stats["augment"]["utts"] == 12
+    assert sorted(iterator.throughput()) == ["audio/utts_per_sec", "audio/wait_ratio",
+                                             "augment/utts_per_sec", "augment/wait_ratio"]
+    iterator.finalize()
+
+
+def test_interleaved_batch_iterator_serialize():
+    chainer = pytest.importorskip("chainer")
+    from asr_utils import InterleavedBatchIterator
+
+    audio = [[("a%d" % i, {})] for i in range(3)]
+    augment = [[("t%d" % i, {})] for i in range(5)]
+
+    def make_iterator():
+        return InterleavedBatchIterator(chainer.iterators.SerialIterator(audio, 1, shuffle=False),
+                                        chainer.iterators.SerialIterator(augment, 1, shuffle=False),
+                                        lambda batch: batch[0], lambda batch: batch[0], 2)
+
+    iterator = make_iterator()
+    for _ in range(4):
+        iterator.next()
+    serializer = chainer.serializers.DictionarySerializer()
+    iterator.serialize(serializer)
+    resumed = make_iterator()
+    resumed.serialize(chainer.serializers.NpzDeserializer(serializer.target))
+    assert [resumed.next()[0][0][0] for _ in range(3)] == ["t3", "a1", "t4"]
+
+    # snapshot of the audio iterator taken before the interleaving
+    audio_iter = chainer.iterators.SerialIterator(audio, 1, shuffle=False)
+    audio_iter.next()
+    serializer = chainer.serializers.DictionarySerializer()
+    audio_iter.serialize(serializer)
+    resumed = make_iterator()
+    resumed.serialize(chainer.serializers.NpzDeserializer(serializer.target))
+    assert [resumed.next()[0][0][0] for _ in range(3)] == ["t0", "t1", "a1"]
+
+
+def test_prefetch_batch_iterator_serialize():
+    chainer = pytest.importorskip("chainer")
+    from asr_utils import PrefetchBatchIterator
+
+    data = [[("a%d" % i, {})] for i in range(3)]
+    iterator = PrefetchBatchIterator(chainer.iterators.SerialIterator(data, 1, shuffle=False),
+                                     lambda batch: batch[0], 2)
+    iterator.next()
+    iterator.next()
+    while not iterator.queue.full():
+        time.sleep(0.01)
+    # the wrapped iterator is already in the next epoch
+    assert iterator.iterator.epoch == 1
+    assert iterator.epoch == 0
+    serializer = chainer.serializers.DictionarySerializer()
+    iterator.serialize(serializer)
+    # saving keeps the epoch of the returned minibatches, not of those loaded ahead
+    assert iterator.epoch == 0
+    assert iterator.epoch_detail == pytest.approx(2.0 / 3)
+    iterator.finalize()
+
+    resumed = PrefetchBatchIterator(chainer.iterators.SerialIterator(data, 1, shuffle=False),
+                                    lambda batch: batch[0], 2)
+    resumed.serialize(chainer.serializers.NpzDeserializer(serializer.target))
+    assert resumed.epoch == serializer.target["epoch"]
+    assert resumed.epoch_detail == resumed.iterator.epoch_detail
+    resumed.finalize()
+
+
+def test_check_request_feat(tmpdir):
+    pytest.importorskip("chainer")
+    from asr_utils import check_request_feat
+    from asr_utils import check_request_file
+
+    ark = tmpdir.join("feats.ark")
+    ark.write("")
+    assert check_request_feat(str(ark) + ":10") == str(ark) + ":10"
+    assert check_request_file(str(ark)) == str(ark)
+    for feat in [str(ark), "cat %s |" % ark, "%s:10 |" % ark, "$(touch x) %s:10" % ark, "%s;ls:10" % ark,
+                 str(tmpdir.join("missing.ark")) + ":10", "-n:10", None]:
+        with pytest.raises(ValueError):
+            check_request_feat(feat)
+    for wav in ["%s; ls" % ark, "`ls`", "a b.wav", str(tmpdir)]:
+        with pytest.raises(ValueError):
+            check_request_file(wav)
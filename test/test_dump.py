@@ -0,0 +1,56 @@
+# coding: utf-8
+
+# Copyright 2018 Johns Hopkins University (Shinji Watanabe)
+#  Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+
+import io
+import os
+import sys
+
+import numpy
+import pytest
+
+
+def run_dump(monkeypatch, *args):
+    import dump
+    monkeypatch.setattr(sys, 'argv', ['dump.py'] + list(args))
+    dump.main()
+
+
+def test_dump_resume_only_same_layout(tmpdir, monkeypatch):
+    kaldi_io_py = pytest.importorskip("kaldi_io_py")
+
+    ark = str(tmpdir.join("src.ark"))
+    with open(ark, "wb") as f, io.open(str(tmpdir.join("src.scp")), "w", encoding="utf-8") as g:
+        for i in range(10):
+            f.write(("utt%02d " % i).encode("utf-8"))
+            g.write(u"utt%02d %s:%d\n" % (i, ark, f.tell()))
+            kaldi_io_py.write_mat(f, numpy.random.randn(5 + i, 3).astype(numpy.float32))
+    stats = numpy.zeros((2, 4))
+    stats[0, 3] = 10
+    stats[1, :3] = 10
+    with open(str(tmpdir.join("cmvn.ark")), "wb") as f:
+        kaldi_io_py.write_mat(f, stats)
+    scp, cmvn, out = str(tmpdir.join("src.scp")), str(tmpdir.join("cmvn.ark")), str(tmpdir.join("out"))
+
+    run_dump(monkeypatch, scp, cmvn, out, "--nj", "3")
+    os.remove(os.path.join(out, "feats.2.scp"))
+    # resumed with the shards of the first run regardless of --nj
+    run_dump(monkeypatch, scp, cmvn, out, "--nj", "2")
+    with io.open(os.path.join(out, "feats.scp"), encoding="utf-8") as f:
+        assert [line.split()[0] for line in f] == ["utt%02d" % i for i in range(10)]
+
+    for args in [["--nshards", "5"], ["--delta-order", "2"], ["--format", "store"]]:
+        with pytest.raises(ValueError):
+            run_dump(monkeypatch, scp, cmvn, out, *args)
+    with io.open(str(tmpdir.join("small.scp")), "w", encoding="utf-8") as f, \
+            io.open(scp, encoding="utf-8") as g:
+        f.writelines(g.readlines()[:3])
+    with pytest.raises(ValueError):
+        run_dump(monkeypatch, str(tmpdir.join("small.scp")), cmvn, out)
+
+    # shards without a layout are not resumed
+    os.remove(os.path.join(out, "layout.json"))
+    with pytest.raises(ValueError):
+        run_dump(monkeypatch, scp, cmvn, out)
@@ -204,3 +204,39 @@ def test_zero_length_target(etype):
     # ]
     # ch_ctc, ch_att, ch_acc = ch_model(data)
     # th_ctc, th_att, th_acc = th_model(data)
+
+
+@pytest.mark.parametrize("etype,atype", [("blstmp", "location"), ("vggblstmp", "location"),
+                                         ("blstmp", "multi_head_loc"), ("blstmp", "dot")])
+@pytest.mark.parametrize("maxlenratio,minlenratio", [(0.0, 0.0), (0.05, 0.0), (1.0, 0.0), (1.0, 0.02)])
+def test_recognize_batch_same_as_recognize(etype, atype, maxlenratio, minlenratio):
+    pytest.importorskip('torch')
+    import e2e_asr_attctc_th as th
+    args = make_arg(etype=etype, atype=atype, aheads=4, eunits=20, eprojs=20, dunits=30, adim=20,
+                    aconv_filts=10, beam_size=1, maxlenratio=maxlenratio, minlenratio=minlenratio)
+    model = th.E2E(40, 5, args)
+    xs = [numpy.random.randn(n, 40).astype(numpy.float32) for n in [150, 80, 200, 40]]
+
+    ys = model.recognize_batch(xs, args, args.char_list)
+    for x, y in zip(xs, ys):
+        assert [int(t) for t in y] == [int(t) for t in model.recognize(x, args, args.char_list)]
+
+
+@pytest.mark.parametrize("etype,atype", [("blstmp", "location"), ("vggblstmp", "dot"), ("blstmp", "add")])
+@pytest.mark.parametrize("maxlenratio,minlenratio", [(0.0, 0.0), (0.05, 0.0), (1.0, 0.02)])
+def test_exported_greedy_same_as_e2e(tmpdir, etype, atype, maxlenratio, minlenratio):
+    torch = pytest.importorskip('torch')
+    if not hasattr(torch.jit, 'trace') or not hasattr(torch.jit, 'save'):
+        pytest.skip('tracing is not supported')
+    import e2e_asr_attctc_th as th
+    import e2e_asr_export_th as export_th
+    args = make_arg(etype=etype, atype=atype, eunits=20, eprojs=20, dunits=30, adim=20, aconv_filts=10,
+                    beam_size=1, maxlenratio=maxlenratio, minlenratio=minlenratio)
+    model = th.E2E(40, 5, args)
+    export_th.export(model, 40, str(tmpdir))
+    exported = export_th.ExportedE2E(str(tmpdir))
+
+    for n in [150, 80, 40]:
+        x = numpy.random.randn(n, 40).astype(numpy.float32)
+        assert [int(t) for t in exported.recognize(x, args, args.char_list)] == \
+            [int(t) for t in model.recognize(x, args, args.char_list)]
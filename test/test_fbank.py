@@ -0,0 +1,79 @@
+# coding: utf-8
+
+# Copyright 2018 Johns Hopkins University (Shinji Watanabe)
+#  Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+
+import math
+import wave
+
+import numpy
+import pytest
+
+
+def kaldi_fbank(x, num_bins=80, samplerate=16000):
+    # straightforward implementation of compute-fbank-feats (--dither=0)
+    frame_len, frame_step, nfft = 400, 160, 512
+
+    def mel(f):
+        return 1127.0 * math.log(1.0 + f / 700.0)
+    mel_low, mel_high = mel(20.0), mel(samplerate / 2.0)
+    delta = (mel_high - mel_low) / (num_bins + 1)
+    feats = []
+    for t in range(1 + (len(x) - frame_len) // frame_step):
+        frame = x[t * frame_step:t * frame_step + frame_len].astype(numpy.float64)
+        frame = frame - frame.mean()
+        for i in range(frame_len - 1, 0, -1):
+            frame[i] -= 0.97 * frame[i - 1]
+        frame[0] -= 0.97 * frame[0]
+        for i in range(frame_len):
+            frame[i] *= (0.5 - 0.5 * math.cos(2 * math.pi * i / (frame_len - 1))) ** 0.85
+        power = numpy.abs(numpy.fft.rfft(frame, nfft)) ** 2
+        feat = numpy.zeros(num_bins)
+        for b in range(num_bins):
+            left, center, right = mel_low + b * delta, mel_low + (b + 1) * delta, mel_low + (b + 2) * delta
+            for k in range(nfft // 2):
+                m = mel(samplerate * k / float(nfft))
+                if left < m < right:
+                    w = (m - left) / (center - left) if m <= center else (right - m) / (right - center)
+                    feat[b] += w * power[k]
+        feats.append(numpy.log(numpy.maximum(feat, numpy.finfo(numpy.float32).eps)))
+    return numpy.array(feats)
+
+
+def write_wav(path, x, samplerate=16000):
+    w = wave.open(path, "wb")
+    w.setnchannels(1)
+    w.setsampwidth(2)
+    w.setframerate(samplerate)
+    w.writeframes(x.astype("<i2").tobytes())
+    w.close()
+
+
+def test_fbank():
+    pytest.importorskip("kaldi_io_py")
+    import fbank
+
+    x = (numpy.random.randn(4000) * 1000).astype(numpy.int16)
+    y = fbank.Fbank()(x)
+    assert y.shape == (23, 80)
+    numpy.testing.assert_allclose(y, kaldi_fbank(x), rtol=1e-3, atol=1e-3)
+
+
+def test_wav_fbank_dict_with_segments(tmpdir):
+    pytest.importorskip("kaldi_io_py")
+    import fbank
+
+    x = (numpy.random.randn(32000) * 1000).astype(numpy.int16)
+    write_wav(str(tmpdir.join("reco1.wav")), x)
+    tmpdir.join("wav.scp").write("reco1 %s\n" % tmpdir.join("reco1.wav"))
+    tmpdir.join("segments").write("utt1 reco1 0.0 0.5\nutt2 reco1 0.5 1.8\n")
+
+    reader = fbank.WavFbankDict(str(tmpdir), cache_dir=str(tmpdir.join("cache")))
+    feat = reader[b"utt2"]
+    numpy.testing.assert_allclose(feat, fbank.Fbank()(x[8000:28800]), rtol=1e-5)
+    assert len(feat) == reader.fbank.num_frames(fbank.num_samples(str(tmpdir.join("reco1.wav")), 0.5, 1.8)[1])
+    # the second read comes from the cache
+    assert tmpdir.join("cache", "utt2.npy").check()
+    numpy.testing.assert_array_equal(reader[b"utt2"], feat)
+    assert [key for key, _ in reader.items()] == ["utt1", "utt2"]
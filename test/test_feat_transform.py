@@ -0,0 +1,57 @@
+# coding: utf-8
+
+# Copyright 2018 Johns Hopkins University (Shinji Watanabe)
+#  Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+
+import numpy
+import pytest
+
+
+def kaldi_deltas(x, order, window):
+    # straightforward implementation of DeltaFeatures of Kaldi
+    scales = [numpy.ones(1)]
+    for i in range(order):
+        prev = scales[-1]
+        prev_offset = (len(prev) - 1) // 2
+        cur = numpy.zeros(len(prev) + 2 * window)
+        for j in range(-window, window + 1):
+            for k in range(-prev_offset, prev_offset + 1):
+                cur[j + k + prev_offset + window] += j * prev[k + prev_offset]
+        scales.append(cur / sum(j * j for j in range(-window, window + 1)))
+    y = numpy.zeros((len(x), x.shape[1] * (order + 1)))
+    for t in range(len(x)):
+        for i, s in enumerate(scales):
+            offset = (len(s) - 1) // 2
+            for j in range(-offset, offset + 1):
+                y[t, i * x.shape[1]:(i + 1) * x.shape[1]] += s[j + offset] * x[min(max(t + j, 0), len(x) - 1)]
+    return y
+
+
+@pytest.mark.parametrize("n_frames", [1, 3, 20])
+def test_add_deltas(n_frames):
+    pytest.importorskip("kaldi_io_py")
+    import feat_transform
+
+    x = numpy.random.randn(n_frames, 5).astype(numpy.float32)
+    numpy.testing.assert_allclose(feat_transform.add_deltas(x, 2, 2), kaldi_deltas(x, 2, 2), atol=1e-5)
+
+
+def test_global_cmvn(tmpdir):
+    kaldi_io_py = pytest.importorskip("kaldi_io_py")
+    import feat_transform
+
+    feats = numpy.random.randn(100, 5) * 3 + 2
+    stats = numpy.zeros((2, 6))
+    stats[0, :5] = feats.sum(axis=0)
+    stats[0, 5] = len(feats)
+    stats[1, :5] = (feats ** 2).sum(axis=0)
+    with open(str(tmpdir.join("cmvn.ark")), "wb") as f:
+        kaldi_io_py.write_mat(f, stats)
+
+    transform = feat_transform.make_transform(str(tmpdir.join("cmvn.ark")), delta_order=2)
+    y = transform(feats.astype(numpy.float32))
+    assert y.shape == (100, 15)
+    assert y.dtype == numpy.float32
+    numpy.testing.assert_allclose(y[:, :5].mean(axis=0), 0, atol=1e-4)
+    numpy.testing.assert_allclose(y[:, :5].std(axis=0), 1, atol=1e-4)
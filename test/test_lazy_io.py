@@ -0,0 +1,251 @@
+# coding: utf-8
+
+# Copyright 2018 Johns Hopkins University (Shinji Watanabe)
+#  Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+
+import struct
+
+import numpy
+import pytest
+
+
+def write_arks(tmpdir, n_arks=3, n_utts=4):
+    kaldi_io_py = pytest.importorskip("kaldi_io_py")
+    mats = {}
+    with open(str(tmpdir.join("feats.scp")), "w") as scp:
+        for a in range(n_arks):
+            ark = str(tmpdir.join("feats.%d.ark" % a))
+            with open(ark, "wb") as f:
+                for u in range(n_utts):
+                    key = "utt%d_%d" % (a, u)
+                    mats[key] = numpy.random.randn(5 + u, 3).astype(numpy.float32)
+                    f.write((key + " ").encode())
+                    offset = f.tell()
+                    kaldi_io_py.write_mat(f, mats[key])
+                    scp.write("%s %s:%d\n" % (key, ark, offset))
+    return str(tmpdir.join("feats.scp")), mats
+
+
+def test_read_dict_scp_with_pooled_handles(tmpdir):
+    scp, mats = write_arks(tmpdir)
+    import lazy_io
+
+    reader = lazy_io.read_dict_scp(scp, max_open=2)
+    for key in sorted(mats, reverse=True):
+        numpy.testing.assert_array_equal(reader[key.encode()], mats[key])
+    assert len(reader.ark_reader.fds) == 2
+    reader.close()
+    assert len(reader.ark_reader.fds) == 0
+
+
+@pytest.mark.parametrize("coalesce", [False, True])
+def test_read_batch_keeps_the_order(tmpdir, coalesce):
+    scp, mats = write_arks(tmpdir, n_utts=6)
+    import lazy_io
+
+    reader = lazy_io.read_dict_scp(scp, coalesce=coalesce)
+    keys = sorted(mats)
+    numpy.random.shuffle(keys)
+    for key, mat in zip(keys, reader.read_batch([k.encode() for k in keys])):
+        numpy.testing.assert_array_equal(mat, mats[key])
+
+
+def count_reads(reader):
+    calls = {"read": 0, "read_bytes": 0}
+    ark_reader = reader.ark_reader
+    read, read_bytes = ark_reader.read, ark_reader.read_bytes
+
+    def counted_read(*args):
+        calls["read"] += 1
+        return read(*args)
+
+    def counted_read_bytes(*args):
+        calls["read_bytes"] += 1
+        return read_bytes(*args)
+
+    ark_reader.read, ark_reader.read_bytes = counted_read, counted_read_bytes
+    return calls
+
+
+def test_read_batch_coalesces_adjacent_utterances(tmpdir):
+    scp, mats = write_arks(tmpdir, n_arks=2, n_utts=6)
+    import lazy_io
+
+    reader = lazy_io.read_dict_scp(scp, coalesce=True)
+    calls = count_reads(reader)
+    keys = ["utt0_%d" % u for u in range(6)]
+    numpy.random.shuffle(keys)
+    # the last one is not adjacent to the others
+    keys.append("utt1_3")
+    for key, mat in zip(keys, reader.read_batch([k.encode() for k in keys])):
+        numpy.testing.assert_array_equal(mat, mats[key])
+    assert calls == {"read": 1, "read_bytes": 1}
+
+    # the runs are split to keep max_coalesce_bytes
+    reader = lazy_io.ScpLazyDict(reader.loader_dict, coalesce=True,
+                                 max_coalesce_bytes=3 * mats["utt0_5"].nbytes)
+    calls = count_reads(reader)
+    keys = ["utt0_%d" % u for u in range(6)]
+    for key, mat in zip(keys, reader.read_batch([k.encode() for k in keys])):
+        numpy.testing.assert_array_equal(mat, mats[key])
+    assert calls["read_bytes"] >= 2
+    assert calls["read"] + calls["read_bytes"] < len(keys)
+
+
+@pytest.mark.parametrize("dtype", ["float32", "float16"])
+def test_feat_store(tmpdir, dtype):
+    scp, mats = write_arks(tmpdir)
+    import lazy_io
+
+    store = str(tmpdir.join("store"))
+    assert lazy_io.write_store("scp:" + scp, store, dtype) == len(mats)
+    reader = lazy_io.read_dict("store:" + store)
+    keys = sorted(mats)
+    numpy.random.shuffle(keys)
+    atol = 0 if dtype == "float32" else 1e-2
+    for key, mat in zip(keys, reader.read_batch([k.encode() for k in keys])):
+        assert mat.dtype == numpy.float32
+        numpy.testing.assert_allclose(mat, mats[key], atol=atol)
+        numpy.testing.assert_array_equal(reader[key.encode()], mat)
+
+
+@pytest.mark.parametrize("policy", ["lru", "pin"])
+def test_feat_cache(tmpdir, policy):
+    scp, mats = write_arks(tmpdir, n_arks=1, n_utts=4)
+    import lazy_io
+
+    keys = [k.encode() for k in sorted(mats)]
+    # room for the two smallest matrices only
+    max_bytes = mats["utt0_0"].nbytes + mats["utt0_1"].nbytes
+    reader = lazy_io.FeatCache(lazy_io.read_dict_scp(scp), max_bytes, policy)
+    for _ in range(2):
+        for key, mat in zip(keys, reader.read_batch(keys)):
+            numpy.testing.assert_array_equal(mat, mats[key.decode()])
+    assert reader.n_bytes <= max_bytes
+    assert reader.hits + reader.misses == 8
+    if policy == "pin":
+        assert reader.hits == 2
+
+
+@pytest.mark.parametrize("fmt", ["CM", "CM2", "CM3"])
+def test_read_compressed_matrix(tmpdir, fmt):
+    kaldi_io_py = pytest.importorskip("kaldi_io_py")
+    import lazy_io
+
+    rows, cols, min_value, value_range = 7, 3, -2.0, 5.0
+    header = b"\0B" + fmt.encode() + b" " + struct.pack("<ffii", min_value, value_range, rows, cols)
+    if fmt == "CM":
+        percentiles = numpy.sort(numpy.random.randint(0, 65536, size=(cols, 4)), axis=1).astype(numpy.uint16)
+        data = numpy.random.randint(0, 256, size=(cols, rows)).astype(numpy.uint8)
+        body = percentiles.tobytes() + data.tobytes()
+    elif fmt == "CM2":
+        data = numpy.random.randint(0, 65536, size=(rows, cols)).astype(numpy.uint16)
+        body = data.tobytes()
+        expected = min_value + value_range * data / 65535.0
+    else:
+        data = numpy.random.randint(0, 256, size=(rows, cols)).astype(numpy.uint8)
+        body = data.tobytes()
+        expected = min_value + value_range * data / 255.0
+    with open(str(tmpdir.join("feats.ark")), "wb") as f:
+        f.write(b"utt1 " + header + body)
+    with open(str(tmpdir.join("feats.scp")), "w") as f:
+        f.write("utt1 %s:5\n" % tmpdir.join("feats.ark"))
+
+    mat = lazy_io.read_dict_scp(str(tmpdir.join("feats.scp")))[b"utt1"]
+    assert mat.dtype == numpy.float32
+    if fmt == "CM":
+        expected = kaldi_io_py.read_mat("%s:5" % tmpdir.join("feats.ark"))
+    numpy.testing.assert_allclose(mat, expected, atol=1e-5)
+    # only the header is read for the shape
+    assert lazy_io.ArkReader().read_shape(str(tmpdir.join("feats.ark")), 5) == (rows, cols)
+
+
+def test_merge_stores(tmpdir):
+    pytest.importorskip("kaldi_io_py")
+    import lazy_io
+
+    mats = {}
+    for i in range(3):
+        with lazy_io.FeatStoreWriter(str(tmpdir.join("store.%d" % i))) as writer:
+            for j in range(2):
+                key = "utt%d_%d" % (i, j)
+                mats[key] = numpy.random.randn(4 + j, 3).astype(numpy.float32)
+                writer.write(key, mats[key])
+    lazy_io.merge_stores([str(tmpdir.join("store.%d" % i)) for i in range(3)], str(tmpdir.join("store")))
+    reader = lazy_io.read_dict("store:" + str(tmpdir.join("store")))
+    assert len(reader) == len(mats)
+    for key in mats:
+        numpy.testing.assert_array_equal(reader[key.encode()], mats[key])
+
+
+def test_shard_iterator(tmpdir):
+    pytest.importorskip("kaldi_io_py")
+    pytest.importorskip("chainer")
+    import json
+    import lazy_io
+    from asr_utils import ShardIterator
+
+    mats = {}
+    shards = []
+    for s in range(3):
+        utts = []
+        for u in range(7):
+            key = "utt%d_%d" % (s, u)
+            mats[key] = numpy.random.randn(10 * s + u + 1, 3).astype(numpy.float32)
+            utts.append((key, {"ilen": len(mats[key]), "olen": 5, "tokenid": "1 2 3 4 5"}, mats[key]))
+        lazy_io.write_shard(str(tmpdir.join("shard.%d" % s)), utts)
+        shards.append({"file": "shard.%d" % s, "bucket": s, "n_utts": len(utts)})
+    tmpdir.join("index.json").write(json.dumps({"n_utts": len(mats), "shards": shards}))
+
+    iterator = ShardIterator(str(tmpdir), 4, 800, 150, buffer_size=10)
+    seen = []
+    while not iterator.is_new_epoch:
+        batch = iterator.next()[0]
+        assert len(batch) <= 4
+        for key, info in batch:
+            numpy.testing.assert_array_equal(info["feat"], mats[key])
+            seen.append(key)
+    assert sorted(seen) == sorted(mats)
+    assert iterator.epoch == 1
+
+
+def test_mergescp_key_ranges(tmpdir):
+    pytest.importorskip("kaldi_io_py")
+    import lazy_io
+    import mergescp
+
+    keys = sorted("utt%03d" % i for i in range(50))
+    tmpdir.join("text").write("".join("%s hello world %d\n" % (k, i) for i, k in enumerate(keys)))
+    tmpdir.join("utt2spk").write("".join("%s spk%d\n" % (k, i % 3) for i, k in enumerate(keys)))
+    # some utterances are missing in ilen.scp
+    tmpdir.join("ilen.scp").write("".join("%s %d\n" % (k, 100 + i) for i, k in enumerate(keys) if i % 7 != 3))
+    tmpdir.join("tokenid.scp").write("".join("%s %d %d\n" % (k, i, i + 1) for i, k in enumerate(keys)))
+    tmpdir.join("idim.scp").write("".join("%s 83\n" % k for k in keys))
+    tmpdir.join("odim.scp").write("".join("%s 52\n" % k for k in keys))
+    tmpdir.join("olen.scp").write("".join("%s 2\n" % k for k in keys))
+    paths = [str(tmpdir.join(x)) for x in ["text", "utt2spk", "ilen.scp", "idim.scp", "olen.scp", "odim.scp",
+                                           "tokenid.scp"]]
+    names = ["text", "utt2spk", "ilen", "idim", "olen", "odim", "tokenid"]
+
+    utts = list(mergescp.merge_entries(paths, names))
+    assert [k for k, _ in utts] == [k for i, k in enumerate(keys) if i % 7 != 3]
+    assert utts[0][1] == {"text": "hello world 0", "utt2spk": "spk0", "ilen": "100", "idim": "83",
+                          "olen": "2", "odim": "52", "tokenid": "0 1"}
+
+    ranges = mergescp.split_keys(paths[0], 4)
+    assert len(ranges) == 4
+    assert sum([list(mergescp.merge_entries(paths, names, start, end)) for start, end in ranges], []) == utts
+
+    dirnames = []
+    for i, (start, end) in enumerate(ranges):
+        dirnames.append(str(tmpdir.join("part.%d" % i)))
+        lazy_io.write_manifest(mergescp.merge_entries(paths, names, start, end), dirnames[-1])
+    lazy_io.merge_manifests(dirnames, str(tmpdir.join("manifest")))
+    manifest = lazy_io.Manifest(str(tmpdir.join("manifest")))
+    assert manifest.keys() == [k for k, _ in utts]
+    for key, info in utts:
+        # text is not kept in the manifest
+        info = dict(info, ilen=int(info["ilen"]), idim=83, olen=2, odim=52)
+        del info["text"]
+        assert manifest[key] == info
@@ -0,0 +1,48 @@
+# coding: utf-8
+
+# Copyright 2018 Johns Hopkins University (Shinji Watanabe)
+#  Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+
+import numpy
+import pytest
+
+from score_recog import batch_edit_ops
+from score_recog import edit_ops
+
+
+def levenshtein_ops(ref, hyp):
+    # straightforward dynamic programming on (errors, deletions, substitutions, insertions)
+    table = [[(j, 0, 0, j) for j in range(len(hyp) + 1)]]
+    for i in range(1, len(ref) + 1):
+        row = [(i, i, 0, 0)]
+        for j in range(1, len(hyp) + 1):
+            e, d, s, n = table[i - 1][j - 1]
+            m = int(ref[i - 1] != hyp[j - 1])
+            candidates = [(e + m, d, s + m, n)]
+            e, d, s, n = table[i - 1][j]
+            candidates.append((e + 1, d + 1, s, n))
+            e, d, s, n = row[j - 1]
+            candidates.append((e + 1, d, s, n + 1))
+            row.append(min(candidates, key=lambda c: (c[0], c[1])))
+        table.append(row)
+    _, d, s, n = table[-1][-1]
+    return s, n, d
+
+
+def test_edit_ops():
+    refs = [[1, 2, 3, 4], [1, 2, 3], [], [5, 5], [1, 2]]
+    hyps = [[1, 3, 4, 4, 5], [], [7, 8], [5, 5], [2, 1]]
+    ops = edit_ops([numpy.array(x) for x in refs], [numpy.array(x) for x in hyps])
+    numpy.testing.assert_array_equal(ops, [levenshtein_ops(r, h) for r, h in zip(refs, hyps)])
+    numpy.testing.assert_array_equal(ops[1], [0, 0, 3])
+    numpy.testing.assert_array_equal(ops[2], [0, 2, 0])
+
+
+@pytest.mark.parametrize("nj", [1, 2])
+def test_batch_edit_ops_random(nj):
+    rng = numpy.random.RandomState(0)
+    refs = [rng.randint(0, 4, rng.randint(0, 12)) for _ in range(200)]
+    hyps = [rng.randint(0, 4, rng.randint(0, 12)) for _ in range(200)]
+    ops = batch_edit_ops(refs, hyps, nj=nj, max_cells=64)
+    numpy.testing.assert_array_equal(ops, [levenshtein_ops(list(r), list(h)) for r, h in zip(refs, hyps)])
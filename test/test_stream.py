@@ -0,0 +1,83 @@
+# coding: utf-8
+
+# Copyright 2018 Johns Hopkins University (Shinji Watanabe)
+#  Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+
+import argparse
+import collections
+import itertools
+
+import numpy
+import pytest
+
+
+def make_arg(**kwargs):
+    defaults = dict(
+        elayers=2,
+        subsample="1_2_1",
+        etype="blstmp",
+        eunits=20,
+        eprojs=20,
+        dlayers=1,
+        dunits=30,
+        atype="location",
+        aconv_chans=10,
+        aconv_filts=10,
+        mtlalpha=0.5,
+        lsm_type="",
+        lsm_weight=0.0,
+        adim=20,
+        dropout_rate=0.0,
+        verbose=0,
+        char_list=[u"あ", u"い", u"う", u"え", u"お"],
+        outdir=None,
+    )
+    defaults.update(kwargs)
+    return argparse.Namespace(**defaults)
+
+
+@pytest.mark.parametrize("etype", ["blstm", "blstmp"])
+def test_single_chunk_equals_full_encoder(etype):
+    torch = pytest.importorskip("torch")
+    import e2e_asr_attctc_th as m
+    import e2e_asr_stream_th as s
+
+    e2e = m.E2E(40, 5, make_arg(etype=etype))
+    e2e.eval()
+    x = numpy.random.randn(50, 40).astype(numpy.float32)
+    h = torch.autograd.Variable(torch.from_numpy(x), volatile=True)
+    hs, _ = e2e.enc(h.unsqueeze(0), [50])
+
+    encoder = s.StreamingEncoder(e2e, 64, 8)
+    assert encoder.accept(x) is None
+    hs_stream = encoder.finish()
+    numpy.testing.assert_allclose(hs[0].data.numpy(), hs_stream.data.numpy(), atol=1e-5)
+
+
+def test_chunked_encoder_output_length():
+    pytest.importorskip("torch")
+    import e2e_asr_attctc_th as m
+    import e2e_asr_stream_th as s
+
+    e2e = m.E2E(40, 5, make_arg())
+    x = numpy.random.randn(51, 40).astype(numpy.float32)
+    encoder = s.StreamingEncoder(e2e, 8, 4)
+    hs = [encoder.accept(x[i:i + 5]) for i in range(0, 51, 5)] + [encoder.finish()]
+    assert sum(h.size(0) for h in hs if h is not None) == 26
+
+
+def test_ctc_prefix_beam_decoder():
+    pytest.importorskip("torch")
+    import e2e_asr_stream_th as s
+
+    lpz = numpy.log(numpy.random.dirichlet(numpy.ones(4), size=5))
+    # brute-force sum over all the paths
+    probs = collections.defaultdict(float)
+    for path in itertools.product(range(4), repeat=5):
+        seq = tuple(c for i, c in enumerate(path) if c != 0 and (i == 0 or c != path[i - 1]))
+        probs[seq] += numpy.exp(sum(lpz[t, c] for t, c in enumerate(path)))
+
+    decoder = s.CTCPrefixBeamDecoder(100)
+    decoder(lpz[:2])
+    assert tuple(decoder(lpz[2:])) == max(probs, key=probs.get)
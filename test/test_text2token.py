@@ -0,0 +1,24 @@
+# coding: utf-8
+
+# Copyright 2018 Johns Hopkins University (Shinji Watanabe)
+#  Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+
+from text2token import Tokenizer
+
+
+def test_tokenizer_non_lang_syms():
+    tokenizer = Tokenizer(skip_ncols=1, non_lang_syms=[u"<NOISE>", u"<NOISE>S", u"[laughter]"])
+    assert tokenizer(u"utt1 ab <NOISE>S c[laughter]\n") == (
+        u"utt1 a b <space> <NOISE> S <space> c [laughter]", None)
+    assert tokenizer(u"utt2\n") == (u"utt2 ", None)
+
+    tokenizer = Tokenizer(nchar=2, non_lang_syms=[u"<NOISE>"])
+    # the skipped columns are separated by a space even if there is none
+    assert tokenizer(u"ab <NOISE>c")[0] == u" ab <space><NOISE> c"
+
+
+def test_tokenizer_token_ids():
+    token2id = {u"<unk>": 1, u"<space>": 2, u"a": 3, u"b": 4}
+    tokenizer = Tokenizer(skip_ncols=1, token2id=token2id)
+    assert tokenizer(u"utt1 ab ca") == (u"utt1 a b <space> c a", u"utt1 3 4 2 1 3")